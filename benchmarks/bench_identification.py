@@ -0,0 +1,74 @@
+"""
+Compare the iterrows based identification with SubstanceLibrary matching.
+
+Run from the repository root:
+    python -m benchmarks.bench_identification
+"""
+import time
+import numpy as np
+from benchmarks.synthetic import synthetic_library
+from modules.substance_identifier import SubstanceLibrary
+
+LIBRARY_SIZES = [12, 1000, 5000]
+N_SPECTRA = 20
+PEAKS_PER_SPECTRUM = 10
+TOLERANCES = [0.002, 0.02, 0.2]
+RANDOM_SEED = 42
+
+def legacy_identify(library, pos_k0_values, neg_k0_values, tolerance):
+    """
+    The identification loop as it was in identify_substances, kept as the reference.
+    """
+    identified_substances = []
+    for _, substance in library.iterrows():
+        pos_matches = []
+        for i in range(1, 4):
+            k0_col = f'k0_pos_{i}'
+            if substance[k0_col] > 0:
+                for k0 in pos_k0_values:
+                    if abs(k0 - substance[k0_col]) <= tolerance:
+                        pos_matches.append((k0_col, k0, substance[k0_col]))
+                        break
+        neg_matches = []
+        for i in range(1, 4):
+            k0_col = f'k0_neg_{i}'
+            if substance[k0_col] > 0:
+                for k0 in neg_k0_values:
+                    if abs(k0 - substance[k0_col]) <= tolerance:
+                        neg_matches.append((k0_col, k0, substance[k0_col]))
+                        break
+        required_pos_matches = sum(1 for i in range(1, 4) if substance[f'k0_pos_{i}'] > 0)
+        required_neg_matches = sum(1 for i in range(1, 4) if substance[f'k0_neg_{i}'] > 0)
+        if (len(pos_matches) == required_pos_matches and required_pos_matches > 0) or \
+           (len(neg_matches) == required_neg_matches and required_neg_matches > 0):
+            identified_substances.append({
+                'name': substance['substance_name'],
+                'pos_matches': pos_matches,
+                'neg_matches': neg_matches
+            })
+    return identified_substances
+
+def main():
+    rng = np.random.default_rng(RANDOM_SEED)
+    spectra = [(list(rng.uniform(1.2, 2.6, size=PEAKS_PER_SPECTRUM)), list(rng.uniform(1.2, 2.6, size=PEAKS_PER_SPECTRUM)))
+               for _ in range(N_SPECTRA)]
+
+    print(f"{'library':>8}{'tolerance':>11}{'legacy [ms]':>14}{'library [ms]':>14}{'identified':>12}")
+    for size in LIBRARY_SIZES:
+        library_df = synthetic_library(size, rng)
+        library = SubstanceLibrary(library_df)
+        for tolerance in TOLERANCES:
+            start = time.perf_counter()
+            expected = [legacy_identify(library_df, pos, neg, tolerance) for pos, neg in spectra]
+            legacy_time = (time.perf_counter() - start) / N_SPECTRA
+
+            start = time.perf_counter()
+            result = [library.match(pos, neg, tolerance) for pos, neg in spectra]
+            library_time = (time.perf_counter() - start) / N_SPECTRA
+
+            assert result == expected, (size, tolerance)
+            identified = sum(len(r) for r in result)
+            print(f"{size:>8}{tolerance:>11}{legacy_time * 1e3:>14.3f}{library_time * 1e3:>14.3f}{identified:>12}")
+
+if __name__ == "__main__":
+    main()
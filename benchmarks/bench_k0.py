@@ -0,0 +1,51 @@
+"""
+Compare the per-peak K0 conversion with the vectorized and cached-axis variants.
+
+Run from the repository root:
+    python -m benchmarks.bench_k0
+"""
+import time
+import numpy as np
+from modules.ims import calculate_k0_value, calculate_k0_values, k0_axis
+
+N_MEASUREMENTS = 20000
+PEAKS_PER_MEASUREMENT = 10
+N_POINTS = 895
+N_CONDITIONS = 5  # Distinct instrument conditions, consecutive frames share them
+RANDOM_SEED = 42
+
+def main():
+    rng = np.random.default_rng(RANDOM_SEED)
+    condition = rng.integers(0, N_CONDITIONS, size=N_MEASUREMENTS)
+    temperature = (40 + rng.random(N_CONDITIONS))[condition]
+    pressure = (1030 + 10 * rng.random(N_CONDITIONS))[condition]
+    voltage = (1750 + 20 * rng.random(N_CONDITIONS))[condition]
+    tube_length = np.full(N_MEASUREMENTS, 6.14772)
+    positions = rng.integers(0, N_POINTS, size=(N_MEASUREMENTS, PEAKS_PER_MEASUREMENT))
+    rows = np.repeat(np.arange(N_MEASUREMENTS), PEAKS_PER_MEASUREMENT)
+
+    start = time.perf_counter()
+    loop = [calculate_k0_value([(p, 0.0) for p in positions[i]], temperature[i], pressure[i], voltage[i],
+                               tube_length[i]) for i in range(N_MEASUREMENTS)]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = calculate_k0_values(positions.ravel(), temperature, pressure, voltage, tube_length, rows=rows)
+    vectorized_time = time.perf_counter() - start
+
+    k0_axis.cache_clear()
+    start = time.perf_counter()
+    cached = [k0_axis(temperature[i], pressure[i], voltage[i], tube_length[i], N_POINTS)[positions[i]]
+              for i in range(N_MEASUREMENTS)]
+    cached_time = time.perf_counter() - start
+
+    assert np.array_equal(np.asarray(loop).ravel(), vectorized)
+    assert np.array_equal(np.concatenate(cached), vectorized)
+
+    print(f"{N_MEASUREMENTS} measurements x {PEAKS_PER_MEASUREMENT} peaks")
+    print(f"per-peak loop       {loop_time:8.3f} s")
+    print(f"vectorized          {vectorized_time:8.3f} s")
+    print(f"cached K0 axis      {cached_time:8.3f} s  ({k0_axis.cache_info()})")
+
+if __name__ == "__main__":
+    main()
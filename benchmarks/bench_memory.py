@@ -0,0 +1,147 @@
+"""
+Peak memory of the CLI pipeline against the number of measurements in the database.
+
+Builds databases of increasing size from a pool of synthetic alternating-polarity frames
+and runs, each in a fresh interpreter, the streaming pipeline of main.py (--no-plot) and
+the previous materialized path (select everything, pair_polarities, a list of all
+results). Prints the peak RSS and the peak anonymous memory of both and exits with
+status 1 if the anonymous peak of the streaming pipeline grows by more than
+STREAM_GROWTH_BUDGET between the smallest and the largest database.
+
+The RSS also counts the pages of the database file that SQLite maps into memory
+(mmap_size in sqlite_helper.CONNECTION_PRAGMAS), so it grows with the file up to that
+limit; the anonymous memory (/proc/self/status RssAnon, Linux only) is what the process
+itself holds, including SQLite's page cache (cache_size).
+
+Analysis takes a few ms per measurement, a million frames run for about half an hour:
+    python -m benchmarks.bench_memory --frames 1000 10000 100000 1000000 --skip-materialized
+
+Run from the repository root:
+    python -m benchmarks.bench_memory
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+import numpy as np
+from benchmarks.synthetic import synthetic_library, synthetic_measurements, csv_frame, START_TIME
+from modules import sqlite_helper
+
+DEFAULT_FRAMES = [1000, 3000, 10000]
+POOL_SIZE = 500  # Distinct synthetic frames, repeated to fill the databases
+INSERT_BATCH = 10000
+LIBRARY_SIZE = 200
+# Bytes: SQLite's page cache (cache_size in KiB when negative) fills up to its limit on a
+# large database, everything else has to stay within the headroom
+STREAM_GROWTH_BUDGET = -sqlite_helper.CONNECTION_PRAGMAS['cache_size'] * 1024 + 32 * 1024 * 1024
+RANDOM_SEED = 42
+
+SAMPLE_INTERVAL = 0.005  # Seconds between two readings of the anonymous memory
+
+# Prints the peak RSS and the peak anonymous memory in kB when the script ends
+MEMORY_PROBE = f"""
+import atexit, resource, threading, time
+
+def _anonymous_kb():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('RssAnon:'))
+
+_peak = [_anonymous_kb()]
+
+def _sample():
+    while True:
+        _peak[0] = max(_peak[0], _anonymous_kb())
+        time.sleep({SAMPLE_INTERVAL})
+
+threading.Thread(target=_sample, daemon=True).start()
+
+@atexit.register
+def _report():
+    _peak[0] = max(_peak[0], _anonymous_kb())
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, _peak[0])
+"""
+
+STREAMING_RUN = MEMORY_PROBE + """
+import contextlib, io, sys
+import main
+with contextlib.redirect_stdout(io.StringIO()):
+    main.main(['--db', sys.argv[1], '--no-plot'])
+"""
+
+MATERIALIZED_RUN = MEMORY_PROBE + """
+import sys
+from modules import sqlite_helper
+from modules.analysis import analyze_measurement
+from modules.pairing import pair_polarities
+from modules.streaming import STREAM_COLUMNS
+sqlite_helper.configure(sys.argv[1])
+merged, _ = pair_polarities(sqlite_helper.select_columns_from_db(STREAM_COLUMNS))
+results = [result for result in (analyze_measurement(row, tolerance=0.2) for row in merged.to_dict('records'))
+           if result is not None]
+"""
+
+def create_db(db_file, n, pool, library_table):
+    """
+    Write n frames into a new database, cycling through the pool with increasing times.
+    """
+    sqlite_helper.configure(db_file)
+    library_table.to_sql('library', sqlite_helper.get_engine(), index=False)
+    for first in range(0, n, INSERT_BATCH):
+        records = []
+        for i in range(first, min(n, first + INSERT_BATCH)):
+            time = START_TIME + timedelta(seconds=i)
+            record = dict(pool[i % len(pool)], measurement_time=time.strftime('%d.%m.%Y %H:%M:%S'),
+                          measurement_timestamp=time.isoformat(sep=' '))
+            records.append(record)
+        sqlite_helper.insert_measurements(records)
+    sqlite_helper.configure()
+
+def peak_memory(script, db_file):
+    """
+    Peak resident and peak anonymous memory in bytes of a script run in a fresh interpreter.
+    """
+    result = subprocess.run([sys.executable, '-c', script, db_file], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    # ru_maxrss and RssAnon are in kilobytes on Linux
+    rss, anonymous = result.stdout.strip().splitlines()[-1].split()
+    return int(rss) * 1024, int(anonymous) * 1024
+
+def format_memory(peaks):
+    return '-' if peaks is None else f"{peaks[0] / 2**20:.1f} / {peaks[1] / 2**20:.1f}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Peak memory of the streaming and the materialized pipeline.")
+    parser.add_argument("--frames", nargs='+', type=int, default=DEFAULT_FRAMES, help="Frames per database")
+    parser.add_argument("--skip-materialized", action="store_true",
+                        help="Only measure the streaming pipeline (the materialized path needs memory per frame)")
+    args = parser.parse_args(argv)
+
+    library_table = synthetic_library(LIBRARY_SIZE, np.random.default_rng(RANDOM_SEED))
+    frames = csv_frame(synthetic_measurements(POOL_SIZE, seed=RANDOM_SEED, pattern='alternating',
+                                              library=library_table))
+    pool = [sqlite_helper.measurement_record(row) for row in frames.to_dict('records')]
+
+    streaming = []
+    print(f"{'frames':>10}{'db [MB]':>10}{'streaming rss/anon [MB]':>26}{'materialized rss/anon [MB]':>29}")
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sorted(args.frames):
+            db_file = os.path.join(directory, f'frames_{n}.db')
+            create_db(db_file, n, pool, library_table)
+            streaming.append(peak_memory(STREAMING_RUN, db_file))
+            materialized = None if args.skip_materialized else peak_memory(MATERIALIZED_RUN, db_file)
+            print(f"{n:>10}{os.path.getsize(db_file) / 2**20:>10.1f}{format_memory(streaming[-1]):>26}"
+                  f"{format_memory(materialized):>29}")
+            os.remove(db_file)
+
+    growth = streaming[-1][1] - streaming[0][1]
+    failed = growth > STREAM_GROWTH_BUDGET
+    print(f"\nAnonymous memory of the streaming pipeline grew by {growth / 2**20:.1f} MB from {min(args.frames)} "
+          f"to {max(args.frames)} frames (budget {STREAM_GROWTH_BUDGET / 2**20:.0f} MB)")
+    print("Memory is bounded" if not failed else "Streaming memory grows with the number of frames")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Multi-database scan (modules.multi_db) on synthetic per-device campaign databases.
+
+Creates databases of different sizes with overlapping measurement times, scans every
+file on its own and all of them together, checks that the merged stream is ordered by
+time, tagged with source and device and complete, that the files are not changed and
+that measurements read back for the viewer match the scan, and prints the scan times. With a
+worker per file and enough CPUs the combined scan takes about as long as the largest
+file.
+
+Run from the repository root:
+    python -m benchmarks.bench_multi_db --sizes 400 200 100 100
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+import numpy as np
+from benchmarks.synthetic import synthetic_library, synthetic_measurements, csv_frame, measurement_times, START_TIME
+from modules import sqlite_helper
+from modules.multi_db import scan_database, scan_databases, print_scan_summary, ScannedMeasurements
+from modules.substance_identifier import SubstanceLibrary, DEFAULT_K0_TOLERANCE
+
+DEFAULT_SIZES = [400, 200, 100, 100]  # Frames per database
+LIBRARY_SIZE = 200
+FILE_OFFSET = timedelta(seconds=0.5)  # Frames of different files interleave in time
+RANDOM_SEED = 42
+
+def create_campaign_db(db_file, n, seed, device, library_table):
+    """
+    Write n alternating-polarity frames of one device into a new database.
+    """
+    frames = synthetic_measurements(n, seed=seed, pattern='alternating', library=library_table)
+    rows = csv_frame(frames)
+    rows['measurement_time'] = measurement_times(n, start=START_TIME + seed * FILE_OFFSET, interval=1)
+    rows['device'] = device
+    sqlite_helper.configure(db_file)
+    sqlite_helper.insert_measurements([sqlite_helper.measurement_record(row) for row in rows.to_dict('records')])
+    sqlite_helper.configure()
+
+def file_checksum(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan several synthetic databases in parallel.")
+    parser.add_argument("--sizes", nargs='+', type=int, default=DEFAULT_SIZES, help="Frames per database")
+    args = parser.parse_args(argv)
+
+    library_table = synthetic_library(LIBRARY_SIZE, np.random.default_rng(RANDOM_SEED))
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        # The library is read from the main database, the campaign files only hold measurements
+        main_db = os.path.join(directory, 'main.db')
+        sqlite_helper.configure(main_db)
+        library_table.to_sql('library', sqlite_helper.get_engine(), index=False)
+        sqlite_helper.configure()
+
+        db_files = []
+        for i, size in enumerate(args.sizes):
+            db_file = os.path.join(directory, f'campaign_{i}.db')
+            create_campaign_db(db_file, size, i, f'GDA-{i % 2}', library_table)
+            db_files.append(db_file)
+
+        sqlite_helper.configure(main_db)
+        single = []
+        for db_file in db_files:
+            start = time.perf_counter()
+            records, _, _, _ = scan_database(db_file, library_table, DEFAULT_K0_TOLERANCE)
+            single.append((time.perf_counter() - start, len(records)))
+
+        checksums = [file_checksum(db_file) for db_file in db_files]
+        start = time.perf_counter()
+        records, ranges, summary = scan_databases(db_files, tolerance=DEFAULT_K0_TOLERANCE)
+        merged = list(records)
+        elapsed = time.perf_counter() - start
+        print_scan_summary(summary, elapsed)
+        if checksums != [file_checksum(db_file) for db_file in db_files]:
+            print("Scanning changed a database file")
+            failed = True
+
+        timestamps = [result['measurement_timestamp'] for result in merged]
+        if timestamps != sorted(timestamps):
+            print("Merged results are not ordered by time")
+            failed = True
+        if len(merged) != sum(count for _, count in single):
+            print(f"Merged {len(merged)} results, the files have {sum(count for _, count in single)}")
+            failed = True
+        sources = {result['source'] for result in merged}
+        if sources != {os.path.abspath(db_file) for db_file in db_files}:
+            print("Results are missing source tags")
+            failed = True
+
+        # The viewer sequence reads the measurements back from their files
+        measurements = ScannedMeasurements(DEFAULT_K0_TOLERANCE, SubstanceLibrary(library_table), ranges)
+        for record in merged:
+            measurements.add(record)
+        engine = sqlite_helper.get_engine(read_only=True)
+        for position in np.linspace(0, len(merged) - 1, 10).astype(int):
+            result, record = measurements[position], merged[position]
+            if (result['source'], result['measurement_id'], [s['name'] for s in result['identified_substances']]) != \
+                    (record['source'], record['measurement_id'], record['substances']):
+                print(f"Measurement {position} read back differs from the scan")
+                failed = True
+        if sqlite_helper.get_engine(read_only=True) is not engine:
+            print("Reading measurements back replaced the engine of the configured database")
+            failed = True
+        measurements.close()
+
+        records, _, _ = scan_databases(db_files, tolerance=DEFAULT_K0_TOLERANCE, device='GDA-0')
+        filtered = list(records)
+        if {result['device'] for result in filtered} != {'GDA-0'} or \
+                len(filtered) != sum(count for (_, count), db_file in zip(single, db_files)
+                                     if summary[os.path.abspath(db_file)]['devices'] == ['GDA-0']):
+            print("Device filter returned other devices or missed measurements")
+            failed = True
+        sqlite_helper.configure()
+
+    print(f"\nSerial scans: largest file {max(seconds for seconds, _ in single):.2f} s, "
+          f"sum of all files {sum(seconds for seconds, _ in single):.2f} s")
+    print(f"Parallel scan of {len(db_files)} files: {elapsed:.2f} s on {os.cpu_count()} CPU(s) "
+          f"(process startup and result transfer included)")
+    print("Merged stream is complete and time-ordered" if not failed else "Check failed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Campaign overview (modules.overview) of many measurements: build, cache and render times.
+
+Feeds analysis results built from a pool of synthetic spectra into OverviewBuilder,
+checks the decimated rows against the mean and maximum of the raw spectra of every
+row, saves and loads the pyramid and renders the overview window with the Agg backend,
+once for the whole campaign and once zoomed in. Exits with status 1 if a check fails.
+
+Run from the repository root:
+    python -m benchmarks.bench_overview --measurements 100000 1000000
+"""
+import argparse
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.synthetic import synthetic_measurements, measurement_times
+
+DEFAULT_MEASUREMENTS = [10000, 100000]
+POOL_SIZE = 500
+RANDOM_SEED = 42
+
+def synthetic_results(pool, n):
+    """
+    Minimal analyze_measurement results cycling through the pool, one marker each.
+    """
+    times = measurement_times(len(pool))
+    for i in range(n):
+        spectra = pool[i % len(pool)]
+        index = int(np.argmax(spectra['pos']))
+        yield {
+            'measurement_time': times[i % len(pool)],
+            'spectrums': spectra,
+            'peaks_data': {'pos': [(index, spectra['pos'][index])], 'neg': [], 'pos_k0s': [2.0], 'neg_k0s': []},
+            'identified_substances': [{'name': f'S{i % 7}', 'pos_matches': [('k0_pos_1', 2.0, 2.0)],
+                                       'neg_matches': []}],
+        }
+
+def check_rows(overview, pool, n):
+    """
+    Compare every finest row with the mean and maximum of its raw spectra.
+    """
+    level = overview.levels[0]
+    bin_size = level['bin']
+    stack = {polarity: np.stack([spectra[polarity] for spectra in pool]).astype(np.float32)
+             for polarity in ('pos', 'neg')}
+    failed = 0
+    for row in range(len(level['pos']['max'])):
+        members = np.arange(row * bin_size, min(n, (row + 1) * bin_size)) % len(pool)
+        for polarity, spectra in stack.items():
+            rows = spectra[members]
+            if not np.array_equal(level[polarity]['max'][row], rows.max(axis=0)) or \
+                    not np.allclose(level[polarity]['mean'][row], rows.mean(axis=0), rtol=1e-4):
+                failed += 1
+    return failed
+
+def render(overview, zoom):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from modules.visualization import show_campaign_overview
+
+    start = time.perf_counter()
+    show_campaign_overview(overview)
+    fig = plt.gcf()
+    fig.canvas.draw()
+    full = time.perf_counter() - start
+    start = time.perf_counter()
+    fig.axes[0].set_xlim(*zoom)
+    fig.canvas.draw()
+    zoomed = time.perf_counter() - start
+    plt.close(fig)
+    return full, zoomed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build, cache and render campaign overviews.")
+    parser.add_argument("--measurements", nargs='+', type=int, default=DEFAULT_MEASUREMENTS)
+    args = parser.parse_args(argv)
+
+    from modules.overview import OverviewBuilder, CampaignOverview
+
+    frames = synthetic_measurements(POOL_SIZE, seed=RANDOM_SEED, pattern='both')
+    pool = [{'pos': row['pos_spectrum'], 'neg': row['neg_spectrum']} for row in frames.to_dict('records')]
+
+    failed = False
+    print(f"{'measurements':>13}{'build [s]':>11}{'rows x bin':>14}{'levels':>8}{'save+load [s]':>15}"
+          f"{'render [s]':>12}{'zoomed [s]':>12}")
+    for n in args.measurements:
+        builder = OverviewBuilder()
+        start = time.perf_counter()
+        for result in synthetic_results(pool, n):
+            builder.add(result)
+        overview = builder.finish()
+        build = time.perf_counter() - start
+
+        mismatches = check_rows(overview, pool, n)
+        if mismatches:
+            print(f"{mismatches} decimated rows differ from the raw spectra")
+            failed = True
+        if overview.markers[:, 3].max() != 6 or len(overview.substances) != 7:
+            print("Substance markers are missing")
+            failed = True
+
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            overview.save(directory)
+            loaded = CampaignOverview.load(directory)
+            cache = time.perf_counter() - start
+            if any(not np.array_equal(a[polarity]['max'], b[polarity]['max'])
+                   for a, b in zip(overview.levels, loaded.levels) for polarity in ('pos', 'neg')):
+                print("Loaded overview differs")
+                failed = True
+            full, zoomed = render(loaded, (n // 3, n // 3 + n // 100))
+
+        finest = overview.levels[0]
+        print(f"{n:>13}{build:>11.2f}{len(finest['pos']['max']):>8} x {finest['bin']:<3}{len(overview.levels):>8}"
+              f"{cache:>15.3f}{full:>12.2f}{zoomed:>12.2f}")
+
+    print("Decimated rows match the spectra" if not failed else "Check failed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
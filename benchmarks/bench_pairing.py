@@ -0,0 +1,110 @@
+"""
+Regression check and timing of pairing.pair_polarities against the original merge loop.
+
+Run from the repository root:
+    python -m benchmarks.bench_pairing
+"""
+import time
+import numpy as np
+import pandas as pd
+from modules.pairing import pair_polarities
+from modules.spectrum_codec import decode_spectrum, encode_spectrum
+
+# Positive-only rows without a later negative row are the quadratic worst case of the legacy loop
+SIZES = {
+    'alternating': [100, 1000, 3000],
+    'random': [100, 1000, 3000],
+    'positive_only': [100, 300, 600],
+}
+RANDOM_SEED = 42
+
+def legacy_merge_loop(df):
+    """
+    The merge loop as it was in main.main, kept as the reference implementation.
+    """
+    merged_data = []
+    i = 0
+    while i < len(df):
+        current_row = df.iloc[i].copy()
+        pos_spectrum_array = decode_spectrum(current_row["pos_spectrum"])
+        neg_spectrum_array = decode_spectrum(current_row["neg_spectrum"])
+
+        if not np.all(pos_spectrum_array == 0) and not np.all(neg_spectrum_array == 0):
+            merged_data.append(current_row)
+            i += 1
+            continue
+
+        if not np.all(pos_spectrum_array == 0) and np.all(neg_spectrum_array == 0):
+            next_neg_idx = -1
+            for j in range(i+1, len(df)):
+                next_neg_array = decode_spectrum(df.iloc[j]["neg_spectrum"])
+                next_pos_array = decode_spectrum(df.iloc[j]["pos_spectrum"])
+                if not np.all(next_neg_array == 0) and np.all(next_pos_array == 0):
+                    next_neg_idx = j
+                    break
+            if next_neg_idx != -1:
+                merged_row = current_row.copy()
+                merged_row["neg_spectrum"] = df.iloc[next_neg_idx]["neg_spectrum"]
+                merged_data.append(merged_row)
+                i = next_neg_idx + 1
+            else:
+                i += 1
+            continue
+
+        i += 1
+    return merged_data
+
+def synthetic_frame(n, rng, pattern):
+    """
+    Build a measurement frame with the requested polarity pattern.
+    """
+    if pattern == 'alternating':
+        has_pos = np.arange(n) % 2 == 0
+        has_neg = ~has_pos
+    elif pattern == 'positive_only':
+        has_pos = np.ones(n, dtype=bool)
+        has_neg = np.zeros(n, dtype=bool)
+    else:
+        # Random mix of pos-only, neg-only, both and empty rows with missing polarities
+        kind = rng.choice(4, size=n, p=[0.4, 0.4, 0.1, 0.1])
+        has_pos = (kind == 0) | (kind == 2)
+        has_neg = (kind == 1) | (kind == 2)
+
+    signal = encode_spectrum(np.ones(16))
+    empty = encode_spectrum(np.zeros(16))
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "pos_spectrum": [signal if p else empty for p in has_pos],
+        "neg_spectrum": [signal if q else empty for q in has_neg],
+    })
+
+def assert_same(df):
+    expected = legacy_merge_loop(df)
+    merged, unpaired = pair_polarities(df)
+    assert len(expected) == len(merged)
+    for row, (_, merged_row) in zip(expected, merged.iterrows()):
+        assert row.name == merged_row.name
+        assert row["pos_spectrum"] == merged_row["pos_spectrum"]
+        assert row["neg_spectrum"] == merged_row["neg_spectrum"]
+    return merged, unpaired
+
+def main():
+    rng = np.random.default_rng(RANDOM_SEED)
+
+    print(f"{'pattern':<15}{'rows':>8}{'legacy [s]':>14}{'paired [s]':>14}{'pairs':>8}{'unpaired':>10}")
+    for pattern, sizes in SIZES.items():
+        for n in sizes:
+            df = synthetic_frame(n, rng, pattern)
+            merged, unpaired = assert_same(df)
+
+            start = time.perf_counter()
+            legacy_merge_loop(df)
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            pair_polarities(df)
+            paired_time = time.perf_counter() - start
+            print(f"{pattern:<15}{n:>8}{legacy_time:>14.4f}{paired_time:>14.4f}{len(merged):>8}{len(unpaired):>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Compare per-spectrum peak detection with the batched 2-D path.
+
+Run from the repository root:
+    python -m benchmarks.bench_peak_detection
+"""
+import time
+import numpy as np
+from modules import sqlite_helper
+from modules.ims import process_spectrum, process_spectra_batch
+from modules.spectrum_codec import decode_spectrum, spectrum_has_signal
+
+SIZES = [100, 1000, 5000]
+NOISE_LEVEL = 2.0
+RANDOM_SEED = 42
+
+def load_spectra():
+    df = sqlite_helper.select_columns_from_db(["pos_spectrum", "neg_spectrum"])
+    blobs = [s for s in list(df["pos_spectrum"]) + list(df["neg_spectrum"]) if spectrum_has_signal(s)]
+    return np.vstack([decode_spectrum(s) for s in blobs]).astype(np.float64)
+
+def main():
+    rng = np.random.default_rng(RANDOM_SEED)
+    base = load_spectra()
+
+    print(f"{'spectra':>8}{'single [s]':>14}{'batch [s]':>14}{'speedup':>10}")
+    for n in SIZES:
+        matrix = base[rng.integers(0, len(base), size=n)] + rng.normal(0, NOISE_LEVEL, size=(n, base.shape[1]))
+
+        start = time.perf_counter()
+        single = [process_spectrum(spectrum) for spectrum in matrix]
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = process_spectra_batch(matrix)
+        batch_time = time.perf_counter() - start
+
+        # The batched records must reproduce the per-spectrum lists exactly
+        for row, peaks in enumerate(single):
+            records = batch[batch['row'] == row]
+            assert peaks == [(int(i), float(h)) for i, h in zip(records['index'], records['height'])], row
+
+        print(f"{n:>8}{single_time:>14.3f}{batch_time:>14.3f}{single_time / batch_time:>10.2f}")
+
+if __name__ == "__main__":
+    main()
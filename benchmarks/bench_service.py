@@ -0,0 +1,110 @@
+"""
+Local client for the analysis service (modules.service).
+
+Starts the service on a free localhost port with a synthetic library, checks that its
+results equal analyze_measurement, then sends single-measurement requests from several
+client threads with and without micro-batching and prints throughput, latencies and
+the mean batch size reported by /metrics.
+
+Run from the repository root:
+    python -m benchmarks.bench_service --clients 8 --requests 200
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.synthetic import synthetic_library, synthetic_measurements
+from modules.analysis import analyze_measurement
+from modules.service import create_server, analyze_remote, request_json, BATCH_WINDOW
+from modules.substance_identifier import SubstanceLibrary
+
+DEFAULT_CLIENTS = 8
+DEFAULT_REQUESTS = 200  # Per client
+LIBRARY_SIZE = 1000
+CHECK_MEASUREMENTS = 50
+TOLERANCE = 0.02
+RANDOM_SEED = 42
+
+def start_service(library, window):
+    server = create_server(port=0, library=library, tolerance=TOLERANCE, window=window)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}'
+
+def check_results(url, rows, library):
+    """
+    Compare the service results with analyze_measurement.
+
+    Returns:
+    - Number of measurements whose peaks, K0 values or substances differ
+    """
+    mismatches = 0
+    for row, remote in zip(rows, analyze_remote(rows, url)):
+        local = analyze_measurement(row, tolerance=TOLERANCE, library=library)
+        peaks = local['peaks_data']
+        same = ([substance['name'] for substance in remote['identified_substances']]
+                == [substance['name'] for substance in local['identified_substances']])
+        for polarity in ('pos', 'neg'):
+            remote_peaks = np.array(remote['peaks'][polarity]).reshape(-1, 2)
+            local_peaks = np.array(peaks[polarity]).reshape(-1, 2)
+            # Savitzky-Golay edge fits of a matrix can differ from single spectra in the last bit
+            same = (same and np.array_equal(remote_peaks[:, 0], local_peaks[:, 0])
+                    and np.allclose(remote_peaks[:, 1], local_peaks[:, 1], rtol=1e-12, atol=0)
+                    and np.allclose(remote['k0s'][polarity], peaks[f'{polarity}_k0s'], rtol=1e-12, atol=0))
+        mismatches += not same
+    return mismatches
+
+def run_clients(url, rows, clients, requests):
+    """
+    Send `requests` single-measurement requests from every client thread.
+
+    Returns:
+    - Wall time in seconds
+    """
+    def client(offset):
+        for i in range(requests):
+            analyze_remote([rows[(offset + i) % len(rows)]], url)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(0, clients * requests, requests)))
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and load-test the local analysis service.")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS, help="Concurrent client threads")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Requests per client")
+    args = parser.parse_args(argv)
+
+    library_table = synthetic_library(LIBRARY_SIZE, np.random.default_rng(RANDOM_SEED))
+    library = SubstanceLibrary(library_table)
+    rows = synthetic_measurements(max(CHECK_MEASUREMENTS, 200), seed=RANDOM_SEED, pattern='both',
+                                  library=library_table).to_dict('records')
+
+    failed = False
+    print(f"{'batch window':<14}{'requests/s':>12}{'p50 [ms]':>10}{'p95 [ms]':>10}{'p99 [ms]':>10}"
+          f"{'mean batch':>12}")
+    for window in (0.0, BATCH_WINDOW):
+        server, url = start_service(library, window)
+        try:
+            mismatches = check_results(url, rows[:CHECK_MEASUREMENTS], library)
+            if mismatches:
+                print(f"{mismatches} of {CHECK_MEASUREMENTS} results differ from analyze_measurement")
+                failed = True
+            before = request_json(url, '/metrics')
+            elapsed = run_clients(url, rows, args.clients, args.requests)
+            metrics = request_json(url, '/metrics')
+        finally:
+            server.shutdown()
+            server.server_close()
+        batches = metrics['batches'] - before['batches']
+        measurements = metrics['measurements'] - before['measurements']
+        latency = metrics['latency_ms']
+        print(f"{window * 1000:>10.0f} ms{args.clients * args.requests / elapsed:>12.0f}{latency['p50']:>10.1f}"
+              f"{latency['p95']:>10.1f}{latency['p99']:>10.1f}{measurements / batches if batches else 0:>12.1f}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
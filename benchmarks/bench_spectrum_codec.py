@@ -0,0 +1,61 @@
+"""
+Compare the legacy text spectrum storage with the binary encoding.
+
+Run from the repository root:
+    python -m benchmarks.bench_spectrum_codec [csv_file]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import pandas as pd
+from modules.spectrum_codec import encode_spectrum, decode_spectrum, decode_legacy_spectrum
+
+CSV_FILE = './data/test.csv'
+REPEATS = 20
+
+def build_db(db_file, blobs):
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE measurements (id INTEGER PRIMARY KEY, pos_spectrum BLOB, neg_spectrum BLOB)")
+    with conn:
+        conn.executemany("INSERT INTO measurements (pos_spectrum, neg_spectrum) VALUES (?, ?)", blobs)
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(db_file)
+
+def time_decode(blobs, decode):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for pos_spectrum, neg_spectrum in blobs:
+            decode(pos_spectrum)
+            decode(neg_spectrum)
+    return (time.perf_counter() - start) / (REPEATS * len(blobs) * 2)
+
+def main(csv_file=CSV_FILE):
+    df = pd.read_csv(csv_file, header=0)
+    legacy = [(p.encode('utf-8'), n.encode('utf-8')) for p, n in zip(df["pos_spectrum"], df["neg_spectrum"])]
+    arrays = [(decode_legacy_spectrum(p), decode_legacy_spectrum(n)) for p, n in legacy]
+
+    variants = {
+        'legacy text': (legacy, decode_legacy_spectrum),
+        'float32': ([(encode_spectrum(p), encode_spectrum(n)) for p, n in arrays], decode_spectrum),
+        'float32 zlib+delta': ([(encode_spectrum(p, compress=True, delta=True),
+                                 encode_spectrum(n, compress=True, delta=True)) for p, n in arrays], decode_spectrum),
+        'float64': ([(encode_spectrum(p, dtype='float64'), encode_spectrum(n, dtype='float64')) for p, n in arrays],
+                    decode_spectrum),
+    }
+
+    print(f"{len(df)} rows from {csv_file}")
+    print(f"{'format':<22}{'decode [us/spectrum]':>22}{'db size [KiB]':>16}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i, (name, (blobs, decode)) in enumerate(variants.items()):
+            # The binary decoders must reproduce the parsed text exactly
+            for (p, n), (ref_p, ref_n) in zip(blobs, arrays):
+                assert (decode(p) == ref_p).all() and (decode(n) == ref_n).all(), name
+            size = build_db(os.path.join(tmp_dir, f"bench_{i}.db"), blobs)
+            per_spectrum = time_decode(blobs, decode)
+            print(f"{name:<22}{per_spectrum * 1e6:>22.1f}{size / 1024:>16.0f}")
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,97 @@
+"""
+Import time budget of the CLI, measured with python -X importtime.
+
+Every entry point is started in a fresh interpreter. The script prints the total import
+time, the slowest top-level imports and the wall time, and exits with status 1 if a
+budget is exceeded, a heavy module is imported that the entry point doesn't need, or
+the database is touched at import time.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 5
+SLOWEST_IMPORTS = 8
+
+# name: (command arguments, import time budget in ms, modules that must not be imported)
+ENTRY_POINTS = {
+    'main.py --help': (['main.py', '--help'], 800, ['matplotlib', 'scipy', 'pandas']),
+    'import main': (['-c', 'import main'], 800, ['matplotlib', 'scipy', 'pandas']),
+    'import modules.analysis': (['-c', 'import modules.analysis'], 700, ['matplotlib', 'scipy', 'pandas']),
+    'import modules.export': (['-c', 'import modules.export'], 100, ['matplotlib', 'sqlalchemy']),
+}
+
+def parse_importtime(stderr):
+    """
+    Parse -X importtime output.
+
+    Returns:
+    - {module: (depth, cumulative microseconds)}; depth 0 are the top-level imports
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two spaces per level below the module that triggered them
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports[name.strip()] = (depth, int(cumulative))
+    return imports
+
+def loaded_modules(args, modules, env):
+    """
+    Which of the given modules an entry point imports (output and --help exit are ignored).
+    """
+    if args[0] == '-c':
+        setup = args[1]
+    else:
+        setup = (f"import contextlib, io, runpy\nsys.argv = {args!r}\n"
+                 "with contextlib.redirect_stdout(io.StringIO()):\n"
+                 "    try:\n        runpy.run_path(sys.argv[0], run_name='__main__')\n"
+                 "    except SystemExit:\n        pass")
+    probe = f"import sys\n{setup}\nprint(','.join(m for m in {modules!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, env=env).stdout
+    lines = output.strip().splitlines()
+    return lines[-1].split(',') if lines and lines[-1] else []
+
+def main():
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        # Point the database to a file that must not be created by merely importing modules
+        db_file = os.path.join(directory, 'untouched.db')
+        env = dict(os.environ, IMS_DB_FILE=db_file)
+
+        print(f"{'entry point':<26}{'imports [ms]':>14}{'budget [ms]':>13}{'wall [ms]':>11}  heavy modules")
+        for name, (args, budget, forbidden) in ENTRY_POINTS.items():
+            import_times = []
+            wall_times = []
+            for _ in range(RUNS):
+                start = time.perf_counter()
+                result = subprocess.run([sys.executable, '-X', 'importtime', *args], capture_output=True, text=True,
+                                        env=env)
+                wall_times.append(time.perf_counter() - start)
+                imports = parse_importtime(result.stderr)
+                import_times.append(sum(us for depth, us in imports.values() if depth == 0) / 1000)
+            best = min(import_times)
+            heavy = loaded_modules(args, forbidden, env)
+            over = best > budget or heavy
+            failed = failed or over
+            print(f"{name:<26}{best:>14.0f}{budget:>13}{min(wall_times) * 1000:>11.0f}  "
+                  f"{', '.join(heavy) or '-'}{'  OVER BUDGET' if over else ''}")
+            slowest = sorted(((us, module) for module, (depth, us) in imports.items() if depth <= 1), reverse=True)
+            for cumulative, module in slowest[:SLOWEST_IMPORTS]:
+                print(f"    {module:<36}{cumulative / 1000:>8.1f} ms")
+
+        if os.path.exists(db_file):
+            print("Importing the modules created the database")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
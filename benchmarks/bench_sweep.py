@@ -0,0 +1,94 @@
+"""
+Parameter sweep (modules.sweep) against rerunning the analysis for every parameter set.
+
+Checks on synthetic data that every row of the sweep table equals a full rerun with
+process_spectrum and SubstanceLibrary.match, and times the sweep with one tolerance, with
+many tolerances and the naive reruns.
+
+Run from the repository root:
+    python -m benchmarks.bench_sweep --measurements 500
+"""
+import argparse
+import itertools
+import sys
+import time
+import numpy as np
+from benchmarks.synthetic import synthetic_library, synthetic_measurements
+from modules.ims import process_spectrum, calculate_k0_value
+from modules.substance_identifier import SubstanceLibrary
+from modules.sweep import ParameterSweep
+
+DEFAULT_MEASUREMENTS = 500
+LIBRARY_SIZE = 1000
+TOLERANCES = [0.005, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2]
+SAVGOL_SETTINGS = [(9, 2), (11, 3), (15, 3)]
+HEIGHT_FRACTIONS = [0.05, 0.1, 0.2]
+RANDOM_SEED = 42
+
+def naive_counts(rows, library, tolerance, window_length, polyorder, height_fraction):
+    """
+    Identified measurements and identifications of a full rerun with one parameter set.
+    """
+    identified = identifications = 0
+    for row in rows:
+        k0s = []
+        for polarity in ('pos', 'neg'):
+            peaks = process_spectrum(row[f'{polarity}_spectrum'], window_length=window_length, polyorder=polyorder,
+                                     height_fraction=height_fraction)
+            k0s.append(calculate_k0_value(peaks, row['temperature_drift_tube'], row['pressure'],
+                                          row[f'{polarity}_voltage'], row['tube_length']))
+        substances = library.match(k0s[0], k0s[1], tolerance)
+        identified += bool(substances)
+        identifications += len(substances)
+    return identified, identifications
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the parameter sweep with full reruns.")
+    parser.add_argument("--measurements", type=int, default=DEFAULT_MEASUREMENTS)
+    args = parser.parse_args(argv)
+
+    library_table = synthetic_library(LIBRARY_SIZE, np.random.default_rng(RANDOM_SEED))
+    library = SubstanceLibrary(library_table)
+    rows = synthetic_measurements(args.measurements, seed=RANDOM_SEED, pattern='both',
+                                  library=library_table).to_dict('records')
+    combinations = len(SAVGOL_SETTINGS) * len(HEIGHT_FRACTIONS)
+
+    start = time.perf_counter()
+    ParameterSweep(rows, library=library).run(TOLERANCES[:1], SAVGOL_SETTINGS, HEIGHT_FRACTIONS)
+    one = time.perf_counter() - start
+    start = time.perf_counter()
+    table = ParameterSweep(rows, library=library).run(TOLERANCES, SAVGOL_SETTINGS, HEIGHT_FRACTIONS)
+    many = time.perf_counter() - start
+
+    # Full reruns of the largest tolerance for every smoothing and height setting
+    failed = False
+    start = time.perf_counter()
+    for (window_length, polyorder), height_fraction in itertools.product(SAVGOL_SETTINGS, HEIGHT_FRACTIONS):
+        expected = naive_counts(rows, library, TOLERANCES[-1], window_length, polyorder, height_fraction)
+        row = table[(table.savgol_window == window_length) & (table.savgol_polyorder == polyorder)
+                    & (table.height_fraction == height_fraction) & (table.tolerance == TOLERANCES[-1])].iloc[0]
+        if (row.identified_measurements, row.identifications) != expected:
+            print(f"Mismatch at {window_length}:{polyorder}, height {height_fraction}: sweep "
+                  f"{(row.identified_measurements, row.identifications)}, rerun {expected}")
+            failed = True
+    naive = time.perf_counter() - start
+    # Every tolerance of one setting, the remaining tolerances are checked against match() directly
+    for tolerance in TOLERANCES[:-1]:
+        expected = naive_counts(rows, library, tolerance, 11, 3, 0.1)
+        row = table[(table.savgol_window == 11) & (table.height_fraction == 0.1) & (table.tolerance == tolerance)]
+        if (row.identified_measurements.iloc[0], row.identifications.iloc[0]) != expected:
+            print(f"Mismatch at tolerance {tolerance}")
+            failed = True
+
+    per_rerun = naive / combinations
+    print(f"{args.measurements} measurements, {combinations} smoothing/height settings")
+    print(f"Sweep, {len(TOLERANCES[:1])} tolerance:   {one:8.2f} s ({combinations} combinations)")
+    print(f"Sweep, {len(TOLERANCES)} tolerances: {many:8.2f} s ({len(table)} combinations, "
+          f"{many / one:.2f}x the time of one tolerance)")
+    print(f"Full reruns:            {per_rerun * len(table):8.2f} s (estimated from {combinations} reruns, "
+          f"{per_rerun:.3f} s each)")
+    print("All checked combinations match" if not failed else "Results differ")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
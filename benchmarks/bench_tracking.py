@@ -0,0 +1,103 @@
+"""
+Peak tracking (modules.tracking) on synthetic drifting peaks.
+
+Every frame holds the same ions with slowly drifting K0 values, random heights and
+dropouts of up to TRACK_MAX_GAP frames, plus short-lived noise peaks. The script checks
+that every ion ends up in exactly one track that holds all of its peaks, and prints the
+time per frame for growing numbers of frames, which stays constant (linear time).
+
+Run from the repository root:
+    python -m benchmarks.bench_tracking --frames 10000 100000 1000000
+"""
+import argparse
+import sys
+import time
+import numpy as np
+from modules.tracking import PeakTracker, TRACK_K0_TOLERANCE, TRACK_MAX_GAP
+
+DEFAULT_FRAMES = [10000, 100000]
+IONS = {'pos': 6, 'neg': 4}
+K0_RANGE = (1.4, 2.6)
+K0_SPACING = 0.1  # Minimum K0 distance between ions, far more than the tolerance
+TOTAL_DRIFT = 0.02  # K0 change of an ion over the whole run
+JITTER = 0.002
+DROPOUT = 0.05  # Chance that an ion has no peak in a frame
+NOISE_PEAKS = 2  # Peaks per frame that belong to no ion
+RANDOM_SEED = 42
+
+def ion_k0s(rng, n):
+    k0s = rng.permutation(np.arange(K0_RANGE[0], K0_RANGE[1], K0_SPACING))[:n]
+    return np.sort(k0s)
+
+def run(frames, rng):
+    """
+    Track a synthetic run.
+
+    Returns:
+    - (tracker, true ion of every recorded peak (-1 for noise), seconds)
+    """
+    tracker = PeakTracker()
+    base = {polarity: ion_k0s(rng, n) for polarity, n in IONS.items()}
+    drift = {polarity: rng.choice([-1, 1], size=n) * TOTAL_DRIFT / frames for polarity, n in IONS.items()}
+    offsets = {'pos': 0, 'neg': IONS['pos']}
+    # Dropout runs are cut to TRACK_MAX_GAP frames so every ion stays a single track
+    missing = {polarity: np.zeros(n, dtype=int) for polarity, n in IONS.items()}
+    truth = []
+
+    elapsed = 0.0
+    for frame in range(frames):
+        peaks = {}
+        for polarity, n in IONS.items():
+            present = (rng.random(n) >= DROPOUT) | (missing[polarity] >= TRACK_MAX_GAP)
+            missing[polarity] = np.where(present, 0, missing[polarity] + 1)
+            k0s = base[polarity] + drift[polarity] * frame + rng.normal(0, JITTER, n)
+            ions = np.flatnonzero(present)
+            # Noise peaks lie between the ions, away from every track
+            noise = rng.uniform(K0_RANGE[0], K0_RANGE[1], NOISE_PEAKS)
+            noise = noise[np.min(np.abs(noise[:, None] - k0s[None, :]), axis=1) > 3 * TRACK_K0_TOLERANCE]
+            peaks[polarity] = (np.concatenate([k0s[ions], noise]), rng.uniform(20, 800, len(ions) + len(noise)))
+            truth.append(np.concatenate([ions + offsets[polarity], np.full(len(noise), -1)]))
+
+        start = time.perf_counter()
+        for polarity, (k0s, heights) in peaks.items():
+            tracker.add_peaks(polarity, k0s, heights)
+        tracker.end_frame()
+        elapsed += time.perf_counter() - start
+    return tracker, np.concatenate(truth), elapsed
+
+def check(tracker, truth):
+    """
+    Every ion must map to one track and every track of an ion must hold only that ion.
+    """
+    tracks = tracker.peaks['track']
+    failed = False
+    for ion in range(sum(IONS.values())):
+        ion_tracks = np.unique(tracks[truth == ion])
+        if len(ion_tracks) != 1 or np.any(truth[tracks == ion_tracks[0]] != ion):
+            print(f"Ion {ion} is split into or mixed with {len(ion_tracks)} tracks")
+            failed = True
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Track synthetic drifting peaks.")
+    parser.add_argument("--frames", nargs='+', type=int, default=DEFAULT_FRAMES)
+    args = parser.parse_args(argv)
+
+    failed = False
+    print(f"{'frames':>10}{'peaks':>11}{'tracks':>9}{'seconds':>10}{'us/frame':>10}")
+    for frames in args.frames:
+        tracker, truth, elapsed = run(frames, np.random.default_rng(RANDOM_SEED))
+        failed |= check(tracker, truth)
+        table = tracker.track_table(min_peaks=2)
+        print(f"{frames:>10}{tracker.peaks.size:>11}{tracker.tracks.size:>9}{elapsed:>10.2f}"
+              f"{elapsed / frames * 1e6:>10.1f}")
+        drift = np.abs(table['k0_drift'][np.argsort(-table['peaks'])[:sum(IONS.values())]])
+        if drift.max() > TOTAL_DRIFT + 10 * JITTER:
+            print("Track K0 drift exceeds the simulated drift")
+            failed = True
+
+    print("Every ion is one track" if not failed else "Tracking check failed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
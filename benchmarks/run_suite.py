@@ -0,0 +1,248 @@
+"""
+Benchmark suite on synthetic data with machine-readable results.
+
+Times spectrum parsing, smoothing and peak finding, K0 conversion, library matching,
+polarity pairing and database ingest at several scales and writes the results to a
+JSON file, so runs on different commits can be compared.
+
+Run from the repository root:
+    python -m benchmarks.run_suite --scales 100 1000 10000 --output bench.json
+    python -m benchmarks.run_suite --cases peaks matching --compare bench.json
+
+The core cases also run as pytest-benchmark tests (tests/test_benchmarks.py).
+
+Large scales reuse a pool of distinct generated measurements, so memory stays bounded
+even at 1e6 spectra.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import scipy
+from sqlalchemy import create_engine, insert
+from benchmarks.synthetic import synthetic_library, synthetic_measurements, csv_frame
+from modules import sqlite_helper
+from modules.ims import process_spectrum, process_spectra_batch, calculate_k0_value
+from modules.pairing import pair_polarities
+from modules.spectrum_codec import decode_spectrum, encode_spectrum
+from modules.substance_identifier import SubstanceLibrary
+
+DEFAULT_SCALES = [100, 1000, 10000]
+DEFAULT_REPEAT = 3
+DEFAULT_LIBRARY_SIZE = 1000
+POOL_SIZE = 2000  # Distinct measurements generated; larger scales cycle through them
+MATCH_TOLERANCE = 0.02
+RANDOM_SEED = 42
+# Slower cases whose time grows quickly are skipped above this scale unless requested explicitly
+SLOW_CASE_LIMIT = 100000
+
+class Pool:
+    """
+    Distinct synthetic measurements and everything derived from them that the cases need.
+    """
+
+    def __init__(self, size=POOL_SIZE, library_size=DEFAULT_LIBRARY_SIZE, seed=RANDOM_SEED):
+        rng = np.random.default_rng(seed)
+        self.library_table = synthetic_library(library_size, rng)
+        self.library = SubstanceLibrary(self.library_table)
+        self.measurements = synthetic_measurements(size, seed=seed, pattern='both', library=self.library_table)
+        self.size = size
+
+        self.matrix = np.vstack(self.measurements['pos_spectrum'].to_list())
+        self.text_blobs = [str(spectrum.tolist()) for spectrum in self.measurements['pos_spectrum']]
+        self.binary_blobs = [encode_spectrum(spectrum) for spectrum in self.measurements['pos_spectrum']]
+        self.csv_rows = csv_frame(self.measurements).to_dict('records')
+
+        self.conditions = self.measurements[['temperature_drift_tube', 'pressure', 'pos_voltage', 'neg_voltage',
+                                             'tube_length']].to_dict('records')
+        self.peaks = {'pos': [], 'neg': []}
+        self.k0s = {'pos': [], 'neg': []}
+        for row, conditions in zip(self.measurements.to_dict('records'), self.conditions):
+            for polarity in ('pos', 'neg'):
+                peaks = process_spectrum(row[f'{polarity}_spectrum'])
+                self.peaks[polarity].append(peaks)
+                self.k0s[polarity].append(calculate_k0_value(
+                    peaks, conditions['temperature_drift_tube'], conditions['pressure'],
+                    conditions[f'{polarity}_voltage'], conditions['tube_length']))
+
+    def cycle(self, items, n):
+        return [items[i % self.size] for i in range(n)]
+
+def case_parse_text(pool, n):
+    blobs = pool.cycle(pool.text_blobs, n)
+    return lambda: [decode_spectrum(blob) for blob in blobs]
+
+def case_parse_binary(pool, n):
+    blobs = pool.cycle(pool.binary_blobs, n)
+    return lambda: [decode_spectrum(blob) for blob in blobs]
+
+def case_peaks(pool, n):
+    def run():
+        for start in range(0, n, pool.size):
+            process_spectra_batch(pool.matrix[:min(pool.size, n - start)])
+    return run
+
+def case_k0(pool, n):
+    peaks = pool.cycle(pool.peaks['pos'], n)
+    conditions = pool.cycle(pool.conditions, n)
+
+    def run():
+        for spectrum_peaks, c in zip(peaks, conditions):
+            calculate_k0_value(spectrum_peaks, c['temperature_drift_tube'], c['pressure'], c['pos_voltage'],
+                               c['tube_length'])
+    return run
+
+def case_matching(pool, n):
+    pos = pool.cycle(pool.k0s['pos'], n)
+    neg = pool.cycle(pool.k0s['neg'], n)
+    return lambda: [pool.library.match(p, q, MATCH_TOLERANCE) for p, q in zip(pos, neg)]
+
+def case_pairing(pool, n):
+    empty = encode_spectrum(np.zeros(pool.matrix.shape[1], dtype=np.float32))
+    blobs = pool.cycle(pool.binary_blobs, n)
+    positive = np.arange(n) % 2 == 0
+    df = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'pos_spectrum': [blob if p else empty for blob, p in zip(blobs, positive)],
+        'neg_spectrum': [empty if p else blob for blob, p in zip(blobs, positive)],
+    })
+    return lambda: pair_polarities(df)
+
+def case_ingest(pool, n):
+    rows = pool.cycle(pool.csv_rows, n)
+
+    def run():
+        # Same conversion and executemany insert as load_csv_and_insert, into a scratch database
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            sqlite_helper.Base.metadata.create_all(engine)
+            with engine.connect() as conn:
+                sqlite_helper.set_bulk_load_pragmas(conn)
+                conn.commit()
+                for start in range(0, n, sqlite_helper.CSV_CHUNK_SIZE):
+                    records = [sqlite_helper.measurement_record(row)
+                               for row in rows[start:start + sqlite_helper.CSV_CHUNK_SIZE]]
+                    with conn.begin():
+                        conn.execute(insert(sqlite_helper.Measurement.__table__), records)
+            engine.dispose()
+    return run
+
+CASES = {
+    'parse_text': case_parse_text,
+    'parse_binary': case_parse_binary,
+    'peaks': case_peaks,
+    'k0': case_k0,
+    'matching': case_matching,
+    'pairing': case_pairing,
+    'ingest': case_ingest,
+}
+SLOW_CASES = {'parse_text', 'ingest'}
+
+def time_case(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(cases, scales, repeat=DEFAULT_REPEAT, library_size=DEFAULT_LIBRARY_SIZE, seed=RANDOM_SEED,
+              explicit_cases=False):
+    """
+    Run the benchmark cases at every scale.
+
+    Returns:
+    - Dictionary with 'meta' (commit, versions, settings) and 'results', one entry per
+      case and scale with all timings in seconds and the best throughput in spectra/s
+    """
+    start = time.perf_counter()
+    pool = Pool(library_size=library_size, seed=seed)
+    print(f"Generated {pool.size} distinct measurements in {time.perf_counter() - start:.1f} s")
+
+    results = []
+    print(f"{'case':<14}{'scale':>10}{'best [s]':>12}{'median [s]':>12}{'spectra/s':>14}")
+    for name in cases:
+        for n in scales:
+            if name in SLOW_CASES and n > SLOW_CASE_LIMIT and not explicit_cases:
+                print(f"{name:<14}{n:>10}{'skipped (pass --cases to run)':>38}")
+                continue
+            timings = time_case(CASES[name](pool, n), repeat)
+            best = min(timings)
+            rate = n / best if best else 0
+            results.append({'case': name, 'scale': n, 'timings': timings, 'best': best,
+                            'median': statistics.median(timings), 'spectra_per_s': rate})
+            print(f"{name:<14}{n:>10}{best:>12.4f}{statistics.median(timings):>12.4f}{rate:>14.0f}")
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'repeat': repeat,
+            'library_size': library_size,
+            'pool_size': pool.size,
+        },
+        'results': results,
+    }
+
+def compare(baseline, current):
+    """
+    Print the speedup of every case and scale present in both result sets.
+    """
+    previous = {(r['case'], r['scale']): r['best'] for r in baseline['results']}
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('created_at')}):")
+    print(f"{'case':<14}{'scale':>10}{'before [s]':>12}{'after [s]':>12}{'speedup':>10}")
+    for r in current['results']:
+        before = previous.get((r['case'], r['scale']))
+        if before is not None:
+            print(f"{r['case']:<14}{r['scale']:>10}{before:>12.4f}{r['best']:>12.4f}{before / r['best']:>9.2f}x")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the IMS benchmark suite on synthetic data.")
+    parser.add_argument("--cases", nargs='+', choices=list(CASES), default=None,
+                        help="Cases to run (default: all)")
+    parser.add_argument("--scales", nargs='+', type=lambda value: int(float(value)), default=DEFAULT_SCALES,
+                        help="Numbers of spectra, e.g. 100 1e4 1e6")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per case and scale")
+    parser.add_argument("--library-size", type=int, default=DEFAULT_LIBRARY_SIZE,
+                        help="Substances in the synthetic library")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED)
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--compare", metavar="JSON", default=None,
+                        help="Print speedups relative to an earlier results file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_suite(args.cases or list(CASES), args.scales, repeat=args.repeat, library_size=args.library_size,
+                       seed=args.seed, explicit_cases=args.cases is not None)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Stress test of concurrent database access: one loader process keeps inserting
+measurements while reader threads and reader processes query the same file through
+the read-only engine.
+
+Every database error is counted; the script exits with status 1 if any occurred, in
+particular "database is locked".
+
+Run from the repository root:
+    python -m benchmarks.stress_db --seconds 10 --reader-threads 4 --reader-processes 2
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sqlalchemy.exc import OperationalError
+from benchmarks.synthetic import synthetic_measurements, csv_frame
+from modules import sqlite_helper
+
+DEFAULT_SECONDS = 10.0
+DEFAULT_READER_THREADS = 4
+DEFAULT_READER_PROCESSES = 2
+DEFAULT_BATCH_SIZE = 50
+READ_WINDOW = 100  # Rows per reader query
+INITIAL_ROWS = 500
+RECORD_POOL_SIZE = 200
+
+def _records(n, seed=0):
+    rows = csv_frame(synthetic_measurements(RECORD_POOL_SIZE, seed=seed)).to_dict('records')
+    pool = [sqlite_helper.measurement_record(row) for row in rows]
+    return [pool[i % len(pool)] for i in range(n)]
+
+def run_writer(db_file, seconds, batch_size):
+    """
+    Insert batches of measurements until the time is up.
+
+    Returns:
+    - Dictionary with batches, rows, commit latencies and error messages
+    """
+    sqlite_helper.configure(db_file)
+    batch = _records(batch_size)
+    stats = {'batches': 0, 'rows': 0, 'latencies': [], 'errors': []}
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        try:
+            sqlite_helper.insert_measurements(batch)
+        except OperationalError as e:
+            stats['errors'].append(str(e.orig))
+            continue
+        stats['latencies'].append(time.perf_counter() - start)
+        stats['batches'] += 1
+        stats['rows'] += len(batch)
+    return stats
+
+def run_reader(db_file, seconds, seed):
+    """
+    Read random windows of spectra and the processing watermark until the time is up.
+
+    Returns:
+    - Dictionary with queries, rows, query latencies and error messages
+    """
+    if sqlite_helper.get_db_file() != db_file:
+        sqlite_helper.configure(db_file)
+    rng = random.Random(seed)
+    stats = {'queries': 0, 'rows': 0, 'latencies': [], 'errors': []}
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        try:
+            df = sqlite_helper.select_columns_from_db(["id", "measurement_time", "pos_spectrum", "neg_spectrum"],
+                                                      min_id=1 + rng.randrange(INITIAL_ROWS), limit=READ_WINDOW)
+            sqlite_helper.get_processing_watermark('stress')
+        except OperationalError as e:
+            stats['errors'].append(str(e.orig))
+            continue
+        stats['latencies'].append(time.perf_counter() - start)
+        stats['queries'] += 1
+        stats['rows'] += len(df)
+    return stats
+
+def _combine(results):
+    combined = {'latencies': [], 'errors': []}
+    for stats in results:
+        for key, value in stats.items():
+            if isinstance(value, list):
+                combined[key].extend(value)
+            else:
+                combined[key] = combined.get(key, 0) + value
+    return combined
+
+def _latency_text(latencies):
+    if not latencies:
+        return "-"
+    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+    return (f"p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+            f"max {max(latencies) * 1000:.1f} ms")
+
+def stress(db_file, seconds=DEFAULT_SECONDS, reader_threads=DEFAULT_READER_THREADS,
+           reader_processes=DEFAULT_READER_PROCESSES, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Run the loader and the readers concurrently against db_file.
+
+    Returns:
+    - (writer stats, reader stats)
+    """
+    # The parent opens the database before starting the workers, so forked children
+    # inherit open engines and have to replace them
+    sqlite_helper.configure(db_file)
+    sqlite_helper.insert_measurements(_records(INITIAL_ROWS, seed=1))
+    sqlite_helper.select_columns_from_db(["id"], limit=1)
+
+    with ProcessPoolExecutor(max_workers=1 + reader_processes) as processes, \
+            ThreadPoolExecutor(max_workers=reader_threads) as threads:
+        writer = processes.submit(run_writer, db_file, seconds, batch_size)
+        readers = [processes.submit(run_reader, db_file, seconds, seed) for seed in range(reader_processes)]
+        readers += [threads.submit(run_reader, db_file, seconds, seed)
+                    for seed in range(reader_processes, reader_processes + reader_threads)]
+        return writer.result(), _combine(reader.result() for reader in readers)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run concurrent readers against a writer on one SQLite database.")
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS, help="Duration of the test")
+    parser.add_argument("--reader-threads", type=int, default=DEFAULT_READER_THREADS)
+    parser.add_argument("--reader-processes", type=int, default=DEFAULT_READER_PROCESSES)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per insert transaction")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, 'stress.db')
+        writer, readers = stress(db_file, args.seconds, args.reader_threads, args.reader_processes,
+                                 args.batch_size)
+        sqlite_helper.configure()
+
+    print(f"Writer: {writer['batches']} transactions, {writer['rows']} rows "
+          f"({writer['rows'] / args.seconds:.0f} rows/s), commit {_latency_text(writer['latencies'])}")
+    print(f"Readers ({args.reader_threads} threads, {args.reader_processes} processes): {readers['queries']} "
+          f"queries, {readers['rows']} rows, {_latency_text(readers['latencies'])}")
+    errors = writer['errors'] + readers['errors']
+    locked = sum('database is locked' in error for error in errors)
+    print(f"Errors: {len(errors)} ({locked} 'database is locked')")
+    for error in sorted(set(errors)):
+        print(f"    {error}")
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Seeded generator of synthetic IMS measurements and substance libraries.
+
+Spectra consist of a baseline, a reactant ion peak (RIP) and Gaussian analyte peaks
+placed at the drift positions of library K0 values under the generated drift tube
+conditions, with noise quantized like the instrument output (1/16 counts). Metadata
+ranges follow the measurements in db/ims.db.
+"""
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from modules import ims
+
+SPECTRUM_POINTS = 895
+BASELINE = (50.0, 60.0)
+NOISE_LEVEL = 0.5
+INTENSITY_STEP = 1 / 16  # Spectra are stored in steps of 1/16
+RIP_K0 = {'pos': 2.15, 'neg': 2.25}
+RIP_HEIGHT = (300.0, 750.0)
+PEAK_HEIGHT = (20.0, 400.0)
+PEAK_WIDTH = (2.5, 4.5)  # Gaussian sigma in samples
+ANALYTES_PER_SPECTRUM = (0, 3)  # Inclusive range of library substances per measurement
+LIBRARY_K0_RANGE = (1.2, 2.6)
+
+# Drift tube conditions (temperature in degC, pressure in hPa, voltages in V, length in cm)
+TEMPERATURE = (39.8, 41.6)
+PRESSURE = (1035.0, 1044.0)
+POS_VOLTAGE = (1755.0, 1764.0)
+NEG_VOLTAGE = (1817.0, 1825.0)
+TUBE_LENGTH = 6.14772
+MEASUREMENT_INTERVAL = 1.0  # Seconds between frames
+START_TIME = datetime(2012, 11, 12, 12, 0, 0)
+
+POLARITY_PATTERNS = ('both', 'alternating', 'random', 'missing')
+CSV_COLUMNS = ["measurement_time", "device", "channel_1", "channel_2", "channel_3", "channel_4", "channel_5",
+               "channel_6", "channel_7", "channel_8", "dilution", "temperature_drift_tube", "pressure", "pos_voltage",
+               "neg_voltage", "tube_length", "press_offset", "press_gradient", "pos_spectrum", "neg_spectrum"]
+
+def k0_to_position(k0, temperature, pressure, voltage, drift_tube_length, resolution=ims.DEFAULT_RESOLUTION,
+                   position_offset=ims.DEFAULT_POSITION_OFFSET):
+    """
+    Inverse of ims.calculate_k0_values: the (fractional) spectrum index of a K0 value.
+    """
+    temperature = np.asarray(temperature, dtype=np.float64) + ims.CELSIUS_TO_KELVIN
+    k = np.asarray(k0) / ((ims.NOMINAL_TEMPERATURE / temperature) * (np.asarray(pressure) / ims.NOMINAL_PRESSURE))
+    drift_time = drift_tube_length ** 2 / (k * voltage)
+    return drift_time / (resolution / 1000000) - position_offset
+
+def synthetic_library(n, rng):
+    """
+    Library with one to three K0 values per polarity, the remaining columns set to zero.
+    """
+    data = {'id': np.arange(1, n + 1), 'substance_name': [f'SUBSTANCE_{i}' for i in range(n)]}
+    for polarity in ('pos', 'neg'):
+        n_values = rng.integers(0, 4, size=n)
+        for i in range(1, 4):
+            values = np.round(rng.uniform(*LIBRARY_K0_RANGE, size=n), 2)
+            data[f'k0_{polarity}_{i}'] = np.where(n_values >= i, values, 0.0)
+    return pd.DataFrame(data)
+
+def synthetic_conditions(n, rng):
+    """
+    Drift tube conditions of n frames as a dict of arrays, drifting slowly like the real data.
+    """
+    def drift(bounds):
+        low, high = bounds
+        walk = np.cumsum(rng.normal(0, (high - low) / 200, size=n))
+        return np.clip((low + high) / 2 + walk, low, high)
+
+    return {
+        'temperature_drift_tube': drift(TEMPERATURE),
+        'pressure': drift(PRESSURE),
+        'pos_voltage': drift(POS_VOLTAGE),
+        'neg_voltage': drift(NEG_VOLTAGE),
+        'tube_length': np.full(n, TUBE_LENGTH),
+    }
+
+def polarity_pattern(n, rng, pattern='alternating'):
+    """
+    Which frames carry positive and negative data.
+
+    - both: every frame has both polarities
+    - alternating: positive and negative frames alternate, like the instrument output
+    - random: mix of positive-only, negative-only, both and empty frames
+    - missing: alternating, with 5% of the frames dropped (empty)
+
+    Returns:
+    - (has_pos, has_neg) boolean arrays
+    """
+    if pattern == 'both':
+        has_pos = np.ones(n, dtype=bool)
+        has_neg = np.ones(n, dtype=bool)
+    elif pattern in ('alternating', 'missing'):
+        has_pos = np.arange(n) % 2 == 0
+        has_neg = ~has_pos
+        if pattern == 'missing':
+            dropped = rng.random(n) < 0.05
+            has_pos &= ~dropped
+            has_neg &= ~dropped
+    elif pattern == 'random':
+        kind = rng.choice(4, size=n, p=[0.4, 0.4, 0.1, 0.1])
+        has_pos = (kind == 0) | (kind == 2)
+        has_neg = (kind == 1) | (kind == 2)
+    else:
+        raise ValueError(f"Unknown polarity pattern: {pattern}")
+    return has_pos, has_neg
+
+def synthetic_spectra(rng, rip_positions, analyte_positions, n_points=SPECTRUM_POINTS):
+    """
+    Render spectra from peak positions.
+
+    Parameters:
+    - rng: numpy Generator
+    - rip_positions: Array with the RIP position of every spectrum
+    - analyte_positions: List with an array of analyte peak positions per spectrum
+    - n_points: Samples per spectrum
+
+    Returns:
+    - float32 matrix with one spectrum per row
+    """
+    n = len(rip_positions)
+    x = np.arange(n_points, dtype=np.float64)
+    spectra = rng.uniform(*BASELINE, size=(n, 1)) + rng.normal(0, NOISE_LEVEL, size=(n, n_points))
+    for row in range(n):
+        positions = np.append(analyte_positions[row], rip_positions[row])
+        heights = rng.uniform(*PEAK_HEIGHT, size=len(positions))
+        heights[-1] = rng.uniform(*RIP_HEIGHT)
+        widths = rng.uniform(*PEAK_WIDTH, size=len(positions))
+        spectra[row] += (heights * np.exp(-0.5 * ((x[:, None] - positions) / widths) ** 2)).sum(axis=1)
+    return (np.round(spectra / INTENSITY_STEP) * INTENSITY_STEP).astype(np.float32)
+
+def _analyte_positions(rng, library, polarity, conditions, voltage, n):
+    if library is None or len(library) == 0:
+        return [np.empty(0)] * n
+    columns = [f'k0_{polarity}_{i}' for i in range(1, 4)]
+    k0_table = library[columns].to_numpy(dtype=np.float64)
+    counts = rng.integers(ANALYTES_PER_SPECTRUM[0], ANALYTES_PER_SPECTRUM[1] + 1, size=n)
+    positions = []
+    for row in range(n):
+        k0s = k0_table[rng.integers(0, len(k0_table), size=counts[row])].ravel()
+        k0s = k0s[k0s > 0]
+        positions.append(k0_to_position(k0s, conditions['temperature_drift_tube'][row], conditions['pressure'][row],
+                                        voltage[row], conditions['tube_length'][row]))
+    return positions
+
+def synthetic_measurements(n, seed=42, pattern='alternating', library=None, n_points=SPECTRUM_POINTS):
+    """
+    Generate n frames with the columns of the measurements table.
+
+    Parameters:
+    - n: Number of frames
+    - seed: Random seed; the same seed always gives the same frames
+    - pattern: Polarity pattern, see polarity_pattern
+    - library: Optional library DataFrame whose substances are placed in the spectra
+    - n_points: Samples per spectrum
+
+    Returns:
+    - DataFrame with measurement_time, the drift tube conditions and pos_spectrum /
+      neg_spectrum as float32 arrays (all zeros for a missing polarity)
+    """
+    rng = np.random.default_rng(seed)
+    conditions = synthetic_conditions(n, rng)
+    has_pos, has_neg = polarity_pattern(n, rng, pattern)
+
+    df = pd.DataFrame({'id': np.arange(1, n + 1), 'measurement_time': measurement_times(n)})
+    for column, values in conditions.items():
+        df[column] = values
+
+    for polarity, mask in (('pos', has_pos), ('neg', has_neg)):
+        voltage = conditions[f'{polarity}_voltage']
+        rip = k0_to_position(RIP_K0[polarity], conditions['temperature_drift_tube'], conditions['pressure'], voltage,
+                             conditions['tube_length'])
+        analytes = _analyte_positions(rng, library, polarity, conditions, voltage, n)
+        spectra = synthetic_spectra(rng, rip, analytes, n_points)
+        spectra[~mask] = 0
+        df[f'{polarity}_spectrum'] = list(spectra)
+    return df
+
+def measurement_times(n, start=START_TIME, interval=MEASUREMENT_INTERVAL):
+    """
+    Measurement times in the CSV format (dd.mm.yyyy HH:MM:SS).
+    """
+    return [(start + timedelta(seconds=i * interval)).strftime('%d.%m.%Y %H:%M:%S') for i in range(n)]
+
+def csv_frame(measurements):
+    """
+    Convert synthetic measurements into the layout of the instrument CSV export.
+    """
+    n = len(measurements)
+    df = pd.DataFrame({'measurement_time': measurements['measurement_time'], 'device': 'GDA'})
+    for i in range(1, 9):
+        df[f'channel_{i}'] = 1.0
+    df['dilution'] = 118.0
+    for column in ('temperature_drift_tube', 'pressure', 'pos_voltage', 'neg_voltage', 'tube_length'):
+        df[column] = measurements[column].to_numpy()
+    df['press_offset'] = np.full(n, 197.0)
+    df['press_gradient'] = np.full(n, 500.0)
+    for column in ('pos_spectrum', 'neg_spectrum'):
+        df[column] = [str(spectrum.tolist()) for spectrum in measurements[column]]
+    return df[CSV_COLUMNS]
@@ -1,169 +1,377 @@
+import argparse
+import time
 from modules import sqlite_helper
-from modules.ims import process_spectrum, calculate_k0_value
-from modules.substance_identifier import identify_substances, DEFAULT_K0_TOLERANCE
-from modules.visualization import show_scrollable_plots
-import numpy as np
-import pandas as pd
+from modules import instrumentation
+from modules.instrumentation import timer, log_event, events_enabled, PROFILE_KINDS
+from modules.analysis import print_measurement_report, measurement_event
+from modules.batch import process_measurements_stream, DEFAULT_CHUNK_SIZE
+from modules.pairing import pair_polarities
+from modules.streaming import iter_rows, pair_rows, analyze_rows, StreamedMeasurements, StreamStats, STREAM_COLUMNS
+from modules.export import EXPORT_FORMATS, DEFAULT_EXPORT_FORMAT
+from modules.tracking import PeakTracker, print_track_summary, TRACK_K0_TOLERANCE, TRACK_MAX_GAP
+# The viewer, export, live, archive and incremental modes import their modules where they
+# are used, so matplotlib, asyncio & co. don't slow down every start of the CLI
 
 # Constants
 K0_TOLERANCE = 0.2  # The tolerance used specifically in this script
 
-def main():
-    # csv_file = r"./data/HCl 10ppm.csv"
-    # sqlite_helper.load_csv_and_insert(csv_file)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Detect peaks and identify substances in IMS measurements.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Process the measurements in parallel worker processes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes in batch mode (default: number of CPUs) and for --dbs "
+                             "(default: one per database)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Measurements per work item in batch mode")
+    parser.add_argument("--no-plot", action="store_true",
+                        help="Do not open the interactive viewer")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only analyze measurements added since the last run with the same parameters "
+                             "and store the results in the database")
+    parser.add_argument("--live", metavar="PATH", default=None,
+                        help="Analyze frames as they are appended to a CSV file or dropped into a directory; rows "
+                             "stored by an earlier run are skipped")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Stop live mode after this many seconds without new frames")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Do not insert live frames into the database")
+    parser.add_argument("--start", default=None,
+                        help="Only analyze measurements at or after this time (e.g. '2012-11-12 12:30:00')")
+    parser.add_argument("--end", default=None,
+                        help="Only analyze measurements at or before this time")
+    parser.add_argument("--export", metavar="DIR", default=None,
+                        help="Write one image per measurement to this directory")
+    parser.add_argument("--export-format", choices=EXPORT_FORMATS, default=DEFAULT_EXPORT_FORMAT,
+                        help="Image format of --export")
+    parser.add_argument("--export-pdf", metavar="FILE", default=None,
+                        help="Write all measurements to a multi-page PDF")
+    parser.add_argument("--archive", metavar="DIR", default=None,
+                        help="Browse a spectral archive (see modules.archive); measurements are analyzed on demand")
+    parser.add_argument("--sweep", action="store_true",
+                        help="Print identification counts for a grid of tolerances, smoothing settings and "
+                             "peak height fractions instead of analyzing with the fixed parameters")
+    parser.add_argument("--tolerances", nargs='+', type=float, default=None,
+                        help="K0 tolerances of --sweep (default: 0.01 0.02 0.05 0.1 0.2)")
+    parser.add_argument("--savgol", nargs='+', type=savgol_setting, default=None, metavar="WINDOW:ORDER",
+                        help="Savitzky-Golay settings of --sweep (default: 11:3)")
+    parser.add_argument("--height-fractions", nargs='+', type=float, default=None,
+                        help="Minimum peak heights relative to the spectrum maximum for --sweep (default: 0.1)")
+    parser.add_argument("--sweep-output", metavar="CSV", default=None, help="Also write the --sweep table to a CSV file")
+    parser.add_argument("--overview", action="store_true",
+                        help="Also show a time x drift index heatmap of all measurements; clicking into it jumps the "
+                             "viewer. The overview is cached in overview_cache next to the database and reused, "
+                             "without analyzing again, while the selection, the database rows and the parameters "
+                             "stay the same")
+    parser.add_argument("--rebuild-overview", action="store_true",
+                        help="Analyze again and replace the cached overview")
+    parser.add_argument("--tracks", metavar="NPZ", default=None,
+                        help="Link the peaks of consecutive measurements into tracks and write the track and "
+                             "substance time series to this .npz file (see modules.tracking); default, --live and "
+                             "--incremental mode")
+    parser.add_argument("--track-tolerance", type=float, default=TRACK_K0_TOLERANCE,
+                        help="Largest K0 difference between consecutive peaks of a track")
+    parser.add_argument("--track-gap", type=int, default=TRACK_MAX_GAP,
+                        help="Measurements a track may miss before it ends")
+    parser.add_argument("--db", metavar="FILE", default=None,
+                        help=f"SQLite database (default: ${sqlite_helper.DB_FILE_ENV} or {sqlite_helper.DB_FILE})")
+    parser.add_argument("--dbs", nargs='+', metavar="FILE", default=None,
+                        help="Analyze several databases (files or glob patterns, e.g. 'db/campaign_*.db') in "
+                             "parallel and merge the results by time; the library is read from --db")
+    parser.add_argument("--device", default=None, help="Only analyze measurements of this device")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the peaks, K0 values and matches of every measurement")
+    parser.add_argument("--events", metavar="FILE", default=None,
+                        help="Write one JSON line per measurement to this file")
+    parser.add_argument("--profile", choices=PROFILE_KINDS, default=None,
+                        help="Profile the run and print the report at the end")
+    parser.add_argument("--profile-output", metavar="FILE", default=None,
+                        help="Also save the raw profile (cProfile stats or pyinstrument HTML)")
+    args = parser.parse_args(argv)
+    if args.incremental and (args.start or args.end or args.device):
+        # The watermark of an incremental run covers every row below it, not just a selection
+        parser.error("--incremental always processes all new measurements and cannot be combined with "
+                     "--start, --end or --device")
+    # The overview needs the default mode, tracking a mode that analyzes every measurement
+    modes = {'--live': args.live, '--archive': args.archive, '--incremental': args.incremental, '--dbs': args.dbs,
+             '--sweep': args.sweep}
+    unsupported = [
+        ('--overview', args.overview, modes),
+        ('--rebuild-overview', args.rebuild_overview, modes),
+        ('--tracks', args.tracks, ('--archive', '--dbs', '--sweep')),
+        ('--export', args.export, ('--sweep',)),
+        ('--export-pdf', args.export_pdf, ('--sweep',)),
+    ]
+    for option, value, excluded in unsupported:
+        conflicts = [mode for mode in excluded if value and modes[mode]]
+        if conflicts:
+            parser.error(f"{option} cannot be combined with {conflicts[0]}")
+    return args
+
+def savgol_setting(value):
+    """
+    Parse a WINDOW:ORDER Savitzky-Golay setting, e.g. 11:3.
+    """
+    try:
+        window_length, polyorder = (int(part) for part in value.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WINDOW:ORDER, got {value!r}")
+    if polyorder >= window_length:
+        raise argparse.ArgumentTypeError(f"polynomial order must be less than the window length: {value!r}")
+    return window_length, polyorder
+
+def log_results(results):
+    if events_enabled():
+        for result in results:
+            log_event('measurement', **measurement_event(result))
+
+class ResultLog:
+    """
+    Sink that writes the measurement event of every result it receives.
+    """
+
+    def add(self, result):
+        log_results([result])
+
+def show_plots(visualization_data, overview=None):
+    from modules.visualization import show_scrollable_plots
+    with timer('plotting'):
+        show_scrollable_plots(visualization_data, overview=overview)
+
+def export_results(args, visualization_data):
+    if not (args.export or args.export_pdf):
+        return
+    from modules.export import export_measurement_plots, export_measurement_pdf, print_export_summary
+
+    if args.export:
+        with timer('export'):
+            paths, elapsed = export_measurement_plots(visualization_data, args.export,
+                                                      image_format=args.export_format, workers=args.workers)
+        print_export_summary(len(paths), elapsed, args.export)
+    if args.export_pdf:
+        with timer('export'):
+            pages, elapsed = export_measurement_pdf(visualization_data, args.export_pdf)
+        print_export_summary(pages, elapsed, args.export_pdf)
 
-    df = sqlite_helper.select_columns_from_db(["measurement_time", "pos_spectrum", "neg_spectrum", 
-                                              "temperature_drift_tube", "pressure", "pos_voltage", 
-                                              "neg_voltage", "tube_length"])
-    
+def analyze_selection(args, selection, visualization_data, sinks=()):
+    """
+    Analyze the selected measurements one chunk at a time and report every result.
+
+    Only the ids of the analyzed measurements are kept (in visualization_data); the
+    viewer and the export analyze them again on demand. Every result is also passed to
+    the add method of the sinks (overview.OverviewBuilder, tracking.PeakTracker).
+    """
+    stats = StreamStats()
     # Most of the rows in the database have either positive or negative spectrum data, not both
     # We need to merge them based on the presence of data in either spectrum
-    # Process and merge the data to combine appropriate positive and negative spectra
-    merged_data = []
-    i = 0
-    while i < len(df):
-        current_row = df.iloc[i].copy()
-        pos_spectrum = current_row["pos_spectrum"]
-        neg_spectrum = current_row["neg_spectrum"]
-        
-        pos_spectrum_array = np.fromstring(pos_spectrum[2:-1], sep=', ')
-        neg_spectrum_array = np.fromstring(neg_spectrum[2:-1], sep=', ')
-        
-        # Case 1: Both spectra have data - no need to merge
-        if not np.all(pos_spectrum_array == 0) and not np.all(neg_spectrum_array == 0):
-            merged_data.append(current_row)
-            i += 1
-            continue
-            
-        # Case 2: Current row has positive spectrum but no negative spectrum
-        if not np.all(pos_spectrum_array == 0) and np.all(neg_spectrum_array == 0):
-            # Look ahead for a row with negative spectrum data
-            next_neg_idx = -1
-            for j in range(i+1, len(df)):
-                next_neg_array = np.fromstring(df.iloc[j]["neg_spectrum"][2:-1], sep=', ')
-                next_pos_array = np.fromstring(df.iloc[j]["pos_spectrum"][2:-1], sep=', ')
-                
-                # If we find a row with negative data and no positive data
-                if not np.all(next_neg_array == 0) and np.all(next_pos_array == 0):
-                    next_neg_idx = j
-                    break
-                    
-            if next_neg_idx != -1:
-                # Merge the data - keep metadata from current row with positive spectrum
-                merged_row = current_row.copy()
-                merged_row["neg_spectrum"] = df.iloc[next_neg_idx]["neg_spectrum"]
-                merged_data.append(merged_row)
-                i = next_neg_idx + 1  # Skip to after the last used row
-            else:
-                # No matching negative spectrum found
-                i += 1
-            continue
-            
-        # Case 3: Current row has negative spectrum but no positive spectrum
-        if np.all(pos_spectrum_array == 0) and not np.all(neg_spectrum_array == 0):
-            # Look behind for the most recent row with positive spectrum data
-            prev_pos_idx = -1
-            for j in range(i-1, -1, -1):
-                prev_pos_array = np.fromstring(df.iloc[j]["pos_spectrum"][2:-1], sep=', ')
-                
-                # If we find a row with positive data
-                if not np.all(prev_pos_array == 0):
-                    prev_pos_idx = j
-                    break
-                    
-            if prev_pos_idx != -1:
-                # We've already processed this by looking ahead from the positive spectrum row
-                i += 1
-            else:
-                # No matching positive spectrum found before this
-                i += 1
-            continue
-            
-        # Case 4: Both spectra are empty
-        i += 1
-
-    visualization_data = []
-    
-    for i, row in enumerate(merged_data):
-        measurement_time = row["measurement_time"]
-        pos_spectrum = row["pos_spectrum"]
-        neg_spectrum = row["neg_spectrum"]
-        temperature = row["temperature_drift_tube"]
-        pressure = row["pressure"]
-        pos_voltage = row["pos_voltage"]
-        neg_voltage = row["neg_voltage"]
-        drift_tube_length = row["tube_length"]
-        resolution = 32.392  
-
-        pos_spectrum_array = np.fromstring(pos_spectrum[2:-1], sep=', ')
-        neg_spectrum_array = np.fromstring(neg_spectrum[2:-1], sep=', ')
-        
-        # Skip if either spectrum is empty
-        if np.all(pos_spectrum_array == 0) or np.all(neg_spectrum_array == 0):
-            print(f"Skipping spectrum at Measurement Time: {measurement_time} (contains zeros in one spectrum)")
+    pairs = pair_rows(iter_rows(**selection), stats=stats)
+
+    start = time.perf_counter()
+    if args.batch:
+        results = process_measurements_stream(pairs, tolerance=K0_TOLERANCE, workers=args.workers,
+                                              chunk_size=args.chunk_size)
+    else:
+        results = analyze_rows(pairs, tolerance=K0_TOLERANCE)
+
+    for i, (row, result) in enumerate(results):
+        if result is None:
+            if args.verbose:
+                print(f"Skipping spectrum at Measurement Time: {row['measurement_time']} "
+                      f"(contains zeros in one spectrum)")
+            log_event('skipped', measurement_time=row['measurement_time'])
             continue
-        
-        print(f"\nProcessing Measurement Time: {measurement_time} (Entry {i+1}/{len(merged_data)})")
-        
-        pos_top_peaks = []
-        pos_k0_values = []
-        if not np.all(pos_spectrum_array == 0):
-            pos_top_peaks = process_spectrum(pos_spectrum)
-            pos_k0_values = calculate_k0_value(pos_top_peaks, temperature, pressure, pos_voltage, drift_tube_length, resolution)
-            print(f"Positive Spectrum:")
-            print(f"Top 10 Peaks: {pos_top_peaks}")
-            print(f"K0 Values: {pos_k0_values}")
-        
-        neg_top_peaks = []
-        neg_k0_values = []
-        if not np.all(neg_spectrum_array == 0):
-            neg_top_peaks = process_spectrum(neg_spectrum)
-            neg_k0_values = calculate_k0_value(neg_top_peaks, temperature, pressure, neg_voltage, drift_tube_length, resolution)
-            print(f"Negative Spectrum:")
-            print(f"Top 10 Peaks: {neg_top_peaks}")
-            print(f"K0 Values: {neg_k0_values}")
-        
-        # Identify substances based on K0 values
-        # identified_substances = identify_substances(pos_k0_values, neg_k0_values, tolerance=0.02)
-        identified_substances = identify_substances(pos_k0_values, neg_k0_values, tolerance=K0_TOLERANCE)
-        
-        if identified_substances:
-            print(f"\nIdentified Substances:")
-            for substance in identified_substances:
-                print(f"- {substance['name']}")
-                if substance['pos_matches']:
-                    print(f"  Positive spectrum matches:")
-                    for match in substance['pos_matches']:
-                        print(f"    {match[0]} library value: {match[2]:.3f}, measured: {match[1]:.3f}")
-                if substance['neg_matches']:
-                    print(f"  Negative spectrum matches:")
-                    for match in substance['neg_matches']:
-                        print(f"    {match[0]} library value: {match[2]:.3f}, measured: {match[1]:.3f}")
+
+        if args.verbose:
+            print_measurement_report(result, i)
+        log_results([result])
+        visualization_data.add(result)
+        for sink in sinks:
+            sink.add(result)
+    elapsed = time.perf_counter() - start
+
+    print(f"Paired {stats.pairs} measurements, {stats.unpaired} rows left unpaired")
+    if args.batch:
+        # Every measurement holds a positive and a negative spectrum
+        rate = 2 * stats.pairs / elapsed if elapsed else 0
+        print(f"\nProcessed {stats.pairs} measurements in {elapsed:.2f} s ({rate:.1f} spectra/s)")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.events:
+        instrumentation.open_event_log(args.events)
+    start = time.perf_counter()
+    try:
+        if args.profile:
+            with instrumentation.profiled(args.profile, args.profile_output):
+                run(args)
         else:
-            print("\nNo substances identified in this spectrum.")
-        
-        print("="*50)
-        
-        # data for visualization
-        visualization_data.append({
-            'measurement_time': measurement_time,
-            'spectrums': {
-                'pos': pos_spectrum_array,
-                'neg': neg_spectrum_array
-            },
-            'peaks_data': {
-                'pos': pos_top_peaks,
-                'neg': neg_top_peaks,
-                'pos_k0s': pos_k0_values,
-                'neg_k0s': neg_k0_values
-            },
-            'identified_substances': identified_substances
-        })
+            run(args)
+    finally:
+        instrumentation.close_event_log()
+    instrumentation.print_summary(time.perf_counter() - start)
+
+def run(args):
+    if args.db:
+        sqlite_helper.configure(args.db)
+    if (args.start or args.end or args.device) and not args.dbs:
+        try:
+            sqlite_helper.prepare_selection(args.start, args.end, args.device)
+        except ValueError as error:
+            print(error)
+            return
+
+    # csv_file = r"./data/HCl 10ppm.csv"
+    # sqlite_helper.load_csv_and_insert(csv_file)
+
+    if args.live:
+        from modules.live import run_live_blocking, print_live_result
+        on_result = print_live_result
+        if args.tracks:
+            # Peaks are linked to tracks as the frames arrive
+            tracker = PeakTracker(tolerance=args.track_tolerance, max_gap=args.track_gap)
+
+            def on_result(result, latency):
+                print_live_result(result, latency)
+                tracker.add(result)
+        run_live_blocking(args.live, tolerance=K0_TOLERANCE, store=not args.no_store, idle_timeout=args.idle_timeout,
+                          on_result=on_result)
+        if args.tracks:
+            tracker.save(args.tracks)
+            print_track_summary(tracker)
+        return
+
+    if args.archive:
+        from modules.archive import SpectralArchive, ArchiveMeasurements
+        archive = SpectralArchive(args.archive)
+        measurements = ArchiveMeasurements(archive, tolerance=K0_TOLERANCE)
+        print(f"Archive {args.archive}: {len(archive)} frames, {len(measurements)} measurements")
+        export_results(args, measurements)
+        if len(measurements) and not args.no_plot:
+            show_plots(measurements)
+        return
+
+    if args.incremental:
+        from modules.results import process_incremental
+        sinks = [ResultLog()]
+        tracker = None
+        if args.tracks:
+            # Tracks of the new measurements only; tracks of earlier runs are not continued
+            tracker = PeakTracker(tolerance=args.track_tolerance, max_gap=args.track_gap)
+            sinks.append(tracker)
+        summary = process_incremental(tolerance=K0_TOLERANCE, workers=args.workers if args.batch else None,
+                                      chunk_size=args.chunk_size, sinks=sinks)
+        visualization_data = summary['measurements']
+        if summary['run_id'] is None:
+            print(f"No new final measurements after id {summary['previous_watermark']}")
+        else:
+            print(f"Processed measurements {summary['previous_watermark'] + 1}..{summary['watermark']}: "
+                  f"{len(visualization_data)} complete spectra, {visualization_data.matches} matches")
+            print(f"Results stored as processing run {summary['run_id']}")
+        if tracker is not None:
+            tracker.save(args.tracks)
+            print_track_summary(tracker)
+            print(f"Peak tracks and substance time series written to {args.tracks}")
+        export_results(args, visualization_data)
+        if len(visualization_data) and not args.no_plot:
+            show_plots(visualization_data)
+        return
+
+    if args.dbs:
+        from modules.multi_db import expand_db_files, scan_databases, print_scan_summary, ScannedMeasurements
+        try:
+            db_files = expand_db_files(args.dbs)
+        except ValueError as error:
+            print(error)
+            return
+        start = time.perf_counter()
+        try:
+            records, ranges, summary = scan_databases(db_files, tolerance=K0_TOLERANCE, start_time=args.start,
+                                                      end_time=args.end, device=args.device, workers=args.workers,
+                                                      events=events_enabled())
+        except ValueError as error:
+            # e.g. a time or device filter on a database without these columns
+            print(error)
+            return
+        # Only the ids are kept; the viewer and the export read and analyze the measurements again
+        visualization_data = ScannedMeasurements(tolerance=K0_TOLERANCE, ranges=ranges)
+        for record in records:
+            visualization_data.add(record)
+            if 'event' in record:
+                log_event('measurement', **record['event'])
+        print_scan_summary(summary, time.perf_counter() - start)
+        export_results(args, visualization_data)
+        if visualization_data and not args.no_plot:
+            show_plots(visualization_data)
+        visualization_data.close()
+        return
+
+    if args.sweep:
+        from modules.sweep import (run_sweep, print_sweep_table, DEFAULT_SWEEP_TOLERANCES, DEFAULT_SWEEP_SAVGOL,
+                                   DEFAULT_SWEEP_HEIGHT_FRACTIONS)
+        # The sweep keeps every spectrum in memory to share results between parameter sets
+        df = sqlite_helper.select_columns_from_db(STREAM_COLUMNS, start_time=args.start, end_time=args.end,
+                                                 device=args.device)
+        merged_df, unpaired = pair_polarities(df)
+        print(f"Paired {len(merged_df)} measurements, {len(unpaired)} rows left unpaired")
+        table, elapsed = run_sweep(merged_df, tolerances=args.tolerances or DEFAULT_SWEEP_TOLERANCES,
+                                   savgol_settings=args.savgol or DEFAULT_SWEEP_SAVGOL,
+                                   height_fractions=args.height_fractions or DEFAULT_SWEEP_HEIGHT_FRACTIONS)
+        print_sweep_table(table, elapsed)
+        if args.sweep_output:
+            table.to_csv(args.sweep_output, index=False)
+            print(f"Sweep table written to {args.sweep_output}")
+        return
+
+    selection = {'start_time': args.start, 'end_time': args.end, 'device': args.device}
+    visualization_data = StreamedMeasurements(tolerance=K0_TOLERANCE, selection=selection)
+    sinks = []
+    tracker = None
+    if args.tracks:
+        tracker = PeakTracker(tolerance=args.track_tolerance, max_gap=args.track_gap)
+        sinks.append(tracker)
+
+    overview = builder = None
+    if args.overview or args.rebuild_overview:
+        from modules.overview import OverviewBuilder, overview_cache_dir, load_overview, save_overview
+        cache_dir = overview_cache_dir(selection, K0_TOLERANCE)
+        # Read before the analysis, so rows added meanwhile make the next run rebuild the entry
+        rows = sqlite_helper.get_measurement_range(**selection)
+        # Tracking, the measurement report and the event log need the analysis results, the cache
+        # only holds the overview
+        per_measurement = tracker is not None or args.verbose or events_enabled()
+        cached = None if args.rebuild_overview or per_measurement else load_overview(cache_dir, K0_TOLERANCE,
+                                                                                    selection, rows)
+        if cached is not None:
+            overview, visualization_data = cached
+            print(f"Loaded the overview of {len(visualization_data)} measurements from {cache_dir}")
+        else:
+            builder = OverviewBuilder()
+            sinks.append(builder)
+
+    if overview is None:
+        analyze_selection(args, selection, visualization_data, sinks)
+    if builder is not None and not builder.count:
+        print("No measurements in the selection, no overview built")
+    elif builder is not None:
+        overview = builder.finish()
+        try:
+            save_overview(cache_dir, overview, visualization_data, rows)
+            print(f"Overview saved to {cache_dir}")
+        except OSError as error:
+            # e.g. a database on read-only media; the overview is still shown
+            print(f"Overview not cached: {error}")
+    if tracker is not None:
+        tracker.save(args.tracks)
+        print_track_summary(tracker)
+        print(f"Peak tracks and substance time series written to {args.tracks}")
 
     print(f"\nFound {len(visualization_data)} complete spectra (with both positive and negative data)")
-    print (f"\nTotal matches found: {sum(len(data['identified_substances']) for data in visualization_data)}")
+    print (f"\nTotal matches found: {visualization_data.matches}")
+
+    export_results(args, visualization_data)
 
-    show_scrollable_plots(visualization_data)
+    if len(visualization_data) and not args.no_plot:
+        show_plots(visualization_data, overview)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,126 @@
+import numpy as np
+from modules.ims import process_spectrum, calculate_k0_value
+from modules.substance_identifier import identify_substances, DEFAULT_K0_TOLERANCE
+from modules.spectrum_codec import decode_spectrum
+from modules.instrumentation import timer, count
+
+def analyze_measurement(row, tolerance=DEFAULT_K0_TOLERANCE, library=None):
+    """
+    Detect peaks, convert them to K0 values and identify substances for one measurement.
+
+    Parameters:
+    - row: Mapping with measurement_time, pos_spectrum, neg_spectrum, temperature_drift_tube,
+      pressure, pos_voltage, neg_voltage and tube_length
+    - tolerance: K0 tolerance used for the identification
+    - library: Optional SubstanceLibrary (default: the shared instance)
+
+    Returns:
+    - Dictionary with the spectra, peaks and identified substances in the format used by
+      the visualization, or None if one of the spectra is empty
+    """
+    measurement_time = row["measurement_time"]
+    pos_spectrum = row["pos_spectrum"]
+    neg_spectrum = row["neg_spectrum"]
+    temperature = row["temperature_drift_tube"]
+    pressure = row["pressure"]
+    pos_voltage = row["pos_voltage"]
+    neg_voltage = row["neg_voltage"]
+    drift_tube_length = row["tube_length"]
+
+    with timer('decode'):
+        pos_spectrum_array = decode_spectrum(pos_spectrum)
+        neg_spectrum_array = decode_spectrum(neg_spectrum)
+
+    # Skip if either spectrum is empty
+    if np.all(pos_spectrum_array == 0) or np.all(neg_spectrum_array == 0):
+        count('measurements_skipped')
+        return None
+
+    pos_top_peaks = process_spectrum(pos_spectrum_array)
+    neg_top_peaks = process_spectrum(neg_spectrum_array)
+
+    with timer('k0_conversion'):
+        pos_k0_values = calculate_k0_value(pos_top_peaks, temperature, pressure, pos_voltage, drift_tube_length)
+        neg_k0_values = calculate_k0_value(neg_top_peaks, temperature, pressure, neg_voltage, drift_tube_length)
+
+    # Identify substances based on K0 values
+    with timer('identification'):
+        identified_substances = identify_substances(pos_k0_values, neg_k0_values, tolerance=tolerance,
+                                                    library=library)
+
+    count('spectra_processed', 2)
+    if identified_substances:
+        count('measurements_identified')
+        count('substance_matches', len(identified_substances))
+
+    return {
+        'measurement_id': row.get("id"),
+        'neg_measurement_id': row.get("neg_id", row.get("id")),
+        'measurement_time': measurement_time,
+        'spectrums': {
+            'pos': pos_spectrum_array,
+            'neg': neg_spectrum_array
+        },
+        'peaks_data': {
+            'pos': pos_top_peaks,
+            'neg': neg_top_peaks,
+            'pos_k0s': pos_k0_values,
+            'neg_k0s': neg_k0_values
+        },
+        'identified_substances': identified_substances
+    }
+
+def measurement_event(result):
+    """
+    Compact summary of an analyzed measurement for the JSON lines event log.
+    """
+    peaks_data = result['peaks_data']
+    event = {
+        'measurement_id': result['measurement_id'],
+        'measurement_time': result['measurement_time'],
+        'pos_peaks': len(peaks_data['pos']),
+        'neg_peaks': len(peaks_data['neg']),
+        'pos_k0s': [round(k0, 4) for k0 in peaks_data['pos_k0s']],
+        'neg_k0s': [round(k0, 4) for k0 in peaks_data['neg_k0s']],
+        'substances': [substance['name'] for substance in result['identified_substances']],
+    }
+    # Tags of results from a multi-database scan
+    for key in ('source', 'device'):
+        if key in result:
+            event[key] = result[key]
+    return event
+
+def print_measurement_report(result, position, total=None):
+    """
+    Print the peaks and identified substances of an analyzed measurement.
+
+    The total number of measurements is left out if it is not known yet (streaming).
+    """
+    entry = f"{position + 1}/{total}" if total is not None else f"{position + 1}"
+    print(f"\nProcessing Measurement Time: {result['measurement_time']} (Entry {entry})")
+
+    peaks_data = result['peaks_data']
+    print(f"Positive Spectrum:")
+    print(f"Top 10 Peaks: {peaks_data['pos']}")
+    print(f"K0 Values: {peaks_data['pos_k0s']}")
+    print(f"Negative Spectrum:")
+    print(f"Top 10 Peaks: {peaks_data['neg']}")
+    print(f"K0 Values: {peaks_data['neg_k0s']}")
+
+    identified_substances = result['identified_substances']
+    if identified_substances:
+        print(f"\nIdentified Substances:")
+        for substance in identified_substances:
+            print(f"- {substance['name']}")
+            if substance['pos_matches']:
+                print(f"  Positive spectrum matches:")
+                for match in substance['pos_matches']:
+                    print(f"    {match[0]} library value: {match[2]:.3f}, measured: {match[1]:.3f}")
+            if substance['neg_matches']:
+                print(f"  Negative spectrum matches:")
+                for match in substance['neg_matches']:
+                    print(f"    {match[0]} library value: {match[2]:.3f}, measured: {match[1]:.3f}")
+    else:
+        print("\nNo substances identified in this spectrum.")
+
+    print("="*50)
@@ -0,0 +1,306 @@
+import argparse
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+from numpy.lib.format import open_memmap
+from modules import sqlite_helper
+from modules.analysis import analyze_measurement
+from modules.ims import process_spectra_batch, PEAK_DTYPE
+from modules.pairing import pair_positions
+from modules.spectrum_codec import decode_spectrum, encode_spectrum, DEFAULT_SPECTRUM_DTYPE
+from modules.substance_identifier import DEFAULT_K0_TOLERANCE
+
+ARCHIVE_CHUNK_SIZE = 10000
+ARCHIVE_CACHE_SIZE = 256  # Analyzed measurements kept by ArchiveMeasurements
+SPECTRUM_FILES = {'pos': 'pos.npy', 'neg': 'neg.npy'}
+META_FILE = 'meta.npy'
+TIME_LENGTH = 19  # 'dd.mm.yyyy HH:MM:SS' and 'YYYY-MM-DD HH:MM:SS'
+
+# One record per archived frame, row i describes row i of pos.npy and neg.npy
+ARCHIVE_META_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('measurement_time', f'S{TIME_LENGTH}'),
+    ('measurement_timestamp', f'S{TIME_LENGTH}'),
+    ('temperature_drift_tube', np.float64),
+    ('pressure', np.float64),
+    ('pos_voltage', np.float64),
+    ('neg_voltage', np.float64),
+    ('tube_length', np.float64),
+    ('has_pos', np.bool_),
+    ('has_neg', np.bool_),
+    # Intensity range of every spectrum, so axis limits don't require a full scan
+    ('pos_min', np.float32),
+    ('pos_max', np.float32),
+    ('neg_min', np.float32),
+    ('neg_max', np.float32),
+])
+ARCHIVE_COLUMNS = ["id", "measurement_time", "measurement_timestamp", "temperature_drift_tube", "pressure",
+                   "pos_voltage", "neg_voltage", "tube_length", "pos_spectrum", "neg_spectrum"]
+CONDITION_COLUMNS = ["temperature_drift_tube", "pressure", "pos_voltage", "neg_voltage", "tube_length"]
+
+def _encode_text(value):
+    return (value or '').encode('ascii', 'replace')[:TIME_LENGTH]
+
+def export_archive(directory, start_time=None, end_time=None, min_id=None, max_id=None, dtype=DEFAULT_SPECTRUM_DTYPE,
+                   chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Write the spectra and metadata of a selection of measurements to a memory-mappable archive.
+
+    The directory receives pos.npy and neg.npy (one spectrum per row, in id order) and
+    meta.npy (ARCHIVE_META_DTYPE records, row i belongs to spectrum row i). Rows are
+    fetched in id-keyed chunks, so memory use does not depend on the selection size.
+
+    Parameters:
+    - directory: Output directory (created if missing, existing archive files are replaced)
+    - start_time, end_time, min_id, max_id: Selection as in sqlite_helper.select_columns_from_db
+    - dtype: Sample type of the spectrum arrays (default: 'float32', exact for the instrument data)
+    - chunk_size: Rows fetched and written at once
+
+    Returns:
+    - Number of archived frames
+    """
+    ids = sqlite_helper.select_columns_from_db(["id"], start_time=start_time, end_time=end_time, min_id=min_id,
+                                               max_id=max_id)["id"]
+    n = len(ids)
+    os.makedirs(directory, exist_ok=True)
+    for file_name in SPECTRUM_FILES.values():
+        # Spectrum files are only created once the spectrum length is known
+        if os.path.exists(os.path.join(directory, file_name)):
+            os.remove(os.path.join(directory, file_name))
+    meta = open_memmap(os.path.join(directory, META_FILE), mode='w+', dtype=ARCHIVE_META_DTYPE, shape=(n,))
+    spectra = {}
+
+    written = 0
+    next_id = min_id
+    last_id = int(ids.iloc[-1]) if n else None
+    while written < n:
+        chunk = sqlite_helper.select_columns_from_db(ARCHIVE_COLUMNS, start_time=start_time, end_time=end_time,
+                                                     min_id=next_id, max_id=last_id, limit=chunk_size)
+        if chunk.empty:
+            break
+        rows = slice(written, written + len(chunk))
+        for polarity in SPECTRUM_FILES:
+            matrix = np.vstack([decode_spectrum(blob) for blob in chunk[f'{polarity}_spectrum']]).astype(dtype)
+            if polarity not in spectra:
+                spectra[polarity] = open_memmap(os.path.join(directory, SPECTRUM_FILES[polarity]), mode='w+',
+                                                dtype=dtype, shape=(n, matrix.shape[1]))
+            if matrix.shape[1] != spectra[polarity].shape[1]:
+                raise ValueError(f"Spectrum length {matrix.shape[1]} differs from {spectra[polarity].shape[1]}")
+            spectra[polarity][rows] = matrix
+            meta[f'has_{polarity}'][rows] = np.any(matrix != 0, axis=1)
+            meta[f'{polarity}_min'][rows] = matrix.min(axis=1)
+            meta[f'{polarity}_max'][rows] = matrix.max(axis=1)
+
+        meta['id'][rows] = chunk['id'].to_numpy()
+        meta['measurement_time'][rows] = [_encode_text(value) for value in chunk['measurement_time']]
+        meta['measurement_timestamp'][rows] = [_encode_text(value) for value in chunk['measurement_timestamp']]
+        for column in CONDITION_COLUMNS:
+            meta[column][rows] = chunk[column].to_numpy(dtype=np.float64)
+
+        written += len(chunk)
+        next_id = int(chunk['id'].iloc[-1]) + 1
+
+    for array in [meta, *spectra.values()]:
+        array.flush()
+    return written
+
+def import_archive(directory, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Insert the frames of an archive into the measurements table as binary spectra.
+
+    Only the archived columns are restored; channels, dilution and the pressure
+    offset/gradient stay NULL. The frames get new ids.
+
+    Returns:
+    - Number of inserted frames
+    """
+    archive = SpectralArchive(directory)
+    for start in range(0, len(archive), chunk_size):
+        stop = min(start + chunk_size, len(archive))
+        records = []
+        for index in range(start, stop):
+            frame = archive.frame(index)
+            del frame['id']
+            frame['pos_spectrum'] = encode_spectrum(frame['pos_spectrum'])
+            frame['neg_spectrum'] = encode_spectrum(frame['neg_spectrum'])
+            records.append(frame)
+        sqlite_helper.insert_measurements(records)
+    return len(archive)
+
+class SpectralArchive:
+    """
+    Read-only view on an archive written by export_archive.
+
+    Spectra and metadata are memory-mapped: opening is instant, accessing a frame is
+    O(1) and only touches the pages of that frame, and spectra are returned as views
+    into the mapping without copying.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = np.load(os.path.join(directory, META_FILE), mmap_mode='r')
+        self.spectra = {}
+        for polarity, file_name in SPECTRUM_FILES.items():
+            path = os.path.join(directory, file_name)
+            # An empty selection writes no spectrum files
+            self.spectra[polarity] = (np.load(path, mmap_mode='r') if os.path.exists(path)
+                                      else np.empty((0, 0), dtype=DEFAULT_SPECTRUM_DTYPE))
+        self.pos = self.spectra['pos']
+        self.neg = self.spectra['neg']
+        self._pairs = None
+        self._time_order = None
+
+    def __len__(self):
+        return len(self.meta)
+
+    def frame(self, index):
+        """
+        Row index as a dictionary with the measurements table column names.
+        """
+        record = self.meta[index]
+        frame = {
+            'id': int(record['id']),
+            'measurement_time': record['measurement_time'].decode('ascii'),
+            'measurement_timestamp': record['measurement_timestamp'].decode('ascii') or None,
+            'pos_spectrum': self.pos[index],
+            'neg_spectrum': self.neg[index],
+        }
+        for column in CONDITION_COLUMNS:
+            frame[column] = float(record[column])
+        return frame
+
+    def pairs(self):
+        """
+        Positive/negative row pairs as pairing.pair_positions returns them (cached).
+        """
+        if self._pairs is None:
+            self._pairs = pair_positions(self.meta['has_pos'], self.meta['has_neg'])
+        return self._pairs
+
+    def detect_peaks(self, polarity, start=0, stop=None, chunk_size=ARCHIVE_CHUNK_SIZE):
+        """
+        Run ims.process_spectra_batch on a row range, one chunk of the mapping at a time.
+
+        Returns:
+        - PEAK_DTYPE records with 'row' relative to the archive
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        results = []
+        for chunk_start in range(start, stop, chunk_size):
+            chunk = process_spectra_batch(self.spectra[polarity][chunk_start:min(chunk_start + chunk_size, stop)])
+            chunk['row'] += chunk_start
+            results.append(chunk)
+        return np.concatenate(results) if results else np.empty(0, dtype=PEAK_DTYPE)
+
+    def time_order(self):
+        """
+        Sorted measurement timestamps and the rows they belong to (cached).
+        """
+        if self._time_order is None:
+            timestamps = self.meta['measurement_timestamp']
+            order = np.argsort(timestamps, kind='stable')
+            self._time_order = (timestamps[order], order)
+        return self._time_order
+
+    def find_time(self, timestamp):
+        """
+        First row at or after a time (any format accepted by sqlite_helper.to_iso_timestamp).
+        """
+        timestamps, order = self.time_order()
+        position = np.searchsorted(timestamps, sqlite_helper.to_iso_timestamp(timestamp).encode('ascii'))
+        return int(order[min(position, len(order) - 1)])
+
+class ArchiveMeasurements:
+    """
+    Lazily analyzed measurements of an archive, usable as data_list of the viewer.
+
+    Indexing pairs the polarities with the precomputed masks, analyzes the pair with
+    analysis.analyze_measurement on views into the mapping and keeps the most recent
+    results in a small cache.
+    """
+
+    def __init__(self, archive, tolerance=DEFAULT_K0_TOLERANCE, library=None, cache_size=ARCHIVE_CACHE_SIZE):
+        self.archive = archive
+        self.tolerance = tolerance
+        self.library = library
+        self.cache_size = cache_size
+        self.pos_rows, self.neg_rows, _ = archive.pairs()
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.pos_rows)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        row = self.archive.frame(self.pos_rows[index])
+        neg_row = self.neg_rows[index]
+        row['neg_spectrum'] = self.archive.neg[neg_row]
+        row['neg_id'] = int(self.archive.meta['id'][neg_row])
+        result = analyze_measurement(row, tolerance=self.tolerance, library=self.library)
+
+        self._cache[index] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def intensity_ranges(self):
+        """
+        Spectrum length and lowest/highest intensity per polarity over all measurements,
+        from the stored per-frame ranges instead of a scan of the spectra.
+        """
+        ranges = {}
+        meta = self.archive.meta
+        for polarity, rows in (('pos', self.pos_rows), ('neg', self.neg_rows)):
+            length = self.archive.spectra[polarity].shape[1]
+            if len(rows):
+                ranges[polarity] = (length, float(meta[f'{polarity}_min'][rows].min()),
+                                    float(meta[f'{polarity}_max'][rows].max()))
+            else:
+                ranges[polarity] = (length, 0.0, 1.0)
+        return ranges
+
+    def time_index(self):
+        """
+        Sorted ISO timestamps and the matching measurement positions, for jumping to a time.
+        """
+        timestamps = self.archive.meta['measurement_timestamp'][self.pos_rows].astype(str)
+        order = np.argsort(timestamps, kind='stable')
+        return timestamps[order], order
+
+def main():
+    parser = argparse.ArgumentParser(description="Export measurements to a memory-mapped archive or import one.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write measurements to an archive directory")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--start", default=None, help="First measurement time")
+    export_parser.add_argument("--end", default=None, help="Last measurement time")
+    export_parser.add_argument("--min-id", type=int, default=None)
+    export_parser.add_argument("--max-id", type=int, default=None)
+    export_parser.add_argument("--dtype", choices=["float32", "float64"], default=DEFAULT_SPECTRUM_DTYPE)
+    import_parser = subparsers.add_parser("import", help="Insert the frames of an archive into the database")
+    import_parser.add_argument("directory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        frames = export_archive(args.directory, start_time=args.start, end_time=args.end, min_id=args.min_id,
+                                max_id=args.max_id, dtype=args.dtype)
+        print(f"Archived {frames} frames to {args.directory} in {time.perf_counter() - start:.2f} s")
+    else:
+        frames = import_archive(args.directory)
+        print(f"Imported {frames} frames from {args.directory} in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
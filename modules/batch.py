@@ -0,0 +1,89 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from modules import sqlite_helper
+from modules import instrumentation
+from modules.analysis import analyze_measurement
+from modules.substance_identifier import SubstanceLibrary, DEFAULT_K0_TOLERANCE
+
+DEFAULT_CHUNK_SIZE = 256
+
+# Library of the current worker process, built once by _init_worker
+_worker_library = None
+
+def _init_worker(library_table):
+    global _worker_library
+    _worker_library = SubstanceLibrary(library_table)
+
+def _process_chunk(rows, tolerance):
+    instrumentation.reset()
+    results = [analyze_measurement(row, tolerance=tolerance, library=_worker_library) for row in rows]
+    return results, instrumentation.snapshot()
+
+def process_measurements_parallel(measurements, tolerance=DEFAULT_K0_TOLERANCE, workers=None,
+                                  chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Analyze merged measurements in a pool of worker processes.
+
+    The library table is read once here and handed to every worker, which builds its
+    own SubstanceLibrary at startup. Results come back in measurement order and are
+    identical to calling analysis.analyze_measurement serially. Stage times and counters
+    of the workers are added to the instrumentation totals of this process.
+
+    Parameters:
+    - measurements: List of merged measurement rows (dicts)
+    - tolerance: K0 tolerance used for the identification
+    - workers: Number of worker processes (default: number of CPUs)
+    - chunk_size: Number of measurements sent to a worker at once
+
+    Returns:
+    - (results, elapsed): list with one entry per measurement (None for skipped ones)
+      and the processing time in seconds
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    library_table = sqlite_helper.get_substance_library()
+    chunks = [measurements[i:i + chunk_size] for i in range(0, len(measurements), chunk_size)]
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(library_table,)) as executor:
+        for chunk_results, stats in executor.map(_process_chunk, chunks, repeat(tolerance)):
+            results.extend(chunk_results)
+            instrumentation.merge(stats)
+    elapsed = time.perf_counter() - start
+
+    return results, elapsed
+
+def process_measurements_stream(measurements, tolerance=DEFAULT_K0_TOLERANCE, workers=None,
+                                chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streaming version of process_measurements_parallel for an iterable of merged rows.
+
+    Chunks are taken from the iterable as workers become free, with at most two chunks
+    per worker in flight, so memory stays bounded however many measurements there are.
+
+    Yields:
+    - (row, result) in measurement order, result is None for skipped measurements
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    library_table = sqlite_helper.get_substance_library()
+    measurements = iter(measurements)
+    chunks = iter(lambda: list(islice(measurements, chunk_size)), [])
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(library_table,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(_process_chunk, chunk, tolerance)))
+            while len(pending) >= 2 * workers or (pending and pending[0][1].done()):
+                yield from _finished_chunk(*pending.popleft())
+        while pending:
+            yield from _finished_chunk(*pending.popleft())
+
+def _finished_chunk(rows, future):
+    results, stats = future.result()
+    instrumentation.merge(stats)
+    return zip(rows, results)
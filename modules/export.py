@@ -0,0 +1,136 @@
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+EXPORT_FORMATS = ('png', 'svg')
+DEFAULT_EXPORT_FORMAT = 'png'
+EXPORT_DPI = 100
+EXPORT_FIGSIZE = (12, 10)
+DEFAULT_EXPORT_CHUNK_SIZE = 32
+PNG_COMPRESS_LEVEL = 1  # zlib level; the default (6) spends more time encoding than drawing
+
+# Figure of the current worker process, created on its first image and reused afterwards
+_worker_panels = None
+
+def export_file_name(position, data, image_format=DEFAULT_EXPORT_FORMAT):
+    """
+    File name of an exported measurement: position and measurement time, safe on every file system.
+    """
+    label = re.sub(r'[^0-9A-Za-z]+', '-', str(data.get('measurement_time') or '')).strip('-')
+    return f"{position:05d}_{label}.{image_format}" if label else f"{position:05d}.{image_format}"
+
+def create_export_panels():
+    """
+    Create a figure with spectrum panels that is not registered with pyplot.
+
+    The figure is drawn on an Agg canvas, so no GUI backend is needed and it is freed as
+    soon as it is no longer referenced.
+    """
+    # matplotlib is imported here so the CLI doesn't pay for it unless images are exported
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from modules.visualization import SpectrumPanels
+
+    fig = Figure(figsize=EXPORT_FIGSIZE)
+    FigureCanvasAgg(fig)
+    ax_pos, ax_neg = fig.subplots(2, 1)
+    panels = SpectrumPanels(fig, ax_pos, ax_neg)
+    # The layout is fitted once. Any layout engine left on the figure makes savefig draw
+    # every image twice, so it is removed again.
+    fig.tight_layout(rect=(0, 0, 1, 0.96))
+    fig.set_layout_engine(None)
+    return panels
+
+def save_measurement_images(panels, items, output_dir, image_format=DEFAULT_EXPORT_FORMAT, dpi=EXPORT_DPI):
+    """
+    Draw (position, data) items one after another on the same panels and save each one.
+    """
+    options = {'pil_kwargs': {'compress_level': PNG_COMPRESS_LEVEL}} if image_format == 'png' else {}
+    paths = []
+    for position, data in items:
+        panels.update(data)
+        path = os.path.join(output_dir, export_file_name(position, data, image_format))
+        panels.fig.savefig(path, format=image_format, dpi=dpi, **options)
+        paths.append(path)
+    return paths
+
+def _render_chunk(items, output_dir, image_format, dpi):
+    global _worker_panels
+    if _worker_panels is None:
+        _worker_panels = create_export_panels()
+    return save_measurement_images(_worker_panels, items, output_dir, image_format, dpi)
+
+def export_measurement_plots(data_list, output_dir, image_format=DEFAULT_EXPORT_FORMAT, dpi=EXPORT_DPI, workers=None,
+                             chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    """
+    Render one image per measurement without a GUI.
+
+    Each worker process draws on a single figure that is updated for every measurement,
+    and the measurements are taken from data_list one chunk at a time with at most two
+    chunks per worker in flight, so memory does not grow with the number of images
+    (data_list can be a lazily analyzing sequence).
+
+    Parameters:
+    - data_list: Analysis results as used by visualization.show_scrollable_plots
+    - output_dir: Directory for the images (created if missing)
+    - image_format: 'png' or 'svg'
+    - dpi: Resolution of raster images
+    - workers: Number of worker processes (default: number of CPUs, 1 renders in this process)
+    - chunk_size: Measurements sent to a worker at once
+
+    Returns:
+    - (paths, elapsed): the written files in measurement order and the time in seconds
+    """
+    if image_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {image_format}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    items = enumerate(data_list)
+    chunks = iter(lambda: list(islice(items, chunk_size)), [])
+
+    start = time.perf_counter()
+    paths = []
+    if workers == 1 or len(data_list) <= chunk_size:
+        panels = create_export_panels()
+        for chunk in chunks:
+            paths.extend(save_measurement_images(panels, chunk, output_dir, image_format, dpi))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_render_chunk, chunk, output_dir, image_format, dpi))
+                if len(pending) >= 2 * workers:
+                    paths.extend(pending.popleft().result())
+            while pending:
+                paths.extend(pending.popleft().result())
+    elapsed = time.perf_counter() - start
+
+    return paths, elapsed
+
+def export_measurement_pdf(data_list, pdf_file):
+    """
+    Write all measurements to a multi-page PDF, one measurement per page.
+
+    Returns:
+    - (pages, elapsed): number of pages and the time in seconds
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    start = time.perf_counter()
+    panels = create_export_panels()
+    pages = 0
+    with PdfPages(pdf_file) as pdf:
+        for data in data_list:
+            panels.update(data)
+            pdf.savefig(panels.fig)
+            pages += 1
+    elapsed = time.perf_counter() - start
+    return pages, elapsed
+
+def print_export_summary(count, elapsed, destination):
+    rate = count / elapsed if elapsed else 0
+    print(f"\nExported {count} images to {destination} in {elapsed:.2f} s ({rate:.1f} images/s)")
@@ -1,19 +1,102 @@
+from functools import lru_cache
 import numpy as np
-from scipy.signal import savgol_filter, find_peaks
-import matplotlib.pyplot as plt
+from modules.spectrum_codec import decode_spectrum
+from modules.instrumentation import timer
 
-def process_spectrum(spectrum):
-    spectrum = np.fromstring(spectrum[2:-1], sep=', ')
+# Peak detection defaults
+SAVGOL_WINDOW_LENGTH = 11
+SAVGOL_POLYORDER = 3
+PEAK_HEIGHT_FRACTION = 0.1  # Minimum peak height relative to the spectrum maximum
+PEAK_DISTANCE = 5
+TOP_PEAKS = 10
 
-    smoothed_spectrum = savgol_filter(spectrum, window_length=11, polyorder=3)
-    
-    peaks, properties = find_peaks(smoothed_spectrum, height=np.max(smoothed_spectrum) * 0.1, distance=5)
-    
-    top_peaks = sorted(zip(peaks, properties['peak_heights']), key=lambda x: x[1], reverse=True)[:10]
-    
-    return [(int(idx), float(height)) for idx, height in top_peaks]
+# K0 conversion defaults
+NOMINAL_TEMPERATURE = 273.15  # Kelvin
+NOMINAL_PRESSURE = 1013.25  # kPa
+CELSIUS_TO_KELVIN = 273.15
+DEFAULT_RESOLUTION = 32.392  # Sampling interval in microseconds
+DEFAULT_POSITION_OFFSET = 31 + 1
+K0_AXIS_CACHE_SIZE = 64
 
-def calculate_k0_value(peaks, temperature, pressure, voltage, drift_tube_length, resolution):
+# Structured array returned by process_spectra_batch, one record per peak
+PEAK_DTYPE = np.dtype([('row', np.int32), ('index', np.int32), ('height', np.float64)])
+
+def process_spectrum(spectrum, window_length=SAVGOL_WINDOW_LENGTH, polyorder=SAVGOL_POLYORDER,
+                     height_fraction=PEAK_HEIGHT_FRACTION, distance=PEAK_DISTANCE, top_k=TOP_PEAKS):
+    """
+    Smooth a single spectrum and return its highest peaks.
+
+    Returns a list of (index, height) tuples sorted by descending height.
+    """
+    # scipy.signal takes about a second to import, so it is only loaded when spectra are processed
+    from scipy.signal import savgol_filter
+
+    # Binary spectra may be stored as float32, smooth in float64 like the text path
+    spectrum = decode_spectrum(spectrum).astype(np.float64)
+
+    with timer('smoothing'):
+        smoothed_spectrum = savgol_filter(spectrum, window_length=window_length, polyorder=polyorder)
+
+    with timer('peak_finding'):
+        threshold = np.max(smoothed_spectrum) * height_fraction
+        peaks, heights = _select_peaks(smoothed_spectrum, threshold, distance, top_k)
+
+    return [(int(idx), float(height)) for idx, height in zip(peaks, heights)]
+
+def process_spectra_batch(matrix, window_length=SAVGOL_WINDOW_LENGTH, polyorder=SAVGOL_POLYORDER,
+                          height_fraction=PEAK_HEIGHT_FRACTION, distance=PEAK_DISTANCE, top_k=TOP_PEAKS):
+    """
+    Detect the top peaks of many spectra at once.
+
+    Smoothing and the height thresholds are computed for the whole matrix in one call,
+    the results match process_spectrum row by row.
+
+    Parameters:
+    - matrix: (n_spectra x n_points) array of spectra
+    - window_length: Savitzky-Golay window length
+    - polyorder: Savitzky-Golay polynomial order
+    - height_fraction: Minimum peak height relative to the maximum of each smoothed spectrum
+    - distance: Minimum distance between peaks in samples
+    - top_k: Number of peaks kept per spectrum
+
+    Returns:
+    - Structured array with PEAK_DTYPE fields (row, index, height), grouped by row and
+      sorted by descending height within each row
+    """
+    from scipy.signal import savgol_filter
+
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.ndim != 2:
+        raise ValueError(f"Expected a 2-D spectra matrix, got shape {matrix.shape}")
+
+    smoothed = savgol_filter(matrix, window_length=window_length, polyorder=polyorder, axis=1)
+    thresholds = smoothed.max(axis=1) * height_fraction
+
+    rows, indices, heights = [], [], []
+    for row, (smoothed_spectrum, threshold) in enumerate(zip(smoothed, thresholds)):
+        peaks, peak_heights = _select_peaks(smoothed_spectrum, threshold, distance, top_k)
+        rows.append(np.full(len(peaks), row, dtype=np.int32))
+        indices.append(peaks)
+        heights.append(peak_heights)
+
+    result = np.empty(sum(len(r) for r in rows), dtype=PEAK_DTYPE)
+    if len(result):
+        result['row'] = np.concatenate(rows)
+        result['index'] = np.concatenate(indices)
+        result['height'] = np.concatenate(heights)
+    return result
+
+def _select_peaks(smoothed_spectrum, threshold, distance, top_k):
+    from scipy.signal import find_peaks
+
+    peaks, properties = find_peaks(smoothed_spectrum, height=threshold, distance=distance)
+    heights = properties['peak_heights']
+    # Stable sort keeps equal heights in index order, like sorted(..., reverse=True)
+    order = np.argsort(-heights, kind='stable')[:top_k]
+    return peaks[order], heights[order]
+
+def calculate_k0_value(peaks, temperature, pressure, voltage, drift_tube_length, resolution=DEFAULT_RESOLUTION,
+                       position_offset=DEFAULT_POSITION_OFFSET):
     """
     Calculate the k0 value based on the peaks, temperature, pressure, drift tube length, and resolution.
     Returns a list of K0 values for each peak.
@@ -23,18 +106,51 @@ def calculate_k0_value(peaks, temperature, pressure, voltage, drift_tube_length,
     k = length_squared / (drift_time * voltage)
     k0 = k * (nominal_temperature / temperature) * (pressure / nominal_pressure)  
     """
-    nominal_temperature = 273.15  # Kelvin
-    nominal_pressure = 1013.25  # kPa
-    position_offset = 31 + 1
+    peak_positions = np.fromiter((peak[0] for peak in peaks), dtype=np.int64, count=len(peaks))
+    k0_values = calculate_k0_values(peak_positions, temperature, pressure, voltage, drift_tube_length,
+                                    resolution, position_offset)
+    return k0_values.tolist()
+
+def calculate_k0_values(peak_positions, temperature, pressure, voltage, drift_tube_length,
+                        resolution=DEFAULT_RESOLUTION, position_offset=DEFAULT_POSITION_OFFSET, rows=None):
+    """
+    Vectorized K0 conversion for the peaks of many measurements.
+
+    Parameters:
+    - peak_positions: Array of peak indices
+    - temperature, pressure, voltage, drift_tube_length: Scalars or per-measurement arrays
+    - resolution: Sampling interval in microseconds
+    - position_offset: Index offset of the first sample
+    - rows: Optional array mapping every peak to its measurement (e.g. the 'row' field of
+      process_spectra_batch). Without it the conditions are broadcast against peak_positions.
+
+    Returns:
+    - Array of K0 values with the shape of peak_positions
+    """
+    conditions = [np.asarray(c, dtype=np.float64) for c in (temperature, pressure, voltage, drift_tube_length)]
+    if rows is not None:
+        conditions = [c[rows] if c.ndim else c for c in conditions]
+    temperature, pressure, voltage, drift_tube_length = conditions
+
+    # Per-measurement constants, evaluated in the same order as the scalar formula
     length_squared = drift_tube_length ** 2
-    temperature = temperature + 273.15  # Convert to Kelvin
+    temperature = temperature + CELSIUS_TO_KELVIN
 
-    k0_values = []
-    for peak in peaks:
-        peak_position = peak[0]  # Peak index
-        drift_time = (peak_position + position_offset) * (resolution / 1000000)  # Drift time in seconds
-        k = length_squared / (drift_time * voltage)  
-        k0 = k * (nominal_temperature / temperature) * (pressure / nominal_pressure) 
-        k0_values.append(k0)
+    drift_time = (np.asarray(peak_positions) + position_offset) * (resolution / 1000000)  # Drift time in seconds
+    k = length_squared / (drift_time * voltage)
+    return k * (NOMINAL_TEMPERATURE / temperature) * (pressure / NOMINAL_PRESSURE)
 
-    return k0_values
\ No newline at end of file
+@lru_cache(maxsize=K0_AXIS_CACHE_SIZE)
+def k0_axis(temperature, pressure, voltage, drift_tube_length, n_points, resolution=DEFAULT_RESOLUTION,
+            position_offset=DEFAULT_POSITION_OFFSET):
+    """
+    K0 value of every drift time index for the given instrument conditions.
+
+    The axis is memoized in a bounded LRU because conditions rarely change between
+    consecutive frames; indexing it gives the same values as calculate_k0_value.
+    The returned array is read-only since it is shared between callers.
+    """
+    axis = calculate_k0_values(np.arange(n_points), temperature, pressure, voltage, drift_tube_length,
+                               resolution, position_offset)
+    axis.flags.writeable = False
+    return axis
@@ -0,0 +1,167 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+PROFILE_KINDS = ('cprofile', 'pyinstrument')
+PROFILE_TOP_FUNCTIONS = 25
+
+# Accumulated per process: stage -> [calls, seconds], counter -> value
+_stages = defaultdict(lambda: [0, 0.0])
+_counters = defaultdict(int)
+# JSON lines event log, None when disabled
+_event_log = None
+
+class StageTimer:
+    """
+    Context manager that adds the time spent in its block to a stage.
+    """
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        entry = _stages[self.stage]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - self.start
+        return False
+
+def timer(stage):
+    """
+    Time a block:
+
+        with timer('decode'):
+            ...
+    """
+    return StageTimer(stage)
+
+def timed(stage):
+    """
+    Decorator that adds the time spent in every call of the function to a stage.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                entry = _stages[stage]
+                entry[0] += 1
+                entry[1] += time.perf_counter() - start
+        return wrapper
+    return decorator
+
+def count(counter, amount=1):
+    _counters[counter] += amount
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+def snapshot():
+    """
+    Current stage times and counters as plain dicts, e.g. to send them from a worker process.
+    """
+    return {'stages': {stage: list(entry) for stage, entry in _stages.items()}, 'counters': dict(_counters)}
+
+def merge(data):
+    """
+    Add a snapshot (of another process) to the totals of this process.
+    """
+    for stage, (calls, seconds) in data['stages'].items():
+        entry = _stages[stage]
+        entry[0] += calls
+        entry[1] += seconds
+    for counter, value in data['counters'].items():
+        _counters[counter] += value
+
+def print_summary(elapsed=None):
+    """
+    Print a table of the stage times and the counters.
+
+    Stages can be nested (smoothing runs inside a measurement) and worker processes
+    run concurrently, so the stage times don't need to add up to the wall time.
+    """
+    print(f"\n{'Stage':<18}{'calls':>10}{'total [s]':>12}{'mean [ms]':>12}")
+    for stage, (calls, seconds) in sorted(_stages.items(), key=lambda item: -item[1][1]):
+        print(f"{stage:<18}{calls:>10}{seconds:>12.3f}{seconds / calls * 1000 if calls else 0:>12.3f}")
+    if elapsed is not None:
+        print(f"{'wall time':<18}{'':>10}{elapsed:>12.3f}")
+    if _counters:
+        print("Counters: " + ", ".join(f"{counter}={value}" for counter, value in sorted(_counters.items())))
+
+def open_event_log(path):
+    """
+    Start writing events as JSON lines to path (overwritten).
+    """
+    global _event_log
+    close_event_log()
+    _event_log = open(path, 'w')
+
+def close_event_log():
+    global _event_log
+    if _event_log is not None:
+        _event_log.close()
+        _event_log = None
+
+def events_enabled():
+    return _event_log is not None
+
+def log_event(event, **fields):
+    """
+    Write one JSON line {"event": event, "time": unix time, **fields} if the event log is open.
+    """
+    if _event_log is None:
+        return
+    _event_log.write(json.dumps(dict(event=event, time=time.time(), **fields), default=str) + '\n')
+
+@contextmanager
+def profiled(kind='cprofile', output=None):
+    """
+    Profile the block with cProfile or pyinstrument and print the report afterwards.
+
+    Parameters:
+    - kind: 'cprofile' or 'pyinstrument' (falls back to cProfile if it is not installed)
+    - output: Optional file for the raw profile (cProfile stats or pyinstrument HTML)
+    """
+    if kind == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed, using cProfile")
+            kind = 'cprofile'
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                print(profiler.output_text(unicode=True, color=False))
+                if output:
+                    with open(output, 'w') as f:
+                        f.write(profiler.output_html())
+            return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if output:
+            profiler.dump_stats(output)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        print(stream.getvalue())
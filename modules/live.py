@@ -0,0 +1,271 @@
+import asyncio
+import csv
+import glob
+import os
+import time
+from collections import deque
+import numpy as np
+from modules import sqlite_helper
+from modules.analysis import analyze_measurement
+from modules.pairing import PolarityPairer, DEFAULT_MAX_PENDING
+from modules.spectrum_codec import spectrum_has_signal
+from modules.substance_identifier import get_default_library, DEFAULT_K0_TOLERANCE
+
+# Frames read ahead of the processing stage; the reader waits when the queue is full
+LIVE_QUEUE_SIZE = 256
+# Frames waiting to be written to the database
+DB_QUEUE_SIZE = 1024
+DB_WRITE_BATCH = 200
+POLL_INTERVAL = 0.02  # Seconds between checks for new data
+LATENCY_WINDOW = 10000  # Number of recent latencies kept for the summary
+LATENCY_TARGET = 0.1  # Seconds
+
+class LiveStats:
+    """
+    Counters and end-to-end latencies of a live session.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.rejected = 0
+        self.pairs = 0
+        self.unpaired = 0
+        self.identified = 0
+        self.late = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.perf_counter()
+
+    def record(self, result, latency):
+        self.pairs += 1
+        self.latencies.append(latency)
+        if latency > LATENCY_TARGET:
+            self.late += 1
+        if result is not None and result['identified_substances']:
+            self.identified += 1
+
+    def print_summary(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"\nLive session: {self.frames} frames, {self.rejected} rejected, {self.pairs} measurements, "
+              f"{self.unpaired} unpaired frames, {self.identified} with identified substances in {elapsed:.1f} s")
+        if self.latencies:
+            latencies = np.asarray(self.latencies) * 1000
+            print(f"Latency [ms]: p50 {np.percentile(latencies, 50):.1f}, p95 {np.percentile(latencies, 95):.1f}, "
+                  f"max {latencies.max():.1f}; {self.late} above {LATENCY_TARGET * 1000:.0f} ms")
+
+def print_live_result(result, latency):
+    """
+    Default result handler: one line per measurement.
+    """
+    if result is None:
+        return
+    names = ', '.join(substance['name'] for substance in result['identified_substances'])
+    print(f"{result['measurement_time']}: {names or 'no substances'} [{latency * 1000:.1f} ms]")
+
+async def tail_csv(csv_file, poll_interval=POLL_INTERVAL, idle_timeout=None, from_start=True, skip_rows=0):
+    """
+    Yield the rows of a CSV file while it is being appended to.
+
+    Partially written lines are held back until their newline arrives.
+
+    Parameters:
+    - csv_file: Path of the growing CSV file (first line is the header)
+    - poll_interval: Seconds to wait when no new data is available
+    - idle_timeout: Stop after this many seconds without new data (default: never)
+    - from_start: Also yield the rows already in the file (default: True)
+    - skip_rows: Data rows at the start of the file not to yield (already imported)
+
+    Yields:
+    - (absolute file path, row number counting the data rows from 1, row dict)
+    """
+    path = os.path.abspath(csv_file)
+    with open(csv_file, newline='') as f:
+        header = None
+        partial = ''
+        row_number = 0
+        skip_existing = not from_start
+        last_data = time.monotonic()
+        while True:
+            line = f.readline()
+            if not line:
+                if skip_existing and header is not None:
+                    skip_existing = False
+                if idle_timeout is not None and time.monotonic() - last_data > idle_timeout:
+                    return
+                await asyncio.sleep(poll_interval)
+                continue
+            last_data = time.monotonic()
+
+            partial += line
+            if not partial.endswith('\n'):
+                continue
+            line, partial = partial, ''
+
+            values = next(csv.reader([line]), None)
+            if not values:
+                continue
+            if header is None:
+                header = values
+                continue
+            row_number += 1
+            if not skip_existing and row_number > skip_rows:
+                yield path, row_number, dict(zip(header, values))
+
+async def watch_directory(directory, pattern='*.csv', poll_interval=POLL_INTERVAL, idle_timeout=None,
+                          rows_done=None):
+    """
+    Yield the rows of every CSV file dropped into a spool directory, in file name order.
+
+    Files must be complete when they appear (write them elsewhere and move them in).
+
+    Parameters:
+    - rows_done: Optional function returning the number of data rows of a file that
+      were already imported; these rows are skipped
+
+    Yields:
+    - (absolute file path, row number counting the data rows from 1, row dict)
+    """
+    seen = set()
+    last_data = time.monotonic()
+    while True:
+        new_files = sorted(path for path in glob.glob(os.path.join(directory, pattern)) if path not in seen)
+        if not new_files:
+            if idle_timeout is not None and time.monotonic() - last_data > idle_timeout:
+                return
+            await asyncio.sleep(poll_interval)
+            continue
+        last_data = time.monotonic()
+
+        for path in new_files:
+            seen.add(path)
+            skip_rows = rows_done(path) if rows_done is not None else 0
+            with open(path, newline='') as f:
+                for row_number, row in enumerate(csv.DictReader(f), 1):
+                    if row_number > skip_rows:
+                        yield os.path.abspath(path), row_number, row
+
+async def run_live(source, tolerance=DEFAULT_K0_TOLERANCE, queue_size=LIVE_QUEUE_SIZE, max_pending=DEFAULT_MAX_PENDING,
+                   store=True, on_result=print_live_result, idle_timeout=None, from_start=True,
+                   poll_interval=POLL_INTERVAL, stats=None):
+    """
+    Analyze frames as they are written to a CSV file or spool directory.
+
+    Three tasks connected by bounded queues: the reader parses new rows, the processor
+    pairs polarities with a bounded buffer and runs peak detection, K0 conversion and
+    identification, and the writer inserts the raw frames into the database in a
+    thread. A full queue makes the upstream task wait, so bursts can't exhaust memory.
+
+    Parameters:
+    - source: Growing CSV file or spool directory
+    - tolerance: K0 tolerance used for the identification
+    - queue_size: Maximum number of frames waiting for processing
+    - max_pending: Frames buffered while a positive frame waits for its negative partner
+    - store: Insert the frames into the measurements table (default: True). The number
+      of rows stored from every file is recorded in csv_imports together with the frames,
+      and rows stored by an earlier session (or load_csv_and_insert) are skipped
+    - on_result: Called with (result, latency in seconds) for every measurement
+    - idle_timeout: Stop after this many seconds without new data (default: run forever)
+    - from_start: Also process the rows already in a CSV file (default: True)
+    - poll_interval: Seconds between checks for new data
+    - stats: Optional LiveStats to fill, so it remains available after an interruption
+
+    Returns:
+    - LiveStats of the session
+    """
+    if stats is None:
+        stats = LiveStats()
+    library = get_default_library()
+    len(library)  # Load the library before the first frame arrives
+
+    # Only stored frames are recorded as imported, so --no-store sessions read everything
+    rows_done = sqlite_helper.get_import_progress if store else None
+    if os.path.isdir(source):
+        rows = watch_directory(source, poll_interval=poll_interval, idle_timeout=idle_timeout, rows_done=rows_done)
+    else:
+        skip_rows = rows_done(source) if rows_done is not None else 0
+        if skip_rows:
+            print(f"Resuming {source} after row {skip_rows}")
+        rows = tail_csv(source, poll_interval=poll_interval, idle_timeout=idle_timeout, from_start=from_start,
+                        skip_rows=skip_rows)
+
+    frame_queue = asyncio.Queue(maxsize=queue_size)
+    db_queue = asyncio.Queue(maxsize=DB_QUEUE_SIZE) if store else None
+
+    def analyze_pair(pos_frame, neg_frame):
+        _, pos_record = pos_frame
+        neg_arrival, neg_record = neg_frame
+        row = dict(pos_record, neg_spectrum=neg_record['neg_spectrum'])
+        result = analyze_measurement(row, tolerance=tolerance, library=library)
+        # The measurement is complete once its last frame has arrived
+        latency = time.perf_counter() - neg_arrival
+        stats.record(result, latency)
+        if on_result is not None:
+            on_result(result, latency)
+
+    async def read():
+        async for path, row_number, row in rows:
+            await frame_queue.put((time.perf_counter(), path, row_number, row))
+        await frame_queue.put(None)
+
+    async def process():
+        pairer = PolarityPairer(max_pending=max_pending)
+        while True:
+            item = await frame_queue.get()
+            if item is None:
+                break
+            arrival, path, row_number, row = item
+            try:
+                record = sqlite_helper.measurement_record(row)
+            except (ValueError, KeyError) as error:
+                stats.rejected += 1
+                print(f"Skipping malformed frame: {error}")
+                continue
+            stats.frames += 1
+            if db_queue is not None:
+                await db_queue.put((record, path, row_number))
+
+            has_pos = spectrum_has_signal(record['pos_spectrum'])
+            has_neg = spectrum_has_signal(record['neg_spectrum'])
+            for pos_frame, neg_frame in pairer.push((arrival, record), has_pos, has_neg):
+                analyze_pair(pos_frame, neg_frame)
+            stats.unpaired = pairer.unpaired
+
+        for pos_frame, neg_frame in pairer.flush():
+            analyze_pair(pos_frame, neg_frame)
+        stats.unpaired = pairer.unpaired
+        if db_queue is not None:
+            await db_queue.put(None)
+
+    async def write():
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            batch = [await db_queue.get()]
+            while len(batch) < DB_WRITE_BATCH and not db_queue.empty():
+                batch.append(db_queue.get_nowait())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            # The last row number per file is stored with the frames, a later session resumes after it
+            progress = {}
+            for _, path, row_number in batch:
+                progress[path] = max(progress.get(path, 0), row_number)
+            await loop.run_in_executor(None, sqlite_helper.insert_measurements, [record for record, _, _ in batch],
+                                       progress)
+
+    tasks = [read(), process()]
+    if store:
+        tasks.append(write())
+    await asyncio.gather(*tasks)
+    return stats
+
+def run_live_blocking(source, **kwargs):
+    """
+    Run a live session until the source goes idle or Ctrl-C, then print the summary.
+    """
+    stats = LiveStats()
+    try:
+        asyncio.run(run_live(source, stats=stats, **kwargs))
+    except KeyboardInterrupt:
+        pass
+    stats.print_summary()
+    return stats
@@ -0,0 +1,125 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+from modules.spectrum_codec import encode_spectrum, decode_spectrum, is_binary_spectrum, DEFAULT_SPECTRUM_DTYPE
+
+MIGRATION_BATCH_SIZE = 1000
+
+def migrate_spectrum_blobs(db_file, output_file=None, dtype=DEFAULT_SPECTRUM_DTYPE, compress=False, delta=False,
+                           batch_size=MIGRATION_BATCH_SIZE, vacuum=True):
+    """
+    Rewrite legacy text spectra in the measurements table as binary blobs.
+
+    Rows that are already binary are left untouched, so the migration can be re-run
+    safely after an interruption.
+
+    Parameters:
+    - db_file: Path of the SQLite database to migrate
+    - output_file: Optional path of a new database; db_file is migrated in place if None
+    - dtype: Sample type of the binary encoding (default: 'float32')
+    - compress: zlib compress the spectra (default: False)
+    - delta: Delta encode the spectra before compressing (default: False)
+    - batch_size: Number of rows rewritten per transaction
+    - vacuum: Run VACUUM afterwards to return the freed pages to the file system
+
+    Returns:
+    - Number of rows converted
+    """
+    if output_file is not None:
+        if os.path.abspath(output_file) == os.path.abspath(db_file):
+            raise ValueError("output_file must differ from db_file, pass None to migrate in place")
+        shutil.copyfile(db_file, output_file)
+        db_file = output_file
+
+    conn = sqlite3.connect(db_file)
+    converted = 0
+    try:
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, pos_spectrum, neg_spectrum FROM measurements WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            for row_id, pos_spectrum, neg_spectrum in rows:
+                if is_binary_spectrum(pos_spectrum) and is_binary_spectrum(neg_spectrum):
+                    continue
+                updates.append((
+                    _convert(pos_spectrum, dtype, compress, delta),
+                    _convert(neg_spectrum, dtype, compress, delta),
+                    row_id))
+            if updates:
+                with conn:
+                    conn.executemany("UPDATE measurements SET pos_spectrum = ?, neg_spectrum = ? WHERE id = ?", updates)
+                converted += len(updates)
+
+        if vacuum:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    return converted
+
+def upgrade_schema(db_file):
+    """
+    Bring the tables of a database up to date (sqlite_helper.ensure_schema), once.
+
+    Readers open databases read-only and never migrate them, so a database created by
+    an older version needs this (or any import) before time or device filters work.
+
+    Returns:
+    - True if the schema was older than sqlite_helper.SCHEMA_VERSION
+    """
+    from modules import sqlite_helper
+
+    conn = sqlite3.connect(db_file)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    sqlite_helper.configure(db_file)
+    try:
+        sqlite_helper.get_engine()
+    finally:
+        sqlite_helper.configure()
+    return version < sqlite_helper.SCHEMA_VERSION
+
+def _convert(blob, dtype, compress, delta):
+    if blob is None or is_binary_spectrum(blob):
+        return blob
+    return encode_spectrum(decode_spectrum(blob), dtype=dtype, compress=compress, delta=delta)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert text encoded spectra in an IMS database to binary blobs "
+                                                 "and bring its schema up to date.")
+    parser.add_argument("db_file", help="SQLite database to migrate")
+    parser.add_argument("-o", "--output", help="Write the migrated database to this file instead of in place")
+    parser.add_argument("--dtype", choices=["float32", "float64"], default=DEFAULT_SPECTRUM_DTYPE)
+    parser.add_argument("--compress", action="store_true", help="zlib compress the spectra")
+    parser.add_argument("--delta", action="store_true", help="Delta encode the spectra (use with --compress)")
+    parser.add_argument("--schema-only", action="store_true",
+                        help="Only add missing tables and columns, keep the spectra as they are")
+    args = parser.parse_args()
+
+    if args.schema_only:
+        upgraded = upgrade_schema(args.db_file)
+        print(f"Schema of {args.db_file} {'upgraded' if upgraded else 'is up to date'}")
+        return
+
+    size_before = os.path.getsize(args.db_file)
+    start = time.perf_counter()
+    converted = migrate_spectrum_blobs(args.db_file, args.output, dtype=args.dtype, compress=args.compress, delta=args.delta)
+    upgrade_schema(args.output or args.db_file)
+    elapsed = time.perf_counter() - start
+    size_after = os.path.getsize(args.output or args.db_file)
+
+    print(f"Converted {converted} rows in {elapsed:.2f} s")
+    print(f"Database size: {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB")
+
+if __name__ == "__main__":
+    main()
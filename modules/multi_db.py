@@ -0,0 +1,282 @@
+import glob
+import heapq
+import os
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from sqlalchemy import select
+from modules import sqlite_helper
+from modules import instrumentation
+from modules.analysis import analyze_measurement, measurement_event
+from modules.streaming import StreamStats, iter_rows, pair_rows, analyze_rows, VIEWER_CACHE_SIZE
+from modules.substance_identifier import SubstanceLibrary, get_default_library, DEFAULT_K0_TOLERANCE
+
+# Columns read from every database
+SCAN_COLUMNS = ["id", "measurement_time", "measurement_timestamp", "device", "pos_spectrum", "neg_spectrum",
+                "temperature_drift_tube", "pressure", "pos_voltage", "neg_voltage", "tube_length"]
+# Sort key of rows whose time could not be parsed, after every ISO timestamp
+MISSING_TIMESTAMP_KEY = '\uffff'
+# Result fields kept in the compact record of a scanned measurement
+RECORD_FIELDS = ['source', 'measurement_id', 'neg_measurement_id', 'measurement_time', 'measurement_timestamp',
+                 'device']
+
+def _time_key(result):
+    return result['measurement_timestamp'] or MISSING_TIMESTAMP_KEY
+
+def expand_db_files(patterns):
+    """
+    Expand file names and glob patterns into a sorted list of existing database files.
+
+    Raises ValueError if a pattern matches nothing, so a typo doesn't silently drop a
+    campaign from the results.
+    """
+    files = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern] if os.path.isfile(pattern) else []
+        if not matches:
+            raise ValueError(f"No database file matches {pattern}")
+        files.update(os.path.abspath(match) for match in matches)
+    return sorted(files)
+
+def _scan_columns():
+    # Databases that were never opened for writing may lack the migrated columns
+    available = sqlite_helper.measurement_columns()
+    return [column for column in SCAN_COLUMNS if column in available]
+
+def _tag(result, db_file, row):
+    result['source'] = db_file
+    result['device'] = row.get('device')
+    timestamp = row.get('measurement_timestamp')
+    if timestamp is None:
+        try:
+            timestamp = sqlite_helper.to_iso_timestamp(row['measurement_time'])
+        except ValueError:
+            pass
+    result['measurement_timestamp'] = timestamp
+    return result
+
+def scan_database(db_file, library_table, tolerance=DEFAULT_K0_TOLERANCE, start_time=None, end_time=None,
+                  device=None, events=False):
+    """
+    Pair and analyze the measurements of one database file (runs in a worker process).
+
+    The file is opened read-only and streamed in chunks (streaming.iter_rows). Only a
+    compact record of every measurement is kept and sent back, the viewer and the export
+    read the spectra again (ScannedMeasurements).
+
+    Parameters:
+    - db_file: SQLite database
+    - library_table: Substance library DataFrame, the same for every database
+    - tolerance: K0 tolerance used for the identification
+    - start_time, end_time, device: Selection as in sqlite_helper.select_columns_from_db
+    - events: Also keep the analysis.measurement_event of every measurement
+
+    Returns:
+    - (records, frames, ranges, snapshot): records sorted by measurement_timestamp, each
+      with source, measurement_id, neg_measurement_id, measurement_time,
+      measurement_timestamp, device, substances (names) and optionally event; the number
+      of rows read, the intensity ranges per polarity as in
+      streaming.StreamedMeasurements.intensity_ranges and the instrumentation snapshot
+    """
+    instrumentation.reset()
+    previous = sqlite_helper.get_db_file()
+    sqlite_helper.configure(db_file)
+    library = SubstanceLibrary(library_table)
+    stats = StreamStats()
+    records = []
+    ranges = {}
+    try:
+        rows = iter_rows(_scan_columns(), start_time=start_time, end_time=end_time, device=device)
+        for row, result in analyze_rows(pair_rows(rows, stats=stats), tolerance=tolerance, library=library):
+            if result is None:
+                continue
+            _tag(result, db_file, row)
+            record = {key: result[key] for key in RECORD_FIELDS}
+            record['substances'] = [substance['name'] for substance in result['identified_substances']]
+            if events:
+                record['event'] = measurement_event(result)
+            records.append(record)
+            for polarity, spectrum in result['spectrums'].items():
+                length, low, high = ranges.get(polarity, (0, np.inf, -np.inf))
+                ranges[polarity] = (max(length, len(spectrum)), min(low, float(spectrum.min())),
+                                    max(high, float(spectrum.max())))
+    finally:
+        sqlite_helper.configure(previous)
+    # Stable, so frames with equal timestamps keep their id order
+    records.sort(key=_time_key)
+    return records, stats.rows, ranges, instrumentation.snapshot()
+
+def scan_databases(db_files, tolerance=DEFAULT_K0_TOLERANCE, start_time=None, end_time=None, device=None,
+                   workers=None, events=False):
+    """
+    Analyze several databases in parallel, one worker process per file.
+
+    The library is read once from the configured database (sqlite_helper.configure /
+    --db) and used for all files. The files are scanned concurrently, so with a worker
+    per file the scan takes about as long as the largest file; the compact per-file
+    records are then merged lazily by measurement timestamp.
+
+    Parameters:
+    - db_files: Database files (see expand_db_files)
+    - tolerance: K0 tolerance used for the identification
+    - start_time, end_time, device: Selection applied to every file
+    - workers: Maximum number of worker processes (default: one per file)
+    - events: Keep the event of every measurement in its record (see scan_database)
+
+    Returns:
+    - (records, ranges, summary): iterator over the records of all files in time order
+      (see scan_database), the intensity ranges of all files and a dict per file with
+      frames, measurements, identified measurements, devices and the seconds until the
+      file was done
+    """
+    library_table = sqlite_helper.get_substance_library()
+    if workers is None:
+        workers = len(db_files)
+    workers = max(1, min(workers, len(db_files)))
+
+    per_file = {}
+    summary = {}
+    ranges = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        started = time.perf_counter()
+        futures = {executor.submit(scan_database, db_file, library_table, tolerance, start_time, end_time, device,
+                                   events): db_file for db_file in db_files}
+        for future in as_completed(futures):
+            db_file = futures[future]
+            records, frames, file_ranges, stats = future.result()
+            instrumentation.merge(stats)
+            per_file[db_file] = records
+            for polarity, (length, low, high) in file_ranges.items():
+                total = ranges.get(polarity, (0, np.inf, -np.inf))
+                ranges[polarity] = (max(total[0], length), min(total[1], low), max(total[2], high))
+            summary[db_file] = {
+                'frames': frames,
+                'measurements': len(records),
+                'identified': sum(1 for record in records if record['substances']),
+                'devices': sorted({record['device'] for record in records if record['device'] is not None}),
+                'seconds': time.perf_counter() - started,
+            }
+
+    merged = heapq.merge(*(per_file[db_file] for db_file in db_files), key=_time_key)
+    return merged, ranges, {db_file: summary[db_file] for db_file in db_files}
+
+class ScannedMeasurements:
+    """
+    Measurements of a multi-database scan, usable as data_list of the viewer and the export.
+
+    Only the source, ids and timestamp of every measurement are kept; indexing reads the
+    two rows back from their database through a read-only engine per file (the configured
+    database is not touched) and analyzes them again, with the most recent results kept
+    in a small cache.
+    """
+
+    def __init__(self, tolerance=DEFAULT_K0_TOLERANCE, library=None, ranges=None, cache_size=VIEWER_CACHE_SIZE):
+        """
+        Parameters:
+        - tolerance, library: Used to analyze the measurements again; the library
+          defaults to the shared instance of the configured database
+        - ranges: Intensity ranges per polarity as returned by scan_databases
+        - cache_size: Number of analyzed measurements kept
+        """
+        self.tolerance = tolerance
+        self.library = library if library is not None else get_default_library()
+        self.cache_size = cache_size
+        self.sources = []
+        self._source_numbers = {}
+        self.source_numbers = array('h')
+        self.pos_ids = array('q')
+        self.neg_ids = array('q')
+        self.timestamps = []
+        self._ranges = dict(ranges or {})
+        self._cache = OrderedDict()
+        self._engines = {}
+
+    def add(self, record):
+        """
+        Append a record of scan_databases (in merged order).
+        """
+        number = self._source_numbers.get(record['source'])
+        if number is None:
+            number = self._source_numbers[record['source']] = len(self.sources)
+            self.sources.append(record['source'])
+        self.source_numbers.append(number)
+        self.pos_ids.append(int(record['measurement_id']))
+        self.neg_ids.append(int(record['neg_measurement_id']))
+        self.timestamps.append(record['measurement_timestamp'] or '')
+
+    def __len__(self):
+        return len(self.pos_ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        number = self.source_numbers[index]
+        pos_id, neg_id = self.pos_ids[index], self.neg_ids[index]
+        engine, columns = self._source(number)
+        table = sqlite_helper.Measurement.__table__
+        with engine.connect() as conn:
+            row = dict(conn.execute(select(*[table.c[column] for column in columns])
+                                    .where(table.c.id == pos_id)).mappings().one())
+            row['neg_spectrum'] = conn.execute(select(table.c.neg_spectrum).where(table.c.id == neg_id)).scalar()
+        row['neg_id'] = neg_id
+        db_file = self.sources[number]
+        result = _tag(analyze_measurement(row, tolerance=self.tolerance, library=self.library), db_file, row)
+
+        self._cache[index] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def _source(self, number):
+        # One read-only engine per file, so reading doesn't touch the configured database
+        if number not in self._engines:
+            engine = sqlite_helper.create_read_only_engine(self.sources[number])
+            with engine.connect() as conn:
+                available = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(measurements)")}
+            self._engines[number] = (engine, [column for column in SCAN_COLUMNS if column in available])
+        return self._engines[number]
+
+    def close(self):
+        """
+        Close the connections to the scanned files.
+        """
+        for engine, _ in self._engines.values():
+            engine.dispose()
+        self._engines.clear()
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def intensity_ranges(self):
+        """
+        Spectrum length and lowest/highest intensity per polarity of all scanned files.
+        """
+        return {polarity: self._ranges.get(polarity, (0, 0.0, 1.0)) for polarity in ('pos', 'neg')}
+
+    def time_index(self):
+        """
+        Sorted ISO timestamps and the matching measurement positions, for jumping to a time.
+        """
+        timestamps = np.asarray(self.timestamps, dtype=str)
+        order = np.argsort(timestamps, kind='stable')
+        return timestamps[order], order
+
+def print_scan_summary(summary, elapsed):
+    """
+    Print one line per database and the totals.
+    """
+    print(f"\n{'database':<32}{'frames':>10}{'measurements':>14}{'identified':>12}{'done [s]':>10}  devices")
+    for db_file, entry in summary.items():
+        print(f"{os.path.basename(db_file):<32}{entry['frames']:>10}{entry['measurements']:>14}"
+              f"{entry['identified']:>12}{entry['seconds']:>10.2f}  {', '.join(entry['devices']) or '-'}")
+    print(f"{len(summary)} databases, {sum(entry['measurements'] for entry in summary.values())} measurements "
+          f"in {elapsed:.2f} s")
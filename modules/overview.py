@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from modules import sqlite_helper
+
+OVERVIEW_ROWS = 2048  # Time rows of the finest level, about one per pixel of a wide screen
+PYRAMID_FACTOR = 4  # Rows merged into one row of the next coarser level
+MIN_LEVEL_ROWS = 128  # No coarser level is built below this many rows
+REDUCTIONS = ('mean', 'max')
+POLARITIES = ('pos', 'neg')
+OVERVIEW_CACHE_DIR = 'overview_cache'  # Created next to the database file
+OVERVIEW_META_FILE = 'overview.json'
+
+class OverviewBuilder:
+    """
+    Decimated time x drift index image of a stream of analyzed measurements.
+
+    Measurements are added in order and binned into at most `rows` time rows, each
+    holding the mean and the maximum of its spectra. When the rows are full, neighbouring
+    rows are merged and the bin size doubles, so memory does not depend on the number of
+    measurements and the total does not have to be known in advance. Identified
+    substances are kept as markers at the drift index of their matched peak, one per row,
+    polarity, index and substance.
+    """
+
+    def __init__(self, rows=OVERVIEW_ROWS):
+        """
+        Parameters:
+        - rows: Number of time rows of the finest level (even)
+        """
+        self.capacity = rows
+        self.bin = 1
+        self.count = 0
+        self.length = {}
+        self.sums = {}
+        self.maxima = {}
+        self.row_counts = np.zeros(rows, dtype=np.int64)
+        self.row_times = np.full(rows, '', dtype=object)
+        self.markers = set()
+        self.substances = {}
+
+    def add(self, result):
+        """
+        Add an analysis result (analysis.analyze_measurement) as the next measurement.
+        """
+        row = self.count // self.bin
+        if row >= self.capacity:
+            self._merge_rows()
+            row = self.count // self.bin
+
+        for polarity in POLARITIES:
+            spectrum = np.asarray(result['spectrums'][polarity], dtype=np.float32)
+            if polarity not in self.length:
+                self.length[polarity] = len(spectrum)
+                self.sums[polarity] = np.zeros((self.capacity, len(spectrum)), dtype=np.float32)
+                self.maxima[polarity] = np.full((self.capacity, len(spectrum)), -np.inf, dtype=np.float32)
+            # Spectra of another length are cut or padded to the first one
+            spectrum = np.resize(spectrum, self.length[polarity]) if len(spectrum) != self.length[polarity] \
+                else spectrum
+            self.sums[polarity][row] += spectrum
+            np.maximum(self.maxima[polarity][row], spectrum, out=self.maxima[polarity][row])
+
+        if not self.row_counts[row]:
+            self.row_times[row] = result['measurement_time']
+        self.row_counts[row] += 1
+
+        peaks_data = result['peaks_data']
+        for substance in result['identified_substances']:
+            code = self.substances.setdefault(substance['name'], len(self.substances))
+            for polarity_code, polarity in enumerate(POLARITIES):
+                k0s = list(peaks_data[f'{polarity}_k0s'])
+                for _, measured_k0, _ in substance[f'{polarity}_matches']:
+                    if measured_k0 in k0s:
+                        index = int(peaks_data[polarity][k0s.index(measured_k0)][0])
+                        self.markers.add((row, polarity_code, index, code))
+        self.count += 1
+
+    def _merge_rows(self):
+        half = self.capacity // 2
+        for polarity in self.length:
+            sums, maxima = self.sums[polarity], self.maxima[polarity]
+            sums[:half] = sums[0::2] + sums[1::2]
+            maxima[:half] = np.maximum(maxima[0::2], maxima[1::2])
+            sums[half:] = 0
+            maxima[half:] = -np.inf
+        self.row_counts[:half] = self.row_counts[0::2] + self.row_counts[1::2]
+        self.row_counts[half:] = 0
+        self.row_times[:half] = self.row_times[0::2]
+        self.row_times[half:] = ''
+        self.markers = {(row // 2, polarity, index, substance) for row, polarity, index, substance in self.markers}
+        self.bin *= 2
+
+    def finish(self):
+        """
+        Build the pyramid from the collected rows (at least one measurement must have been
+        added, the image has no polarities otherwise).
+
+        Returns:
+        - CampaignOverview
+        """
+        rows = -(-self.count // self.bin)
+        counts = self.row_counts[:rows]
+        base = {}
+        for polarity, length in self.length.items():
+            mean = self.sums[polarity][:rows] / np.maximum(counts, 1)[:, None]
+            base[polarity] = {'mean': mean.astype(np.float32), 'max': self.maxima[polarity][:rows].copy()}
+        markers = np.array(sorted(self.markers), dtype=np.int64).reshape(-1, 4)
+        names = sorted(self.substances, key=self.substances.get)
+        return CampaignOverview(build_pyramid(base, self.bin), self.count, self.row_times[:rows].astype(str),
+                                markers, names)
+
+def build_pyramid(base, bin_size, factor=PYRAMID_FACTOR, min_rows=MIN_LEVEL_ROWS):
+    """
+    Coarser levels of a decimated image, each merging factor rows of the previous one.
+
+    Parameters:
+    - base: {polarity: {'mean': rows x length, 'max': rows x length}} of the finest level
+    - bin_size: Measurements per row of the finest level
+
+    Returns:
+    - List of levels from fine to coarse, each {'bin': measurements per row,
+      polarity: {'mean': ..., 'max': ...}}; the mean of a merged row is the mean of its
+      rows (exact except for a partly filled last row)
+    """
+    levels = [dict(base, bin=bin_size)]
+    while base:
+        previous = levels[-1]
+        if len(previous[next(iter(base))]['mean']) <= min_rows:
+            break
+        level = {'bin': previous['bin'] * factor}
+        for polarity in base:
+            mean, maximum = previous[polarity]['mean'], previous[polarity]['max']
+            groups = np.arange(0, len(mean), factor)
+            level[polarity] = {'mean': (np.add.reduceat(mean, groups, axis=0) /
+                                        np.diff(np.append(groups, len(mean)))[:, None]).astype(np.float32),
+                               'max': np.maximum.reduceat(maximum, groups, axis=0)}
+        levels.append(level)
+    return levels
+
+class CampaignOverview:
+    """
+    Multi-resolution time x drift index images of a campaign with substance markers.
+
+    Row r of a level covers the measurements r * bin .. (r + 1) * bin - 1 (positions in
+    the viewer's data_list).
+    """
+
+    def __init__(self, levels, count, row_times, markers, substances):
+        """
+        Parameters:
+        - levels: Pyramid from build_pyramid, finest level first
+        - count: Number of measurements
+        - row_times: Measurement time of the first measurement of every finest row
+        - markers: (n x 4) array of finest row, polarity (0 pos, 1 neg), drift index and
+          substance number
+        - substances: Substance names by number
+        """
+        self.levels = levels
+        self.count = count
+        self.row_times = row_times
+        self.markers = markers
+        self.substances = substances
+
+    def __len__(self):
+        return self.count
+
+    def level_for(self, start, stop, pixels):
+        """
+        Coarsest level that still has at least one row per pixel in [start, stop).
+        """
+        for level in reversed(self.levels):
+            if (stop - start) / level['bin'] >= pixels:
+                return level
+        return self.levels[0]
+
+    def image(self, polarity, start=0, stop=None, pixels=OVERVIEW_ROWS, reduction='max'):
+        """
+        Rows of a polarity that cover the measurements [start, stop) at screen resolution.
+
+        Returns:
+        - (rows x drift index array, first measurement position, last position + 1) of the
+          returned rows, which can extend a little beyond the requested range
+        """
+        stop = self.count if stop is None else stop
+        level = self.level_for(start, stop, pixels)
+        first = max(0, int(start) // level['bin'])
+        last = min(len(level[polarity][reduction]), -(-int(stop) // level['bin']))
+        return level[polarity][reduction][first:last], first * level['bin'], min(last * level['bin'], self.count)
+
+    def marker_positions(self, polarity):
+        """
+        Measurement positions (middle of the finest row), drift indices and substance names
+        of the markers of a polarity.
+        """
+        markers = self.markers[self.markers[:, 1] == POLARITIES.index(polarity)]
+        bin_size = self.levels[0]['bin']
+        positions = np.minimum(markers[:, 0] * bin_size + bin_size / 2, self.count - 0.5)
+        return positions, markers[:, 2], [self.substances[code] for code in markers[:, 3]]
+
+    def time_at(self, position):
+        """
+        Measurement time of the finest row holding a measurement position.
+        """
+        row = int(np.clip(position // self.levels[0]['bin'], 0, len(self.row_times) - 1))
+        return self.row_times[row]
+
+    def intensity_limits(self, polarity, reduction='max'):
+        """
+        Color limits of a polarity from the coarsest level (1st and 99.5th percentile).
+        """
+        values = self.levels[-1][polarity][reduction]
+        if not values.size:
+            return 0.0, 1.0
+        return float(np.percentile(values, 1)), float(np.percentile(values, 99.5))
+
+    def save(self, directory):
+        """
+        Write the overview to a directory of .npy files and a JSON description.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for number, level in enumerate(self.levels):
+            for polarity in POLARITIES:
+                for reduction in REDUCTIONS:
+                    np.save(os.path.join(directory, f'{polarity}_{reduction}_{number}.npy'), level[polarity][reduction])
+        np.save(os.path.join(directory, 'row_times.npy'), self.row_times)
+        np.save(os.path.join(directory, 'markers.npy'), self.markers)
+        meta = {'count': self.count, 'bins': [level['bin'] for level in self.levels], 'substances': self.substances}
+        with open(os.path.join(directory, OVERVIEW_META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+    @staticmethod
+    def load(directory, mmap_mode='r'):
+        """
+        Read an overview written by save; the images are memory-mapped.
+        """
+        with open(os.path.join(directory, OVERVIEW_META_FILE)) as f:
+            meta = json.load(f)
+        levels = []
+        for number, bin_size in enumerate(meta['bins']):
+            level = {'bin': bin_size}
+            for polarity in POLARITIES:
+                level[polarity] = {reduction: np.load(os.path.join(directory, f'{polarity}_{reduction}_{number}.npy'),
+                                                      mmap_mode=mmap_mode) for reduction in REDUCTIONS}
+            levels.append(level)
+        return CampaignOverview(levels, meta['count'], np.load(os.path.join(directory, 'row_times.npy')),
+                                np.load(os.path.join(directory, 'markers.npy')), meta['substances'])
+
+def overview_cache_dir(selection, tolerance, cache_dir=None):
+    """
+    Cache directory of the overview of a database selection.
+
+    The name is a hash of the database file, the selection and the analysis parameters,
+    so another library gives a new entry. New measurements replace the entry instead (see
+    load_overview).
+
+    Parameters:
+    - selection: {'start_time', 'end_time', 'device'} as passed to streaming.iter_rows
+    - tolerance: K0 tolerance of the analysis
+    - cache_dir: Directory holding the cache entries (default: OVERVIEW_CACHE_DIR in the
+      directory of the database file)
+    """
+    from modules.results import processing_parameters
+
+    db_file = os.path.abspath(sqlite_helper.get_db_file())
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(db_file), OVERVIEW_CACHE_DIR)
+
+    selection = {key: value for key, value in selection.items() if value is not None}
+    key = {
+        'db_file': db_file,
+        'selection': {key: str(value) for key, value in selection.items()},
+        'parameters': processing_parameters(tolerance),
+        'overview_rows': OVERVIEW_ROWS,
+    }
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, digest[:16])
+
+def save_overview(directory, overview, measurements, rows):
+    """
+    Store an overview and the ids of its measurements (streaming.StreamedMeasurements),
+    replacing an older entry of the selection.
+
+    Parameters:
+    - rows: (count, highest id) of the selection before it was analyzed, as returned by
+      sqlite_helper.get_measurement_range
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    overview.save(directory)
+    np.save(os.path.join(directory, 'ids.npy'), np.stack([np.frombuffer(measurements.pos_ids, dtype=np.int64),
+                                                          np.frombuffer(measurements.neg_ids, dtype=np.int64)]))
+    with open(os.path.join(directory, 'measurements.json'), 'w') as f:
+        json.dump({'rows': list(rows),
+                   'matches': measurements.matches,
+                   'ranges': {polarity: list(bounds) for polarity, bounds in measurements.intensity_ranges().items()}},
+                  f)
+
+def load_overview(directory, tolerance, selection, rows):
+    """
+    Load a cached overview and the measurements it shows.
+
+    Parameters:
+    - rows: Current (count, highest id) of the selection; an entry saved with other rows
+      is out of date
+
+    Returns:
+    - (CampaignOverview, streaming.StreamedMeasurements), or None if there is no
+      up-to-date cache entry
+    """
+    from modules.streaming import StreamedMeasurements
+
+    if not os.path.exists(os.path.join(directory, 'measurements.json')):
+        return None
+    with open(os.path.join(directory, 'measurements.json')) as f:
+        state = json.load(f)
+    if state.get('rows') != list(rows):
+        return None
+    overview = CampaignOverview.load(directory)
+    pos_ids, neg_ids = np.load(os.path.join(directory, 'ids.npy'))
+    measurements = StreamedMeasurements(tolerance=tolerance, selection=selection)
+    measurements.restore(pos_ids, neg_ids, state['matches'], state['ranges'])
+    return overview, measurements
@@ -0,0 +1,168 @@
+import numpy as np
+from modules.spectrum_codec import spectrum_has_signal
+from modules.instrumentation import timed
+
+# Frames buffered by PolarityPairer while a positive frame waits for its negative partner
+DEFAULT_MAX_PENDING = 64
+
+def polarity_masks(df):
+    """
+    Compute which rows carry positive and negative spectrum data.
+
+    Every spectrum is decoded exactly once.
+
+    Parameters:
+    - df: DataFrame with 'pos_spectrum' and 'neg_spectrum' columns
+
+    Returns:
+    - (has_pos, has_neg) boolean arrays
+    """
+    has_pos = np.fromiter((spectrum_has_signal(s) for s in df["pos_spectrum"]), dtype=bool, count=len(df))
+    has_neg = np.fromiter((spectrum_has_signal(s) for s in df["neg_spectrum"]), dtype=bool, count=len(df))
+    return has_pos, has_neg
+
+def pair_positions(has_pos, has_neg):
+    """
+    Pair positive and negative rows in a single pass.
+
+    Semantics follow the original merge loop:
+    - rows with both polarities are kept as they are
+    - a positive-only row is paired with the next negative-only row, and every row
+      in between is skipped
+    - a positive-only row without any later negative-only row is dropped
+    - negative-only and empty rows on their own are dropped
+
+    Parameters:
+    - has_pos: boolean array, row has positive spectrum data
+    - has_neg: boolean array, row has negative spectrum data
+
+    Returns:
+    - (pos_rows, neg_rows, unpaired) integer position arrays. pos_rows[k] provides the
+      metadata and positive spectrum of pair k and neg_rows[k] its negative spectrum.
+    """
+    has_pos = np.asarray(has_pos, dtype=bool)
+    has_neg = np.asarray(has_neg, dtype=bool)
+    n = len(has_pos)
+    both = has_pos & has_neg
+    pos_only = has_pos & ~has_neg
+    neg_only = has_neg & ~has_pos
+
+    # next_neg_only[i] = first neg-only position > i (n if there is none)
+    positions = np.where(neg_only, np.arange(n), n)
+    next_neg_only = np.empty(n, dtype=np.intp)
+    if n:
+        next_neg_only[:-1] = np.minimum.accumulate(positions[::-1])[::-1][1:]
+        next_neg_only[-1] = n
+
+    pos_rows = []
+    neg_rows = []
+    used = np.zeros(n, dtype=bool)
+    i = 0
+    while i < n:
+        if both[i]:
+            pos_rows.append(i)
+            neg_rows.append(i)
+            used[i] = True
+            i += 1
+        elif pos_only[i] and next_neg_only[i] < n:
+            j = next_neg_only[i]
+            pos_rows.append(i)
+            neg_rows.append(j)
+            used[i] = used[j] = True
+            i = j + 1
+        else:
+            i += 1
+
+    return (np.asarray(pos_rows, dtype=np.intp), np.asarray(neg_rows, dtype=np.intp),
+            np.flatnonzero(~used))
+
+@timed('pairing')
+def pair_polarities(df):
+    """
+    Merge rows that carry only one polarity into complete pos/neg measurements.
+
+    Parameters:
+    - df: DataFrame as returned by sqlite_helper.select_columns_from_db, must contain
+      'pos_spectrum' and 'neg_spectrum'
+
+    Returns:
+    - merged: DataFrame with one row per pair. Metadata comes from the row holding the
+      positive spectrum, the original index labels are kept. If df has an 'id' column,
+      'neg_id' holds the id of the row the negative spectrum came from.
+    - unpaired: positions (0-based, into df) of the rows that were not used in any pair
+    """
+    has_pos, has_neg = polarity_masks(df)
+    pos_rows, neg_rows, unpaired = pair_positions(has_pos, has_neg)
+
+    merged = df.iloc[pos_rows].copy()
+    merged["neg_spectrum"] = df["neg_spectrum"].to_numpy()[neg_rows]
+    if "id" in df.columns:
+        merged["neg_id"] = df["id"].to_numpy()[neg_rows]
+    return merged, unpaired
+
+class PolarityPairer:
+    """
+    Incremental version of pair_positions for frames that arrive one at a time.
+
+    A positive-only frame waits for the next negative-only frame. At most max_pending
+    frames are buffered while waiting; if the buffer overflows the positive frame is
+    given up as unpaired and the buffered frames are paired again from scratch. With a
+    large enough buffer the pairs are the same as pair_positions on the whole sequence.
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING):
+        self.max_pending = max_pending
+        self.unpaired = 0
+        self._pending = None
+        self._buffer = []
+
+    def push(self, frame, has_pos, has_neg):
+        """
+        Add a frame and return the list of (pos_frame, neg_frame) pairs it completed.
+        """
+        pairs = []
+        self._push(frame, has_pos, has_neg, pairs)
+        return pairs
+
+    def flush(self):
+        """
+        End of stream: give up on the waiting frame and pair the buffered frames.
+        """
+        pairs = []
+        while self._pending is not None:
+            self._give_up(pairs)
+        return pairs
+
+    @property
+    def pending(self):
+        """
+        Positive frame waiting for its negative partner (None if no frame is waiting).
+        """
+        return self._pending
+
+    def _push(self, frame, has_pos, has_neg, pairs):
+        if self._pending is None:
+            if has_pos and has_neg:
+                pairs.append((frame, frame))
+            elif has_pos:
+                self._pending = frame
+            else:
+                self.unpaired += 1
+        elif has_neg and not has_pos:
+            pairs.append((self._pending, frame))
+            # Frames between a positive frame and its negative partner are skipped
+            self.unpaired += len(self._buffer)
+            self._pending = None
+            self._buffer = []
+        else:
+            self._buffer.append((frame, has_pos, has_neg))
+            if len(self._buffer) > self.max_pending:
+                self._give_up(pairs)
+
+    def _give_up(self, pairs):
+        buffered = self._buffer
+        self.unpaired += 1
+        self._pending = None
+        self._buffer = []
+        for frame, has_pos, has_neg in buffered:
+            self._push(frame, has_pos, has_neg, pairs)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+from datetime import datetime
+from modules import sqlite_helper
+from modules import ims
+from modules.batch import process_measurements_stream, DEFAULT_CHUNK_SIZE
+from modules.streaming import STREAM_CHUNK_SIZE, StreamStats, StreamedMeasurements, iter_rows, pair_rows, analyze_rows
+from modules.substance_identifier import get_default_library, DEFAULT_K0_TOLERANCE
+
+def processing_parameters(tolerance=DEFAULT_K0_TOLERANCE, library=None):
+    """
+    Parameters that determine the analysis results, as stored in processing_runs.
+    """
+    if library is None:
+        library = get_default_library()
+    len(library)  # Make sure the library is loaded so its version is known
+    return {
+        'tolerance': float(tolerance),
+        'savgol_window': ims.SAVGOL_WINDOW_LENGTH,
+        'savgol_polyorder': ims.SAVGOL_POLYORDER,
+        'height_fraction': ims.PEAK_HEIGHT_FRACTION,
+        'peak_distance': ims.PEAK_DISTANCE,
+        'top_peaks': ims.TOP_PEAKS,
+        'resolution': ims.DEFAULT_RESOLUTION,
+        'position_offset': ims.DEFAULT_POSITION_OFFSET,
+        'library_version': library.version,
+    }
+
+def parameters_key(parameters):
+    """
+    Stable hash of a parameter set, used to find earlier runs with the same settings.
+    """
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+
+def result_rows(result):
+    """
+    Convert an analyze_measurement result into peaks and identifications table rows.
+    """
+    peaks = []
+    peaks_data = result['peaks_data']
+    for polarity, measurement_id in (('pos', result['measurement_id']), ('neg', result['neg_measurement_id'])):
+        for (peak_index, height), k0 in zip(peaks_data[polarity], peaks_data[f'{polarity}_k0s']):
+            peaks.append({
+                'measurement_id': int(measurement_id),
+                'polarity': polarity,
+                'peak_index': int(peak_index),
+                'height': float(height),
+                'k0': float(k0),
+            })
+
+    identifications = []
+    for substance in result['identified_substances']:
+        matches = {key: [[column, float(measured), float(library_k0)] for column, measured, library_k0 in substance[key]]
+                   for key in ('pos_matches', 'neg_matches')}
+        identifications.append({
+            'measurement_id': int(result['measurement_id']),
+            'substance_name': substance['name'],
+            'matches': json.dumps(matches),
+        })
+    return peaks, identifications
+
+def process_incremental(tolerance=DEFAULT_K0_TOLERANCE, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, sinks=()):
+    """
+    Analyze only the measurements added since the last run with the same parameters.
+
+    The new rows are streamed in chunks like the default mode. Peaks and identifications
+    are stored in the peaks and identifications tables every STREAM_CHUNK_SIZE results,
+    and the run with its parameters in processing_runs. The watermark only counts once
+    the run is complete; an interrupted run is removed again.
+
+    A positive-only row after the last negative-only row can still be paired with a
+    future row, which would also skip the rows in between. That row and the rows after
+    it are left for the next run.
+
+    Parameters:
+    - tolerance: K0 tolerance used for the identification
+    - workers: Use batch.process_measurements_stream with this many processes if set
+    - chunk_size: Measurements per work item in parallel mode
+    - sinks: Objects whose add method receives every result (e.g. tracking.PeakTracker)
+
+    Returns:
+    - Dictionary with run_id (None if nothing new was final), the previous and new
+      watermark, and the new measurements as a streaming.StreamedMeasurements
+    """
+    library = get_default_library()
+    parameters = processing_parameters(tolerance, library)
+    key = parameters_key(parameters)
+    watermark = sqlite_helper.get_processing_watermark(key)
+
+    measurements = StreamedMeasurements(tolerance=tolerance, library=library, selection={'min_id': watermark + 1})
+    summary = {'run_id': None, 'previous_watermark': watermark, 'watermark': watermark,
+               'measurements': measurements}
+    stats = StreamStats()
+    pairs = pair_rows(iter_rows(min_id=watermark + 1), stats=stats, final_only=True)
+    if workers:
+        results = process_measurements_stream(pairs, tolerance=tolerance, workers=workers, chunk_size=chunk_size)
+    else:
+        results = analyze_rows(pairs, tolerance=tolerance, library=library)
+
+    run = dict(parameters,
+               created_at=datetime.now().strftime(sqlite_helper.ISO_TIMESTAMP_FORMAT),
+               parameters_key=key)
+    run_id = None
+    peaks, identifications, pending = [], [], 0
+    try:
+        for _, result in results:
+            if result is None:
+                continue
+            measurements.add(result)
+            for sink in sinks:
+                sink.add(result)
+            result_peaks, result_identifications = result_rows(result)
+            peaks.extend(result_peaks)
+            identifications.extend(result_identifications)
+            pending += 1
+            if pending >= STREAM_CHUNK_SIZE:
+                run_id = sqlite_helper.save_processing_run(run, peaks, identifications, run_id)
+                peaks, identifications, pending = [], [], 0
+
+        if stats.first_id is None or stats.pending_id == stats.first_id:
+            # No new rows, or the first new row is still waiting for its partner
+            return summary
+        new_watermark = stats.last_id if stats.pending_id is None else stats.pending_id - 1
+        run_id = sqlite_helper.save_processing_run(run, peaks, identifications, run_id)
+        sqlite_helper.finish_processing_run(run_id, int(stats.first_id), int(new_watermark))
+    except BaseException:
+        if run_id is not None:
+            sqlite_helper.delete_processing_run(run_id)
+        raise
+
+    measurements.selection['max_id'] = int(new_watermark)
+    summary['run_id'] = run_id
+    summary['watermark'] = int(new_watermark)
+    return summary
@@ -0,0 +1,484 @@
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from modules import instrumentation
+from modules.ims import process_spectra_batch, calculate_k0_values, SAVGOL_WINDOW_LENGTH
+from modules.instrumentation import timer
+from modules.results import processing_parameters
+from modules.spectrum_codec import decode_spectrum
+from modules.substance_identifier import get_default_library, DEFAULT_K0_TOLERANCE
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Requests arriving within this many seconds after the first one are processed together
+BATCH_WINDOW = 0.002
+MAX_BATCH_SPECTRA = 512
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+LATENCY_WINDOW = 10000  # Number of recent requests kept for the percentiles
+RATE_WINDOW = 60.0  # Seconds over which the current throughput is computed
+LIBRARY_CHECK_INTERVAL = 10.0  # Seconds between checks whether the library table changed
+CONDITION_FIELDS = ['temperature_drift_tube', 'pressure', 'tube_length']
+POLARITIES = ('pos', 'neg')
+
+def parse_measurements(payload):
+    """
+    Validate the body of an /analyze request.
+
+    The body is either one measurement or {"measurements": [...]}. A measurement has
+    pos_spectrum and/or neg_spectrum (list of intensities or a string in the legacy text
+    format), temperature_drift_tube, pressure, tube_length and the voltage of every
+    polarity it contains; id and measurement_time are optional and echoed back. Spectra
+    need at least SAVGOL_WINDOW_LENGTH finite intensities.
+
+    Returns:
+    - List of dicts with decoded float64 spectra (None for a missing polarity)
+
+    Raises ValueError with a message for the client if the body is invalid.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Expected a JSON object")
+    items = payload['measurements'] if 'measurements' in payload else [payload]
+    if not isinstance(items, list) or not items:
+        raise ValueError("'measurements' must be a non-empty list")
+
+    measurements = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Measurement {position}: expected a JSON object")
+        measurement = {'id': item.get('id'), 'measurement_time': item.get('measurement_time')}
+        fields = list(CONDITION_FIELDS)
+        for polarity in POLARITIES:
+            spectrum = item.get(f'{polarity}_spectrum')
+            if spectrum is not None:
+                try:
+                    if isinstance(spectrum, str):
+                        spectrum = decode_spectrum(spectrum)
+                    spectrum = np.asarray(spectrum, dtype=np.float64)
+                except (TypeError, ValueError) as error:
+                    raise ValueError(f"Measurement {position}: invalid {polarity}_spectrum ({error})")
+                if spectrum.ndim != 1 or len(spectrum) < SAVGOL_WINDOW_LENGTH:
+                    raise ValueError(f"Measurement {position}: {polarity}_spectrum must be a list of at least "
+                                     f"{SAVGOL_WINDOW_LENGTH} intensities (the smoothing window)")
+                if not np.all(np.isfinite(spectrum)):
+                    raise ValueError(f"Measurement {position}: {polarity}_spectrum contains NaN or infinite values")
+                fields.append(f'{polarity}_voltage')
+            measurement[f'{polarity}_spectrum'] = spectrum
+        if measurement['pos_spectrum'] is None and measurement['neg_spectrum'] is None:
+            raise ValueError(f"Measurement {position}: pos_spectrum or neg_spectrum is required")
+        for field in fields:
+            try:
+                measurement[field] = float(item[field])
+            except KeyError:
+                raise ValueError(f"Measurement {position}: {field} is required")
+            except (TypeError, ValueError):
+                raise ValueError(f"Measurement {position}: {field} must be a number")
+            if not np.isfinite(measurement[field]):
+                raise ValueError(f"Measurement {position}: {field} must be finite")
+        measurements.append(measurement)
+    return measurements
+
+def analyze_spectra(measurements, tolerances, library):
+    """
+    Peaks, K0 values and identified substances of many measurements.
+
+    All spectra of the same length are smoothed and searched for peaks with one
+    process_spectra_batch call and the K0 values are converted in one vectorized call,
+    so the results equal analyze_measurement for every measurement. Unlike the CLI,
+    measurements with a single polarity are not skipped: the missing one has no peaks.
+
+    Parameters:
+    - measurements: Measurements as returned by parse_measurements
+    - tolerances: K0 tolerance of every measurement
+    - library: SubstanceLibrary
+
+    Returns:
+    - List of JSON-ready result dicts in the order of the measurements
+    """
+    peaks = [{'pos': [], 'neg': []} for _ in measurements]
+    k0s = [{'pos': [], 'neg': []} for _ in measurements]
+
+    # (length -> list of (measurement position, polarity))
+    groups = {}
+    for position, measurement in enumerate(measurements):
+        for polarity in POLARITIES:
+            spectrum = measurement[f'{polarity}_spectrum']
+            if spectrum is not None and np.any(spectrum != 0):
+                groups.setdefault(len(spectrum), []).append((position, polarity))
+
+    for members in groups.values():
+        matrix = np.vstack([measurements[position][f'{polarity}_spectrum'] for position, polarity in members])
+        with timer('peak_detection'):
+            found = process_spectra_batch(matrix)
+
+        conditions = [[measurements[position][field] for position, _ in members]
+                      for field in CONDITION_FIELDS]
+        voltages = [measurements[position][f'{polarity}_voltage'] for position, polarity in members]
+        with timer('k0_conversion'):
+            k0_values = calculate_k0_values(found['index'], conditions[0], conditions[1], voltages, conditions[2],
+                                            rows=found['row'])
+        for row, index, height, k0 in zip(found['row'], found['index'], found['height'], k0_values):
+            position, polarity = members[row]
+            peaks[position][polarity].append([int(index), float(height)])
+            k0s[position][polarity].append(float(k0))
+
+    results = []
+    with timer('identification'):
+        for measurement, measurement_peaks, measurement_k0s, tolerance in zip(measurements, peaks, k0s, tolerances):
+            substances = library.match(measurement_k0s['pos'], measurement_k0s['neg'], tolerance)
+            results.append({
+                'id': measurement['id'],
+                'measurement_time': measurement['measurement_time'],
+                'peaks': measurement_peaks,
+                'k0s': measurement_k0s,
+                'identified_substances': [{
+                    'name': substance['name'],
+                    'pos_matches': [[column, float(measured), float(library_k0)]
+                                    for column, measured, library_k0 in substance['pos_matches']],
+                    'neg_matches': [[column, float(measured), float(library_k0)]
+                                    for column, measured, library_k0 in substance['neg_matches']],
+                } for substance in substances],
+            })
+    instrumentation.count('spectra_processed', sum(len(members) for members in groups.values()))
+    return results
+
+class ServiceMetrics:
+    """
+    Request counters, latencies and throughput of the service (thread-safe).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.measurements = 0
+        self.batches = 0
+        self.batched_measurements = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        # (finish time, measurements) of recent requests for the current throughput
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def record_request(self, measurements, latency):
+        with self.lock:
+            self.requests += 1
+            self.measurements += measurements
+            self.latencies.append(latency)
+            self.recent.append((time.perf_counter(), measurements))
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def record_batch(self, measurements):
+        with self.lock:
+            self.batches += 1
+            self.batched_measurements += measurements
+
+    def snapshot(self):
+        """
+        Metrics as a JSON-ready dict (latencies in milliseconds).
+        """
+        with self.lock:
+            now = time.perf_counter()
+            uptime = now - self.started
+            recent = [(finished, n) for finished, n in self.recent if now - finished <= RATE_WINDOW]
+            window = min(uptime, RATE_WINDOW)
+            latencies = np.asarray(self.latencies) * 1000
+            metrics = {
+                'uptime_s': uptime,
+                'requests': self.requests,
+                'errors': self.errors,
+                'measurements': self.measurements,
+                'batches': self.batches,
+                'mean_batch_measurements': self.batched_measurements / self.batches if self.batches else 0,
+                'requests_per_s': len(recent) / window if window else 0,
+                'measurements_per_s': sum(n for _, n in recent) / window if window else 0,
+            }
+        if len(latencies):
+            metrics['latency_ms'] = {
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max()),
+            }
+        metrics['stages'] = {stage: {'calls': calls, 'total_s': seconds}
+                             for stage, (calls, seconds) in instrumentation.snapshot()['stages'].items()}
+        return metrics
+
+class MicroBatcher:
+    """
+    Collects the measurements of concurrent requests and analyzes them together.
+
+    A single worker thread takes the first waiting request together with all requests
+    queued behind it, waits up to `window` seconds for more (or until max_spectra are
+    collected) and runs analyze_spectra on all of them, so peak detection runs on
+    matrices instead of single spectra.
+    """
+
+    def __init__(self, library, tolerance=DEFAULT_K0_TOLERANCE, window=BATCH_WINDOW, max_spectra=MAX_BATCH_SPECTRA,
+                 metrics=None):
+        self.library = library
+        self.tolerance = tolerance
+        self.window = window
+        self.max_spectra = max_spectra
+        self.metrics = metrics
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._last_library_check = time.monotonic()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def submit(self, measurements, tolerance=None):
+        """
+        Queue measurements for analysis.
+
+        Returns:
+        - Future resolving to the list of results
+        """
+        future = Future()
+        self._queue.put((measurements, self.tolerance if tolerance is None else tolerance, future))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is None:
+                break
+            jobs = [job]
+            spectra = 2 * len(job[0])
+            deadline = time.perf_counter() + self.window
+            while spectra < self.max_spectra:
+                # Requests that queued up while the previous batch ran are always taken along
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        job = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if job is None:
+                    stopping = True
+                    break
+                jobs.append(job)
+                spectra += 2 * len(job[0])
+            self._process(jobs)
+
+    def _process(self, jobs):
+        if time.monotonic() - self._last_library_check > LIBRARY_CHECK_INTERVAL:
+            self._last_library_check = time.monotonic()
+            try:
+                self.library.refresh_if_changed()
+            except Exception as error:
+                # Keep serving with the loaded library if the database is unavailable
+                print(f"Library check failed: {error}")
+
+        measurements = [measurement for job_measurements, _, _ in jobs for measurement in job_measurements]
+        tolerances = [tolerance for job_measurements, tolerance, _ in jobs for _ in job_measurements]
+        try:
+            results = analyze_spectra(measurements, tolerances, self.library)
+        except Exception as error:
+            if len(jobs) == 1:
+                jobs[0][2].set_exception(error)
+                return
+            # Analyze the requests one by one, so only the request that fails gets the error
+            for job in jobs:
+                self._process([job])
+            return
+        if self.metrics is not None:
+            self.metrics.record_batch(len(measurements))
+        start = 0
+        for job_measurements, _, future in jobs:
+            future.set_result(results[start:start + len(job_measurements)])
+            start += len(job_measurements)
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    GET /health, GET /metrics and POST /analyze, all answered with JSON.
+    """
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, clients sending many requests reuse the connection
+    server_version = 'IMSPeakDetector'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'library_substances': len(self.server.library),
+                                  'parameters': self.server.parameters})
+        elif self.path == '/metrics':
+            self._send_json(200, self.server.metrics.snapshot())
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/analyze':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            length = self.headers.get('Content-Length', '').strip()
+            if not length.isdigit() or int(length) > MAX_REQUEST_BYTES:
+                # The body is not read, so the connection can't be reused for another request
+                self.close_connection = True
+                raise ValueError(f"Content-Length must be given and at most {MAX_REQUEST_BYTES} bytes")
+            length = int(length)
+            payload = json.loads(self.rfile.read(length))
+            measurements = parse_measurements(payload)
+            tolerance = payload.get('tolerance')
+            if tolerance is not None:
+                tolerance = float(tolerance)
+        except (ValueError, TypeError) as error:
+            self.server.metrics.record_error()
+            self._send_json(400, {'error': str(error)})
+            return
+
+        try:
+            results = self.server.batcher.submit(measurements, tolerance).result()
+        except Exception as error:
+            self.server.metrics.record_error()
+            self._send_json(500, {'error': f"{type(error).__name__}: {error}"})
+            return
+        self._send_json(200, {'results': results})
+        self.server.metrics.record_request(len(measurements), time.perf_counter() - start)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class AnalysisServer(ThreadingHTTPServer):
+    """
+    HTTP server holding the library, the processing parameters and the micro-batcher.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, library, tolerance=DEFAULT_K0_TOLERANCE, window=BATCH_WINDOW,
+                 max_spectra=MAX_BATCH_SPECTRA, verbose=False):
+        self.library = library
+        self.parameters = processing_parameters(tolerance, library)
+        self.metrics = ServiceMetrics()
+        self.batcher = MicroBatcher(library, tolerance, window, max_spectra, self.metrics)
+        self.verbose = verbose
+        super().__init__(address, ServiceHandler)
+        self.batcher.start()
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.stop()
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, library=None, tolerance=DEFAULT_K0_TOLERANCE,
+                  window=BATCH_WINDOW, max_spectra=MAX_BATCH_SPECTRA, verbose=False):
+    """
+    Create the analysis server with a loaded library; call serve_forever() to run it.
+
+    Parameters:
+    - host, port: Address to listen on; port 0 picks a free port (see server_address)
+    - library: SubstanceLibrary (default: the shared instance loaded from the database)
+    - tolerance: Default K0 tolerance, requests can override it with "tolerance"
+    - window: Seconds to wait for further requests before a batch is processed
+    - max_spectra: Spectra that end the wait early
+    - verbose: Log every request
+    """
+    if library is None:
+        library = get_default_library()
+    len(library)  # Load the library before the first request arrives
+    # Import scipy.signal now, it takes about a second
+    process_spectra_batch(np.zeros((1, 4 * SAVGOL_WINDOW_LENGTH)))
+    return AnalysisServer((host, port), library, tolerance, window, max_spectra, verbose)
+
+def measurement_payload(row):
+    """
+    Convert a measurement (mapping with spectra as blobs or arrays) into the JSON
+    accepted by /analyze.
+    """
+    payload = {field: float(row[field]) for field in CONDITION_FIELDS}
+    for key in ('id', 'measurement_time'):
+        if row.get(key) is not None:
+            payload[key] = row[key].item() if isinstance(row[key], np.generic) else row[key]
+    for polarity in POLARITIES:
+        if row.get(f'{polarity}_spectrum') is not None:
+            payload[f'{polarity}_spectrum'] = decode_spectrum(row[f'{polarity}_spectrum']).tolist()
+            payload[f'{polarity}_voltage'] = float(row[f'{polarity}_voltage'])
+    return payload
+
+def request_json(url, path, payload=None, timeout=30):
+    """
+    GET (or POST payload to) a service path and return the decoded JSON response.
+
+    Raises urllib.error.HTTPError for error responses; its body holds {"error": ...}.
+    """
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    request = urllib.request.Request(url.rstrip('/') + path, data=data,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def analyze_remote(measurements, url=f'http://{DEFAULT_HOST}:{DEFAULT_PORT}', tolerance=None, timeout=30):
+    """
+    Analyze measurements with a running service.
+
+    Parameters:
+    - measurements: Mappings in the format of the measurements table (or /analyze JSON)
+    - url: Base URL of the service
+    - tolerance: Optional K0 tolerance (default: the one the service was started with)
+
+    Returns:
+    - List of result dicts, see analyze_spectra
+    """
+    payload = {'measurements': [measurement_payload(row) for row in measurements]}
+    if tolerance is not None:
+        payload['tolerance'] = tolerance
+    return request_json(url, '/analyze', payload, timeout)['results']
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve peak detection and substance identification over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", metavar="FILE", default=None, help="SQLite database with the substance library")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_K0_TOLERANCE, help="Default K0 tolerance")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW * 1000,
+                        help="Milliseconds to wait for further requests before processing a batch")
+    parser.add_argument("--max-batch-spectra", type=int, default=MAX_BATCH_SPECTRA)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    if args.db:
+        from modules import sqlite_helper
+        sqlite_helper.configure(args.db)
+    server = create_server(args.host, args.port, tolerance=args.tolerance, window=args.batch_window / 1000,
+                           max_spectra=args.max_batch_spectra, verbose=args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port} ({len(server.library)} substances); Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
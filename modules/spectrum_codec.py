@@ -0,0 +1,119 @@
+import struct
+import zlib
+import numpy as np
+
+# Binary spectrum layout (all little-endian):
+#   magic (4 bytes) | dtype code (1 byte) | flags (1 byte) | reserved (2 bytes) | length (uint64)
+# followed by the samples. The 16 byte header keeps float64 payloads 8-byte aligned.
+SPECTRUM_MAGIC = b'IMS1'
+HEADER_FORMAT = '<4sBBHQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+DTYPE_CODES = {
+    'float32': 1,
+    'float64': 2,
+}
+CODE_DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f8'),
+}
+# Integer views used for the lossless delta encoding of the float bit patterns
+DELTA_DTYPES = {
+    1: np.dtype('<i4'),
+    2: np.dtype('<i8'),
+}
+
+FLAG_ZLIB = 0x01
+FLAG_DELTA = 0x02
+
+DEFAULT_SPECTRUM_DTYPE = 'float32'
+ZLIB_LEVEL = 6
+
+def is_binary_spectrum(blob):
+    """
+    Return True if the blob uses the binary spectrum encoding.
+    """
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:4]) == SPECTRUM_MAGIC
+
+def encode_spectrum(spectrum, dtype=DEFAULT_SPECTRUM_DTYPE, compress=False, delta=False):
+    """
+    Encode a spectrum as a binary blob with a small header.
+
+    Parameters:
+    - spectrum: sequence or array of intensities
+    - dtype: 'float32' or 'float64' (default: 'float32')
+    - compress: zlib compress the payload (default: False)
+    - delta: delta encode the sample bit patterns before compressing (default: False)
+
+    Returns:
+    - bytes ready to be stored in a BLOB column
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported spectrum dtype: {dtype}")
+    code = DTYPE_CODES[dtype]
+    samples = np.ascontiguousarray(spectrum, dtype=CODE_DTYPES[code])
+
+    flags = 0
+    if delta:
+        # Differences of the raw bit patterns are lossless and compress well because
+        # neighbouring samples share their exponent and high mantissa bits
+        bits = samples.view(DELTA_DTYPES[code])
+        samples = np.diff(bits, prepend=bits.dtype.type(0))
+        flags |= FLAG_DELTA
+    payload = samples.tobytes()
+    if compress:
+        payload = zlib.compress(payload, ZLIB_LEVEL)
+        flags |= FLAG_ZLIB
+
+    header = struct.pack(HEADER_FORMAT, SPECTRUM_MAGIC, code, flags, 0, samples.size)
+    return header + payload
+
+def decode_spectrum(blob):
+    """
+    Decode a stored spectrum into a NumPy array.
+
+    Binary blobs without compression or delta encoding are returned as a read-only
+    view on the blob (no copy). Legacy text blobs ("[1.0, 2.0, ...]", optionally
+    wrapped as "b'[...]'") are parsed so both formats stay readable.
+
+    Parameters:
+    - blob: bytes, str or an already decoded array
+
+    Returns:
+    - 1-D NumPy array
+    """
+    if isinstance(blob, np.ndarray):
+        return blob
+    if is_binary_spectrum(blob):
+        magic, code, flags, _, length = struct.unpack_from(HEADER_FORMAT, blob)
+        if code not in CODE_DTYPES:
+            raise ValueError(f"Unknown spectrum dtype code: {code}")
+        dtype = CODE_DTYPES[code]
+        if not flags:
+            return np.frombuffer(blob, dtype=dtype, count=length, offset=HEADER_SIZE)
+
+        payload = memoryview(blob)[HEADER_SIZE:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        if flags & FLAG_DELTA:
+            deltas = np.frombuffer(payload, dtype=DELTA_DTYPES[code], count=length)
+            return np.cumsum(deltas, dtype=deltas.dtype).view(dtype)
+        return np.frombuffer(payload, dtype=dtype, count=length)
+    return decode_legacy_spectrum(blob)
+
+def decode_legacy_spectrum(blob):
+    """
+    Parse a legacy text encoded spectrum.
+    """
+    if isinstance(blob, (bytes, bytearray, memoryview)):
+        blob = bytes(blob).decode('utf-8')
+    text = blob.strip()
+    if text.startswith("b'") and text.endswith("'"):
+        text = text[2:-1]
+    return np.fromstring(text.strip('[]'), sep=', ')
+
+def spectrum_has_signal(blob):
+    """
+    Return True if the stored spectrum contains any non-zero sample.
+    """
+    return bool(np.any(decode_spectrum(blob) != 0))
@@ -1,11 +1,35 @@
-import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, String, Float, BLOB, Table, MetaData
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, BLOB, Table, MetaData, ForeignKey, text, select, insert, update, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+import atexit
 import os
+import time
+from urllib.parse import quote
+from datetime import datetime
+from modules.spectrum_codec import encode_spectrum, decode_spectrum
+from modules.instrumentation import timed
 
 DB_FILE = './db/ims.db'
-engine = create_engine(f'sqlite:///{DB_FILE}')
+# Environment variable overriding DB_FILE, e.g. for cron jobs working on another database
+DB_FILE_ENV = 'IMS_DB_FILE'
+# Set to 1 to open the database as immutable (no locking) for reading, e.g. a snapshot
+# that nothing writes to; files on read-only mounts are always opened that way
+DB_IMMUTABLE_ENV = 'IMS_DB_IMMUTABLE'
+CSV_CHUNK_SIZE = 10000
+# Set on every new connection: wait up to 30 s for locks instead of failing with
+# "database is locked", 64 MiB page cache (negative values are KiB) and 256 MiB of
+# memory-mapped I/O
+CONNECTION_PRAGMAS = {'busy_timeout': 30000, 'cache_size': -65536, 'mmap_size': 268435456}
+# PRAGMA user_version of a database whose tables match the models; raise it when a
+# model changes so existing databases are migrated once by ensure_schema
+SCHEMA_VERSION = 1
+# Columns added to the measurements table by ensure_schema
+MIGRATED_COLUMNS = ('measurement_timestamp', 'device')
+MEASUREMENT_TIME_FORMAT = '%d.%m.%Y %H:%M:%S'
+ISO_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+TIMESTAMP_INPUT_FORMATS = [MEASUREMENT_TIME_FORMAT, ISO_TIMESTAMP_FORMAT, '%Y-%m-%dT%H:%M:%S',
+                           '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d.%m.%Y']
 Base = declarative_base()
 
 class Measurement(Base):
@@ -13,6 +37,10 @@ class Measurement(Base):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     measurement_time = Column(String)
+    # measurement_time as sortable ISO-8601 text (YYYY-MM-DD HH:MM:SS) for range queries
+    measurement_timestamp = Column(String, index=True)
+    # Instrument the frame came from (device column of the CSV export)
+    device = Column(String, index=True)
     channel_1 = Column(Float)
     channel_2 = Column(Float)
     channel_3 = Column(Float)
@@ -32,68 +60,487 @@ class Measurement(Base):
     pos_spectrum = Column(BLOB)
     neg_spectrum = Column(BLOB)
 
-Base.metadata.create_all(engine)
+class CsvImport(Base):
+    """
+    Number of rows of a CSV file that were already imported, used to resume imports.
+    """
+    __tablename__ = 'csv_imports'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    file_name = Column(String, unique=True, nullable=False)
+    rows_processed = Column(Integer, nullable=False, default=0)
+
+class ProcessingRun(Base):
+    """
+    One analysis run with the parameters it used and the measurement ids it covered.
+    """
+    __tablename__ = 'processing_runs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(String)
+    parameters_key = Column(String, index=True, nullable=False)
+    tolerance = Column(Float)
+    savgol_window = Column(Integer)
+    savgol_polyorder = Column(Integer)
+    height_fraction = Column(Float)
+    peak_distance = Column(Integer)
+    top_peaks = Column(Integer)
+    resolution = Column(Float)
+    position_offset = Column(Integer)
+    library_version = Column(String)
+    first_measurement_id = Column(Integer)
+    # All measurements up to this id are final for the parameter set (watermark)
+    last_measurement_id = Column(Integer)
+
+class Peak(Base):
+    __tablename__ = 'peaks'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(Integer, ForeignKey('processing_runs.id'), index=True, nullable=False)
+    # Row the spectrum came from (the negative row of a merged pair for negative peaks)
+    measurement_id = Column(Integer, ForeignKey('measurements.id'), index=True, nullable=False)
+    polarity = Column(String)
+    peak_index = Column(Integer)
+    height = Column(Float)
+    k0 = Column(Float)
+
+class Identification(Base):
+    __tablename__ = 'identifications'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(Integer, ForeignKey('processing_runs.id'), index=True, nullable=False)
+    # Row holding the metadata and positive spectrum of the merged pair
+    measurement_id = Column(Integer, ForeignKey('measurements.id'), index=True, nullable=False)
+    substance_name = Column(String, index=True)
+    # JSON encoded {'pos_matches': [...], 'neg_matches': [...]}
+    matches = Column(String)
+
+def to_iso_timestamp(value):
+    """
+    Convert a measurement time to the ISO-8601 text stored in measurement_timestamp.
+
+    Parameters:
+    - value: datetime, or string in the CSV format (dd.mm.yyyy HH:MM:SS) or ISO format
+      (date only, or with minutes or seconds)
+
+    Returns:
+    - 'YYYY-MM-DD HH:MM:SS' string
+
+    Raises ValueError for strings in an unknown format.
+    """
+    if isinstance(value, datetime):
+        return value.strftime(ISO_TIMESTAMP_FORMAT)
+    value = str(value).strip()
+    for time_format in TIMESTAMP_INPUT_FORMATS:
+        try:
+            return datetime.strptime(value, time_format).strftime(ISO_TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized measurement time: {value!r}")
+
+def ensure_schema(conn):
+    """
+    Bring an existing measurements table up to date with the Measurement model.
+
+    Adds the measurement_timestamp and device columns and their indexes to databases
+    created before they existed and backfills measurement_timestamp from
+    measurement_time with a single UPDATE (the device of old rows stays unknown). Runs
+    once per database, get_engine records SCHEMA_VERSION in PRAGMA user_version afterwards.
+    """
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(measurements)")}
+    for column in MIGRATED_COLUMNS:
+        if column not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE measurements ADD COLUMN {column} VARCHAR")
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_measurements_{column} ON measurements ({column})")
+    # dd.mm.yyyy HH:MM:SS -> yyyy-mm-dd HH:MM:SS
+    conn.exec_driver_sql("""
+        UPDATE measurements
+        SET measurement_timestamp = substr(measurement_time, 7, 4) || '-' || substr(measurement_time, 4, 2) || '-' ||
+                                    substr(measurement_time, 1, 2) || ' ' || substr(measurement_time, 12, 8)
+        WHERE measurement_timestamp IS NULL AND measurement_time GLOB
+              '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+    """)
+
+# Engines and thread-local session registries of this process, keyed by read_only.
+# Created on first use by get_engine / get_session and dropped in forked children.
+_db_file = None
+_engines = {}
+_sessions = {}
+# Columns of the measurements table, read by require_columns
+_measurement_columns = None
+
+def configure(db_file=None):
+    """
+    Select the database file used from now on.
+
+    Parameters:
+    - db_file: Path of the SQLite database; None uses $IMS_DB_FILE or DB_FILE
+
+    Engines created for a previous file are disposed; the new ones are created (and the
+    schema brought up to date) on first use.
+    """
+    global _db_file, _measurement_columns
+    _close_all()
+    _db_file = db_file
+    _measurement_columns = None
+
+def _close_all():
+    for registry in _sessions.values():
+        registry.remove()
+    # The writable engine is closed last: the last connection to a WAL database
+    # checkpoints it and removes the -wal and -shm files, which read-only ones can't
+    for read_only in (True, False):
+        if read_only in _engines:
+            _engines.pop(read_only).dispose()
+    _sessions.clear()
+
+atexit.register(_close_all)
+
+def _reset_after_fork():
+    # Connections inherited from the parent must not be used or closed by the child;
+    # drop the references so the child opens its own connections on first use
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _sessions.clear()
+    _engines.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def on_read_only_mount(path):
+    """
+    True if the file lies on a file system mounted read-only.
+    """
+    if not hasattr(os, 'statvfs'):
+        return False
+    try:
+        return bool(os.statvfs(path).f_flag & os.ST_RDONLY)
+    except OSError:
+        return False
+
+def get_db_file():
+    return _db_file or os.environ.get(DB_FILE_ENV) or DB_FILE
+
+def _set_connection_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in CONNECTION_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+def _set_write_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers continue while a writer commits; the mode is stored in the database file
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def create_read_only_engine(db_file):
+    """
+    New engine opening an existing database file with a mode=ro URI.
+
+    get_engine(read_only=True) uses it for the configured database; it can also be used
+    directly to read other files (e.g. multi_db) without changing the configuration.
+    """
+    path = os.path.abspath(db_file)
+    uri = f'file:{quote(path)}?mode=ro'
+    if os.environ.get(DB_IMMUTABLE_ENV) == '1' or on_read_only_mount(path):
+        # Nobody can write, and a WAL database could not create its -shm file; immutable
+        # skips locking, so it must not be used while a loader may still write
+        uri += '&immutable=1'
+    engine = create_engine(f'sqlite:///{uri}&uri=true')
+    event.listen(engine, 'connect', _set_connection_pragmas)
+    return engine
+
+def get_engine(read_only=False):
+    """
+    Engine of the configured database for the current process.
 
-Session = sessionmaker(bind=engine)
-session = Session()
+    The writable engine creates the tables and migrates the schema on first call if the
+    database is older than SCHEMA_VERSION, and switches it to WAL journaling. The
+    read-only engine opens the existing file with a mode=ro URI and never writes to it,
+    so analysis code can't take write locks and works on read-only media; it is meant
+    for readers running next to a loader. Pooled connections are used by one thread at
+    a time, so the engines can be shared by threads; forked children get their own.
 
-def select_columns_from_db(columns, table='measurements'):
+    Parameters:
+    - read_only: Return the read-only engine (default: False)
+    """
+    global _measurement_columns
+    engine = _engines.get(read_only)
+    if engine is not None:
+        return engine
+    if read_only:
+        # Opened on its own: readers never create tables, migrate or change the journal
+        # mode, so they work on read-only files and leave the database untouched
+        engine = create_read_only_engine(get_db_file())
+    else:
+        engine = create_engine(f'sqlite:///{get_db_file()}')
+        event.listen(engine, 'connect', _set_connection_pragmas)
+        event.listen(engine, 'connect', _set_write_pragmas)
+        with engine.begin() as conn:
+            # Up-to-date databases skip the migration, so opening one does not write to it
+            if conn.exec_driver_sql("PRAGMA user_version").scalar() < SCHEMA_VERSION:
+                Base.metadata.create_all(conn)
+                ensure_schema(conn)
+                conn.exec_driver_sql(f"PRAGMA user_version={SCHEMA_VERSION}")
+                _measurement_columns = None
+    _engines[read_only] = engine
+    return engine
+
+def measurement_columns():
+    """
+    Names of the columns the measurements table of the configured database has.
+    """
+    global _measurement_columns
+    if _measurement_columns is None:
+        with get_engine(read_only=True).connect() as conn:
+            _measurement_columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(measurements)")}
+    return _measurement_columns
+
+def require_columns(columns):
+    """
+    Raise ValueError if the measurements table lacks any of the columns.
+
+    Readers don't migrate, so a database created before a column was added only gets
+    it when it is opened for writing once (an import, or migration.upgrade_schema).
+    """
+    missing = [column for column in columns if column not in measurement_columns()]
+    if missing:
+        raise ValueError(f"{get_db_file()} has no {', '.join(missing)} column yet; upgrade its schema with "
+                         f"'python -m modules.migration --schema-only {get_db_file()}'")
+
+def prepare_selection(start_time=None, end_time=None, device=None):
+    """
+    Make sure the measurements table has the columns a selection filters on.
+
+    A database from before these columns is upgraded once through the writable engine
+    (command line runs filtering on the shipped or an old database); on read-only media
+    it can't be, and ValueError is raised with the upgrade command as by require_columns.
+    """
+    columns = _selection_columns([], start_time, end_time, device)
+    if any(column not in measurement_columns() for column in columns):
+        path = os.path.abspath(get_db_file())
+        if os.access(path, os.W_OK) and not on_read_only_mount(path):
+            print(f"Upgrading the schema of {get_db_file()}")
+            get_engine()
+    require_columns(columns)
+
+def get_session(read_only=False):
+    """
+    Session of the current thread (a new one for every thread and process).
+
+    Parameters:
+    - read_only: Session bound to the read-only engine (default: False)
+    """
+    registry = _sessions.get(read_only)
+    if registry is None:
+        registry = _sessions[read_only] = scoped_session(sessionmaker(bind=get_engine(read_only)))
+    return registry()
+
+def __getattr__(name):
+    # Keep sqlite_helper.engine / sqlite_helper.session working without connecting at import time
+    if name == 'engine':
+        return get_engine()
+    if name == 'session':
+        return get_session()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _selection_columns(columns, start_time=None, end_time=None, device=None):
+    needed = [column for column in columns if column in MIGRATED_COLUMNS]
+    if start_time is not None or end_time is not None:
+        needed.append('measurement_timestamp')
+    if device is not None:
+        needed.append('device')
+    return needed
+
+@timed('db_fetch')
+def select_columns_from_db(columns, table='measurements', start_time=None, end_time=None, min_id=None,
+                          max_id=None, limit=None, offset=None, device=None):
     """
     Select columns from the specified table.
     
     Parameters:
     - columns: List of column names
     - table: Table name (default: 'measurements')
+    - start_time, end_time: Inclusive measurement time range (datetime or any format
+      accepted by to_iso_timestamp), measurements table only
+    - min_id, max_id: Inclusive id range, measurements table only
+    - limit, offset: Row window applied after ordering by id, measurements table only
+    - device: Only rows of this device, measurements table only
     
     Returns:
     - DataFrame with selected data
     """
+    import pandas as pd
+
     if table == 'measurements':
+        require_columns(_selection_columns(columns, start_time, end_time, device))
+        session = get_session(read_only=True)
         query = session.query(*[getattr(Measurement, col) for col in columns])
-        results = query.all()
+        if start_time is not None:
+            query = query.filter(Measurement.measurement_timestamp >= to_iso_timestamp(start_time))
+        if end_time is not None:
+            query = query.filter(Measurement.measurement_timestamp <= to_iso_timestamp(end_time))
+        if min_id is not None:
+            query = query.filter(Measurement.id >= min_id)
+        if max_id is not None:
+            query = query.filter(Measurement.id <= max_id)
+        if device is not None:
+            query = query.filter(Measurement.device == device)
+        query = query.order_by(Measurement.id)
+        if limit is not None:
+            query = query.limit(limit)
+        if offset is not None:
+            query = query.offset(offset)
+        try:
+            results = query.all()
+        finally:
+            # Return the connection to the pool instead of keeping it for the thread
+            session.close()
         df = pd.DataFrame(results, columns=columns)
     else:
         # For other tables, use raw SQL
         columns_str = ', '.join(columns)
         query = f"SELECT {columns_str} FROM {table}"
-        df = pd.read_sql_query(query, engine)
+        df = pd.read_sql_query(query, get_engine(read_only=True))
     
     return df
 
-def load_csv_and_insert(csv_file):
-    df = pd.read_csv(csv_file, header=0)
-    print("DataFrame head:")
-    print(df.head())
-    
-    for index, row in df.iterrows():
-        try:
-            measurement = Measurement(
-                measurement_time = row["measurement_time"],
-                channel_1 = float(row["channel_1"]),
-                channel_2 = float(row["channel_2"]),
-                channel_3 = float(row["channel_3"]),
-                channel_4 = float(row["channel_4"]),
-                channel_5 = float(row["channel_5"]),
-                channel_6 = float(row["channel_6"]),
-                channel_7 = float(row["channel_7"]),
-                channel_8 = float(row["channel_8"]),
-                dilution = float(row["dilution"]),
-                temperature_drift_tube = float(row["temperature_drift_tube"]),
-                pressure = float(row["pressure"]),
-                pos_voltage = float(row["pos_voltage"]),
-                neg_voltage = float(row["neg_voltage"]),
-                tube_length = float(row["tube_length"]),
-                pressure_offset = float(row["press_offset"]),
-                pressure_gradient = float(row["press_gradient"]),
-                pos_spectrum = row["pos_spectrum"].encode('utf-8'),
-                neg_spectrum = row["neg_spectrum"].encode('utf-8')
-            )
-            session.add(measurement)
-        except ValueError as ve:
-            print(f"Error converting row {index}: {ve}")
-    
-    session.commit()
-    print(f"Inserted {len(df)} records into the database.")
+def measurement_record(row):
+    """
+    Convert a CSV row (mapping) into a dictionary of measurements table values.
+
+    Raises ValueError if a numeric field can not be converted.
+    """
+    return {
+        "measurement_time": row["measurement_time"],
+        "measurement_timestamp": _timestamp_or_none(row["measurement_time"]),
+        "device": _text_or_none(row.get("device")),
+        "channel_1": float(row["channel_1"]),
+        "channel_2": float(row["channel_2"]),
+        "channel_3": float(row["channel_3"]),
+        "channel_4": float(row["channel_4"]),
+        "channel_5": float(row["channel_5"]),
+        "channel_6": float(row["channel_6"]),
+        "channel_7": float(row["channel_7"]),
+        "channel_8": float(row["channel_8"]),
+        "dilution": float(row["dilution"]),
+        "temperature_drift_tube": float(row["temperature_drift_tube"]),
+        "pressure": float(row["pressure"]),
+        "pos_voltage": float(row["pos_voltage"]),
+        "neg_voltage": float(row["neg_voltage"]),
+        "tube_length": float(row["tube_length"]),
+        "pressure_offset": float(row["press_offset"]),
+        "pressure_gradient": float(row["press_gradient"]),
+        "pos_spectrum": encode_spectrum(decode_spectrum(row["pos_spectrum"])),
+        "neg_spectrum": encode_spectrum(decode_spectrum(row["neg_spectrum"]))
+    }
+
+def _timestamp_or_none(measurement_time):
+    # Rows with an unexpected time format are still imported, just without timestamp
+    try:
+        return to_iso_timestamp(measurement_time)
+    except ValueError:
+        return None
+
+def _text_or_none(value):
+    # Missing CSV values arrive as None or NaN
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return str(value)
+
+def set_bulk_load_pragmas(conn):
+    """
+    Switch a connection to WAL journaling with relaxed syncing for bulk inserts.
+    """
+    conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+
+def load_csv_and_insert(csv_file, chunk_size=CSV_CHUNK_SIZE, resume=True):
+    """
+    Stream a CSV export into the measurements table.
+
+    The file is read in chunks, every chunk is inserted with one executemany statement
+    and committed together with the import progress, so an interrupted import resumes
+    after the last committed chunk when the same file is loaded again.
+
+    Parameters:
+    - csv_file: Path of the CSV file
+    - chunk_size: Number of CSV rows per chunk/transaction
+    - resume: Skip the rows already imported from this file (default: True)
+
+    Returns:
+    - Number of inserted rows
+    """
+    import pandas as pd
+
+    file_key = os.path.abspath(csv_file)
+    start = time.perf_counter()
+    inserted = 0
+
+    with get_engine().connect() as conn:
+        set_bulk_load_pragmas(conn)
+        done = 0
+        if resume:
+            done = conn.execute(
+                select(CsvImport.rows_processed).where(CsvImport.file_name == file_key)).scalar() or 0
+        conn.commit()
+        if done:
+            print(f"Resuming import of {csv_file} after row {done}")
+
+        reader = pd.read_csv(csv_file, header=0, chunksize=chunk_size, skiprows=range(1, done + 1))
+        for chunk in reader:
+            if not inserted and not done:
+                print("DataFrame head:")
+                print(chunk.head())
+
+            records = []
+            for offset, row in enumerate(chunk.to_dict('records')):
+                try:
+                    records.append(measurement_record(row))
+                except ValueError as ve:
+                    print(f"Error converting row {done + offset}: {ve}")
+
+            done += len(chunk)
+            with conn.begin():
+                if records:
+                    conn.execute(insert(Measurement.__table__), records)
+                conn.execute(_import_progress(file_key, done))
+            inserted += len(records)
+
+    elapsed = time.perf_counter() - start
+    rate = inserted / elapsed if elapsed else 0
+    print(f"Inserted {inserted} records into the database in {elapsed:.2f} s ({rate:.0f} rows/s).")
+    return inserted
+
+def _import_progress(file_key, rows_processed):
+    statement = sqlite_insert(CsvImport.__table__).values(file_name=file_key, rows_processed=rows_processed)
+    return statement.on_conflict_do_update(index_elements=['file_name'], set_={'rows_processed': rows_processed})
+
+def get_import_progress(csv_file):
+    """
+    Number of data rows of a CSV file that were already imported (0 if none).
+    """
+    with get_engine().connect() as conn:
+        return conn.execute(select(CsvImport.rows_processed)
+                            .where(CsvImport.file_name == os.path.abspath(csv_file))).scalar() or 0
+
+def insert_measurements(records, progress=None):
+    """
+    Insert measurement_record dictionaries with one executemany statement.
+
+    Parameters:
+    - records: measurement_record dictionaries
+    - progress: Optional {csv file: data rows imported}, stored in csv_imports in the
+      same transaction, so the import resumes after these rows (see load_csv_and_insert)
+    """
+    if not records and not progress:
+        return
+    with get_engine().begin() as conn:
+        if records:
+            conn.execute(insert(Measurement.__table__), records)
+        for csv_file, rows_processed in (progress or {}).items():
+            conn.execute(_import_progress(os.path.abspath(csv_file), rows_processed))
 
 def get_substance_library():
     """
@@ -103,4 +550,88 @@ def get_substance_library():
                "k0_pos_1", "k0_pos_2", "k0_pos_3", 
                "k0_neg_1", "k0_neg_2", "k0_neg_3"]
     
-    return select_columns_from_db(columns, table='library')
\ No newline at end of file
+    return select_columns_from_db(columns, table='library')
+
+def get_library_fingerprint():
+    """
+    Cheap checksum of the library table, used to detect changes without loading it.
+
+    Returns:
+    - Tuple of row count, highest id and id-weighted sums of the K0 columns and names
+    """
+    query = text("""
+        SELECT COUNT(*), COALESCE(MAX(id), 0),
+               TOTAL(id * k0_pos_1), TOTAL(id * k0_pos_2), TOTAL(id * k0_pos_3),
+               TOTAL(id * k0_neg_1), TOTAL(id * k0_neg_2), TOTAL(id * k0_neg_3),
+               TOTAL(id * LENGTH(substance_name))
+        FROM library
+    """)
+    with get_engine(read_only=True).connect() as conn:
+        return tuple(conn.execute(query).one())
+
+def get_processing_watermark(parameters_key):
+    """
+    Highest measurement id already processed with the given parameter set (0 if none).
+    """
+    query = select(func.max(ProcessingRun.last_measurement_id)).where(ProcessingRun.parameters_key == parameters_key)
+    # Incremental runs store their results, so the writable engine creates processing_runs if needed
+    with get_engine().connect() as conn:
+        return conn.execute(query).scalar() or 0
+
+def get_measurement_range(start_time=None, end_time=None, device=None):
+    """
+    Number of measurements and highest id of a selection, used to detect new rows.
+
+    Parameters:
+    - start_time, end_time, device: Selection as in select_columns_from_db
+    """
+    require_columns(_selection_columns([], start_time, end_time, device))
+    query = select(func.count(Measurement.id), func.coalesce(func.max(Measurement.id), 0))
+    if start_time is not None:
+        query = query.where(Measurement.measurement_timestamp >= to_iso_timestamp(start_time))
+    if end_time is not None:
+        query = query.where(Measurement.measurement_timestamp <= to_iso_timestamp(end_time))
+    if device is not None:
+        query = query.where(Measurement.device == device)
+    with get_engine(read_only=True).connect() as conn:
+        return tuple(conn.execute(query).one())
+
+def save_processing_run(run, peaks, identifications, run_id=None):
+    """
+    Store peaks and identifications of a processing run in one transaction.
+
+    Parameters:
+    - run: Dictionary of ProcessingRun column values, inserted as a new run if run_id is None
+    - peaks: List of Peak column value dictionaries without run_id
+    - identifications: List of Identification column value dictionaries without run_id
+    - run_id: Add the rows to this existing run instead
+
+    Returns:
+    - id of the processing run
+    """
+    with get_engine().begin() as conn:
+        if run_id is None:
+            run_id = conn.execute(insert(ProcessingRun.__table__).values(**run)).inserted_primary_key[0]
+        if peaks:
+            conn.execute(insert(Peak.__table__), [dict(peak, run_id=run_id) for peak in peaks])
+        if identifications:
+            conn.execute(insert(Identification.__table__),
+                         [dict(identification, run_id=run_id) for identification in identifications])
+    return run_id
+
+def finish_processing_run(run_id, first_measurement_id, last_measurement_id):
+    """
+    Set the measurement range of a processing run, which makes its watermark count.
+    """
+    with get_engine().begin() as conn:
+        conn.execute(update(ProcessingRun.__table__).where(ProcessingRun.id == run_id)
+                     .values(first_measurement_id=first_measurement_id, last_measurement_id=last_measurement_id))
+
+def delete_processing_run(run_id):
+    """
+    Remove a processing run with its peaks and identifications, e.g. after an interrupted run.
+    """
+    with get_engine().begin() as conn:
+        conn.execute(delete(Peak.__table__).where(Peak.run_id == run_id))
+        conn.execute(delete(Identification.__table__).where(Identification.run_id == run_id))
+        conn.execute(delete(ProcessingRun.__table__).where(ProcessingRun.id == run_id))
@@ -0,0 +1,212 @@
+from array import array
+from collections import OrderedDict
+import numpy as np
+from modules import sqlite_helper
+from modules.analysis import analyze_measurement
+from modules.pairing import PolarityPairer
+from modules.spectrum_codec import spectrum_has_signal
+from modules.substance_identifier import DEFAULT_K0_TOLERANCE
+
+# Rows read from the database per query
+STREAM_CHUNK_SIZE = 1000
+# Pairs buffered while a positive frame waits for its negative partner; large enough that the
+# pairs equal pairing.pair_polarities on the whole selection for the instrument output
+STREAM_MAX_PENDING = 4096
+VIEWER_CACHE_SIZE = 64
+# Columns needed to analyze a measurement
+STREAM_COLUMNS = ["id", "measurement_time", "pos_spectrum", "neg_spectrum", "temperature_drift_tube", "pressure",
+                  "pos_voltage", "neg_voltage", "tube_length"]
+
+class StreamStats:
+    """
+    Counters of a streaming run, filled while the generators are consumed.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.pairs = 0
+        self.unpaired = 0
+        self.first_id = None
+        self.last_id = None
+        # Id of the frame still waiting for its partner when pair_rows stopped at final pairs
+        self.pending_id = None
+
+def iter_rows(columns=STREAM_COLUMNS, start_time=None, end_time=None, device=None, min_id=None, max_id=None,
+              chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield measurement rows as dicts in id order, reading chunk_size rows per query.
+
+    Every chunk continues after the last id of the previous one (keyset pagination), so
+    only one chunk is held in memory and each query is an index range scan.
+
+    Parameters:
+    - columns: Columns to read, must include 'id'
+    - start_time, end_time, device, min_id, max_id: Selection as in
+      sqlite_helper.select_columns_from_db
+    - chunk_size: Rows per query
+    """
+    next_id = min_id or 0
+    while True:
+        chunk = sqlite_helper.select_columns_from_db(columns, start_time=start_time, end_time=end_time,
+                                                     device=device, min_id=next_id, max_id=max_id,
+                                                     limit=chunk_size)
+        yield from chunk.to_dict('records')
+        if len(chunk) < chunk_size:
+            return
+        next_id = int(chunk['id'].iloc[-1]) + 1
+
+def pair_rows(rows, max_pending=STREAM_MAX_PENDING, stats=None, final_only=False):
+    """
+    Merge single-polarity rows into measurements as they arrive.
+
+    With final_only the stream ends without flushing: a positive frame still waiting for
+    its partner, and every frame after it, could be paired differently once new rows
+    arrive, so they are left out and the id of the waiting frame is stored in
+    stats.pending_id.
+
+    Yields:
+    - Merged rows like pairing.pair_polarities: metadata and positive spectrum of the
+      positive row, neg_spectrum and neg_id of the negative row
+    """
+    pairer = PolarityPairer(max_pending=max_pending)
+
+    def merged(pairs):
+        for pos_row, neg_row in pairs:
+            if stats is not None:
+                stats.pairs += 1
+            yield dict(pos_row, neg_spectrum=neg_row['neg_spectrum'], neg_id=neg_row['id'])
+
+    for row in rows:
+        yield from merged(pairer.push(row, spectrum_has_signal(row['pos_spectrum']),
+                                      spectrum_has_signal(row['neg_spectrum'])))
+        if stats is not None:
+            stats.rows += 1
+            if stats.first_id is None:
+                stats.first_id = row['id']
+            stats.last_id = row['id']
+            stats.unpaired = pairer.unpaired
+    if final_only:
+        if stats is not None and pairer.pending is not None:
+            stats.pending_id = pairer.pending['id']
+        return
+    yield from merged(pairer.flush())
+    if stats is not None:
+        stats.unpaired = pairer.unpaired
+
+def analyze_rows(rows, tolerance=DEFAULT_K0_TOLERANCE, library=None):
+    """
+    Analyze merged rows one at a time.
+
+    Yields:
+    - (row, result), result is None for measurements with an empty spectrum
+    """
+    for row in rows:
+        yield row, analyze_measurement(row, tolerance=tolerance, library=library)
+
+class StreamedMeasurements:
+    """
+    Measurements of a streaming run, usable as data_list of the viewer and the export.
+
+    Only the ids of every analyzed measurement and the intensity ranges are kept while
+    streaming (16 bytes per measurement); indexing reads the two rows back from the
+    database and analyzes them again, with the most recent results kept in a small
+    cache. Iteration streams the selection again instead of reading row by row.
+    """
+
+    def __init__(self, tolerance=DEFAULT_K0_TOLERANCE, library=None, selection=None, cache_size=VIEWER_CACHE_SIZE):
+        """
+        Parameters:
+        - tolerance, library: Used to analyze the measurements again
+        - selection: keyword arguments of iter_rows that reproduce the streamed rows
+        - cache_size: Number of analyzed measurements kept
+        """
+        self.tolerance = tolerance
+        self.library = library
+        self.selection = dict(selection or {})
+        self.cache_size = cache_size
+        self.pos_ids = array('q')
+        self.neg_ids = array('q')
+        self.matches = 0
+        self._ranges = {}
+        self._cache = OrderedDict()
+
+    def add(self, result):
+        """
+        Record an analyzed measurement of the stream.
+        """
+        self.pos_ids.append(int(result['measurement_id']))
+        self.neg_ids.append(int(result['neg_measurement_id']))
+        self.matches += len(result['identified_substances'])
+        for polarity, spectrum in result['spectrums'].items():
+            length, low, high = self._ranges.get(polarity, (0, np.inf, -np.inf))
+            self._ranges[polarity] = (max(length, len(spectrum)), min(low, float(spectrum.min())),
+                                      max(high, float(spectrum.max())))
+
+    def restore(self, pos_ids, neg_ids, matches, ranges):
+        """
+        Set the state of an earlier run (e.g. from the overview cache) instead of streaming.
+
+        Parameters:
+        - pos_ids, neg_ids: Ids of the rows holding the positive and negative spectra
+        - matches: Total number of identified substances
+        - ranges: {polarity: (length, low, high)} as returned by intensity_ranges
+        """
+        self.pos_ids = array('q', np.asarray(pos_ids, dtype=np.int64).tobytes())
+        self.neg_ids = array('q', np.asarray(neg_ids, dtype=np.int64).tobytes())
+        self.matches = int(matches)
+        self._ranges = {polarity: tuple(bounds) for polarity, bounds in ranges.items()}
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self.pos_ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        pos_id, neg_id = self.pos_ids[index], self.neg_ids[index]
+        row = sqlite_helper.select_columns_from_db(STREAM_COLUMNS, min_id=pos_id, max_id=pos_id).to_dict('records')[0]
+        neg = sqlite_helper.select_columns_from_db(["neg_spectrum"], min_id=neg_id, max_id=neg_id)
+        row['neg_spectrum'] = neg['neg_spectrum'].iloc[0]
+        row['neg_id'] = neg_id
+        result = analyze_measurement(row, tolerance=self.tolerance, library=self.library)
+
+        self._cache[index] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def __iter__(self):
+        if not len(self):
+            return
+        selection = dict(self.selection, max_id=max(self.pos_ids[-1], self.neg_ids[-1]))
+        pairs = pair_rows(iter_rows(**selection))
+        for _, result in analyze_rows(pairs, tolerance=self.tolerance, library=self.library):
+            if result is not None:
+                yield result
+
+    def intensity_ranges(self):
+        """
+        Spectrum length and lowest/highest intensity per polarity, collected while streaming.
+        """
+        return {polarity: self._ranges.get(polarity, (0, 0.0, 1.0)) for polarity in ('pos', 'neg')}
+
+    def time_index(self):
+        """
+        Sorted ISO timestamps and the matching measurement positions, for jumping to a time.
+        """
+        pos_ids = np.frombuffer(self.pos_ids, dtype=np.int64)
+        timestamps = np.empty(len(pos_ids), dtype=object)
+        # Read the timestamps in chunks instead of one DataFrame of the whole id range
+        for row in iter_rows(["id", "measurement_timestamp"], min_id=int(pos_ids.min()), max_id=int(pos_ids.max())):
+            position = np.searchsorted(pos_ids, row['id'])
+            if position < len(pos_ids) and pos_ids[position] == row['id']:
+                timestamps[position] = row['measurement_timestamp'] or ''
+        timestamps = timestamps.astype(str)
+        order = np.argsort(timestamps, kind='stable')
+        return timestamps[order], order
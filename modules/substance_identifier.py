@@ -1,53 +1,236 @@
+import hashlib
 import numpy as np
 from modules import sqlite_helper
 
 # Default tolerance for K0 value matching
 DEFAULT_K0_TOLERANCE = 0.02
 
-def identify_substances(pos_k0_values, neg_k0_values, tolerance=DEFAULT_K0_TOLERANCE):
+# Number of K0 columns per polarity in the library table (k0_pos_1..3, k0_neg_1..3)
+K0_COLUMNS_PER_POLARITY = 3
+
+class SubstanceLibrary:
     """
-    Identify substances by comparing K0 values with the library.
-    Returns a list of identified substances.
+    In-memory substance library with sorted K0 arrays for fast matching.
+
+    The library is read from the database once. Call refresh_if_changed() to reload it
+    when the library table was modified, or invalidate() to force a reload on next use.
     """
-    library = sqlite_helper.get_substance_library()
-    identified_substances = []
-    
-    for _, substance in library.iterrows():
-        substance_name = substance['substance_name']
-        
-        # Check positive spectrum K0 values
-        pos_matches = []
-        for i in range(1, 4):  # Check k0_pos_1, k0_pos_2, k0_pos_3
-            k0_col = f'k0_pos_{i}'
-            if substance[k0_col] > 0:  # Only check non-zero values
-                # Check if this K0 value matches any in our detected peaks
-                for k0 in pos_k0_values:
-                    if abs(k0 - substance[k0_col]) <= tolerance:
-                        pos_matches.append((k0_col, k0, substance[k0_col]))
-                        break
-        
-        # Check negative spectrum K0 values
-        neg_matches = []
-        for i in range(1, 4):  # Check k0_neg_1, k0_neg_2, k0_neg_3
-            k0_col = f'k0_neg_{i}'
-            if substance[k0_col] > 0:  # Only check non-zero values
-                # Check if this K0 value matches any in our detected peaks
-                for k0 in neg_k0_values:
-                    if abs(k0 - substance[k0_col]) <= tolerance:
-                        neg_matches.append((k0_col, k0, substance[k0_col]))
-                        break
-        
-        # Count required matches (non-zero K0 values in library)
-        required_pos_matches = sum(1 for i in range(1, 4) if substance[f'k0_pos_{i}'] > 0)
-        required_neg_matches = sum(1 for i in range(1, 4) if substance[f'k0_neg_{i}'] > 0)
-        
-        # Substance is identified if all required K0 values match
-        if (len(pos_matches) == required_pos_matches and required_pos_matches > 0) or \
-           (len(neg_matches) == required_neg_matches and required_neg_matches > 0):
+
+    def __init__(self, library=None):
+        """
+        Parameters:
+        - library: Optional DataFrame in the format of sqlite_helper.get_substance_library().
+          The library is loaded from the database if None.
+        """
+        self.fingerprint = None
+        self._loaded = False
+        if library is not None:
+            self._build(library)
+
+    def reload(self):
+        """
+        Load the library table from the database.
+        """
+        self.fingerprint = sqlite_helper.get_library_fingerprint()
+        self._build(sqlite_helper.get_substance_library())
+
+    def invalidate(self):
+        """
+        Drop the loaded data, the next match reloads the library.
+        """
+        self._loaded = False
+
+    def is_stale(self):
+        """
+        Return True if the library table changed since it was loaded.
+        """
+        return not self._loaded or sqlite_helper.get_library_fingerprint() != self.fingerprint
+
+    def refresh_if_changed(self):
+        """
+        Reload the library if the table changed. Returns True if it was reloaded.
+        """
+        if self.is_stale():
+            self.reload()
+            return True
+        return False
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.names)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.reload()
+
+    def _build(self, library):
+        self.names = library['substance_name'].tolist()
+        # Content hash of the table, recorded with stored results
+        columns = ['substance_name'] + [f'k0_{polarity}_{i}' for polarity in ('pos', 'neg')
+                                        for i in range(1, K0_COLUMNS_PER_POLARITY + 1)]
+        from pandas.util import hash_pandas_object
+        row_hashes = hash_pandas_object(library[columns], index=False).to_numpy()
+        self.version = hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+        self.required = {}
+        self._k0 = {}
+        self._substance = {}
+        self._column = {}
+
+        for polarity in ('pos', 'neg'):
+            columns = [f'k0_{polarity}_{i}' for i in range(1, K0_COLUMNS_PER_POLARITY + 1)]
+            values = library[columns].to_numpy(dtype=np.float64)
+            present = values > 0  # Only non-zero values take part in matching
+            substance_idx, column_idx = np.nonzero(present)
+            k0 = values[substance_idx, column_idx]
+
+            order = np.argsort(k0, kind='stable')
+            self._k0[polarity] = k0[order]
+            self._substance[polarity] = substance_idx[order]
+            self._column[polarity] = column_idx[order]
+            self.required[polarity] = np.count_nonzero(present, axis=1)
+
+        self._loaded = True
+
+    def _candidates(self, polarity, k0_values, tolerance):
+        """
+        All (measured value, library entry) pairs within tolerance.
+
+        Returns:
+        - (measured_idx, entries, distances) arrays ordered by measured value; entries are
+          positions in the sorted K0 array
+        """
+        library_k0 = self._k0[polarity]
+        if not len(k0_values) or not len(library_k0):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+        measured = np.asarray(k0_values, dtype=np.float64)
+        # The search window is widened slightly, the exact comparison below decides
+        slack = tolerance * 1e-9 + 1e-12
+        lower = np.searchsorted(library_k0, measured - tolerance - slack, side='left')
+        upper = np.searchsorted(library_k0, measured + tolerance + slack, side='right')
+
+        # Expand the windows into (measured, entry) candidate pairs, ordered by measured value
+        lengths = upper - lower
+        measured_idx = np.repeat(np.arange(len(measured)), lengths)
+        entries = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(lower, lengths)
+        distances = np.abs(measured[measured_idx] - library_k0[entries])
+        within = distances <= tolerance
+        return measured_idx[within], entries[within], distances[within]
+
+    def _match_polarity(self, polarity, k0_values, tolerance):
+        """
+        Find the first measured K0 value within tolerance of every library entry.
+
+        Returns:
+        - (entries, measured) arrays: matched entry positions in the sorted K0 array and
+          the position of the first matching value in k0_values
+        """
+        measured_idx, entries, _ = self._candidates(polarity, k0_values, tolerance)
+        # Keep the first measured value for every entry, like the original break
+        entries, first = np.unique(entries, return_index=True)
+        return entries, measured_idx[first]
+
+    def identification_tolerances(self, pos_k0_values, neg_k0_values, max_tolerance):
+        """
+        Smallest tolerance at which match() identifies every substance.
+
+        A substance is identified at tolerance t if, in one polarity, every one of its K0
+        values has a measured value within t. So the smallest such t is the largest of
+        the nearest distances of its K0 values, minimized over the polarities. One search
+        with max_tolerance answers match() for every tolerance up to it:
+        match(..., t) returns exactly the substances with identification_tolerances <= t.
+
+        Returns:
+        - float array with one value per substance, inf if not identified within
+          max_tolerance
+        """
+        self._ensure_loaded()
+        result = np.full(len(self.names), np.inf)
+        for polarity, k0_values in (('pos', pos_k0_values), ('neg', neg_k0_values)):
+            _, entries, distances = self._candidates(polarity, k0_values, max_tolerance)
+            # Nearest measured value of every matched entry
+            order = np.lexsort((distances, entries))
+            entries, first = np.unique(entries[order], return_index=True)
+            distances = distances[order][first]
+
+            substances = self._substance[polarity][entries]
+            counts = np.bincount(substances, minlength=len(self.names))
+            required = self.required[polarity]
+            needed = np.zeros(len(self.names))
+            np.maximum.at(needed, substances, distances)
+            complete = (required > 0) & (counts == required)
+            result[complete] = np.minimum(result[complete], needed[complete])
+        return result
+
+    def match(self, pos_k0_values, neg_k0_values, tolerance=DEFAULT_K0_TOLERANCE):
+        """
+        Identify substances by comparing K0 values with the library.
+
+        A substance is identified if all of its non-zero K0 values of one polarity match.
+
+        Returns:
+        - List of {'name', 'pos_matches', 'neg_matches'} dicts in library order. Matches
+          are (k0 column, measured K0, library K0) tuples.
+        """
+        self._ensure_loaded()
+
+        found = {}
+        complete = np.zeros(len(self.names), dtype=bool)
+        for polarity, k0_values in (('pos', pos_k0_values), ('neg', neg_k0_values)):
+            entries, measured_idx = self._match_polarity(polarity, k0_values, tolerance)
+            substances = self._substance[polarity][entries]
+            counts = np.bincount(substances, minlength=len(self.names))
+            required = self.required[polarity]
+            complete |= (required > 0) & (counts == required)
+            found[polarity] = (entries, measured_idx, substances)
+
+        identified_substances = []
+        identified = np.flatnonzero(complete)
+        if not len(identified):
+            return identified_substances
+
+        matches = {}
+        for polarity, k0_values in (('pos', pos_k0_values), ('neg', neg_k0_values)):
+            entries, measured_idx, substances = found[polarity]
+            keep = np.isin(substances, identified)
+            by_substance = {}
+            for entry, idx, substance in zip(entries[keep], measured_idx[keep], substances[keep]):
+                column = self._column[polarity][entry]
+                by_substance.setdefault(substance, []).append(
+                    (column, (f'k0_{polarity}_{column + 1}', k0_values[idx], float(self._k0[polarity][entry]))))
+            matches[polarity] = by_substance
+
+        for substance in identified:
             identified_substances.append({
-                'name': substance_name,
-                'pos_matches': pos_matches,
-                'neg_matches': neg_matches
+                'name': self.names[substance],
+                'pos_matches': [m for _, m in sorted(matches['pos'].get(substance, []))],
+                'neg_matches': [m for _, m in sorted(matches['neg'].get(substance, []))]
             })
-    
-    return identified_substances
+
+        return identified_substances
+
+_default_library = None
+
+def get_default_library():
+    """
+    Return the shared library instance, loading it on first use.
+    """
+    global _default_library
+    if _default_library is None:
+        _default_library = SubstanceLibrary()
+    return _default_library
+
+def identify_substances(pos_k0_values, neg_k0_values, tolerance=DEFAULT_K0_TOLERANCE, library=None):
+    """
+    Identify substances by comparing K0 values with the library.
+    Returns a list of identified substances.
+
+    Parameters:
+    - pos_k0_values: K0 values of the positive spectrum peaks
+    - neg_k0_values: K0 values of the negative spectrum peaks
+    - tolerance: Maximum absolute K0 difference for a match
+    - library: SubstanceLibrary to use (default: the shared instance)
+    """
+    if library is None:
+        library = get_default_library()
+    return library.match(pos_k0_values, neg_k0_values, tolerance)
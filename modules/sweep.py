@@ -0,0 +1,225 @@
+import itertools
+import time
+import numpy as np
+import pandas as pd
+from modules import ims
+from modules.instrumentation import timer
+from modules.spectrum_codec import decode_spectrum
+from modules.substance_identifier import get_default_library
+
+DEFAULT_SWEEP_TOLERANCES = [0.01, 0.02, 0.05, 0.1, 0.2]
+DEFAULT_SWEEP_SAVGOL = [(ims.SAVGOL_WINDOW_LENGTH, ims.SAVGOL_POLYORDER)]
+DEFAULT_SWEEP_HEIGHT_FRACTIONS = [ims.PEAK_HEIGHT_FRACTION]
+POLARITIES = ('pos', 'neg')
+
+class ParameterSweep:
+    """
+    Identification results of the same measurements under many parameter sets.
+
+    Intermediate results are shared between parameter sets instead of rerunning the
+    whole analysis for each of them:
+
+    - the spectra are decoded once
+    - every Savitzky-Golay setting smooths all spectra once (cached)
+    - peaks are found once per setting at the lowest height fraction; a higher
+      fraction only drops peaks below its threshold, which gives the same peaks as
+      find_peaks with that threshold (the distance rule only ever removes a peak in
+      favour of a higher one)
+    - the library is searched once per measurement with the largest tolerance, every
+      smaller tolerance is a comparison (SubstanceLibrary.identification_tolerances)
+
+    Results are the same as analyze_measurement with the corresponding parameters.
+    """
+
+    def __init__(self, measurements, library=None, distance=ims.PEAK_DISTANCE, top_k=ims.TOP_PEAKS):
+        """
+        Parameters:
+        - measurements: Merged measurement rows (list of dicts or DataFrame) as returned by
+          pairing.pair_polarities; rows with an empty spectrum are skipped like in the CLI
+        - library: SubstanceLibrary (default: the shared instance)
+        - distance: Minimum distance between peaks in samples
+        - top_k: Number of peaks kept per spectrum
+        """
+        if isinstance(measurements, pd.DataFrame):
+            measurements = measurements.to_dict('records')
+        self.library = library if library is not None else get_default_library()
+        self.distance = distance
+        self.top_k = top_k
+
+        with timer('decode'):
+            spectra = {polarity: [] for polarity in POLARITIES}
+            rows = []
+            for row in measurements:
+                pos = decode_spectrum(row['pos_spectrum'])
+                neg = decode_spectrum(row['neg_spectrum'])
+                if np.all(pos == 0) or np.all(neg == 0):
+                    continue
+                spectra['pos'].append(pos)
+                spectra['neg'].append(neg)
+                rows.append(row)
+            self.spectra = {polarity: np.vstack(spectra[polarity]).astype(np.float64) if rows else
+                            np.empty((0, 0)) for polarity in POLARITIES}
+        self.skipped = len(measurements) - len(rows)
+        self.conditions = {column: np.array([row[column] for row in rows], dtype=np.float64)
+                           for column in ('temperature_drift_tube', 'pressure', 'pos_voltage', 'neg_voltage',
+                                          'tube_length')}
+        self._smoothed = {}
+        self._candidates = {}
+
+    def __len__(self):
+        return len(self.spectra['pos'])
+
+    def smoothed(self, window_length, polyorder):
+        """
+        Smoothed spectra of both polarities for a Savitzky-Golay setting (cached).
+        """
+        key = (window_length, polyorder)
+        if key not in self._smoothed:
+            from scipy.signal import savgol_filter
+            with timer('smoothing'):
+                self._smoothed[key] = {polarity: savgol_filter(self.spectra[polarity], window_length=window_length,
+                                                               polyorder=polyorder, axis=1)
+                                       for polarity in POLARITIES}
+        return self._smoothed[key]
+
+    def candidate_peaks(self, window_length, polyorder, height_fraction):
+        """
+        All peaks above height_fraction of the spectrum maximum (cached per setting).
+
+        A cached search with a lower fraction is reused.
+
+        Returns:
+        - {polarity: (rows, indices, heights, maxima)}: peak arrays grouped by spectrum and
+          sorted by descending height within a spectrum, and the maximum of every smoothed
+          spectrum
+        """
+        key = (window_length, polyorder)
+        cached = self._candidates.get(key)
+        if cached is not None and cached[0] <= height_fraction:
+            return cached[1]
+
+        from scipy.signal import find_peaks
+        smoothed = self.smoothed(window_length, polyorder)
+        candidates = {}
+        with timer('peak_finding'):
+            for polarity in POLARITIES:
+                maxima = smoothed[polarity].max(axis=1) if len(self) else np.empty(0)
+                rows, indices, heights = [], [], []
+                for row, (spectrum, maximum) in enumerate(zip(smoothed[polarity], maxima)):
+                    peaks, properties = find_peaks(spectrum, height=maximum * height_fraction, distance=self.distance)
+                    order = np.argsort(-properties['peak_heights'], kind='stable')
+                    rows.append(np.full(len(peaks), row, dtype=np.intp))
+                    indices.append(peaks[order])
+                    heights.append(properties['peak_heights'][order])
+                candidates[polarity] = (np.concatenate(rows) if rows else np.empty(0, dtype=np.intp),
+                                        np.concatenate(indices) if indices else np.empty(0, dtype=np.intp),
+                                        np.concatenate(heights) if heights else np.empty(0), maxima)
+        self._candidates[key] = (height_fraction, candidates)
+        return candidates
+
+    def peaks(self, window_length, polyorder, height_fraction):
+        """
+        Top peaks of every spectrum, the same as process_spectrum with these parameters.
+
+        Returns:
+        - {polarity: (rows, indices, heights)} grouped by spectrum, highest peak first
+        """
+        result = {}
+        for polarity, (rows, indices, heights, maxima) in \
+                self.candidate_peaks(window_length, polyorder, height_fraction).items():
+            # Same threshold and comparison as find_peaks(height=...)
+            keep = heights >= maxima[rows] * height_fraction
+            rows, indices, heights = rows[keep], indices[keep], heights[keep]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+            top = rank < self.top_k
+            result[polarity] = (rows[top], indices[top], heights[top])
+        return result
+
+    def identification_tolerances(self, window_length, polyorder, height_fraction, max_tolerance):
+        """
+        Smallest identifying tolerance of every substance in every measurement.
+
+        Returns:
+        - (n_measurements x n_substances) array, inf where a substance is not identified
+          within max_tolerance
+        - Mean number of peaks per spectrum
+        """
+        peaks = self.peaks(window_length, polyorder, height_fraction)
+        k0s = {}
+        with timer('k0_conversion'):
+            for polarity, (rows, indices, _) in peaks.items():
+                values = ims.calculate_k0_values(indices, self.conditions['temperature_drift_tube'],
+                                                 self.conditions['pressure'], self.conditions[f'{polarity}_voltage'],
+                                                 self.conditions['tube_length'], rows=rows)
+                bounds = np.searchsorted(rows, np.arange(len(self) + 1))
+                k0s[polarity] = [values[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        with timer('identification'):
+            tolerances = np.full((len(self), len(self.library)), np.inf)
+            for row in range(len(self)):
+                tolerances[row] = self.library.identification_tolerances(k0s['pos'][row], k0s['neg'][row],
+                                                                         max_tolerance)
+        mean_peaks = (len(peaks['pos'][0]) + len(peaks['neg'][0])) / (2 * len(self)) if len(self) else 0.0
+        return tolerances, mean_peaks
+
+    def run(self, tolerances=DEFAULT_SWEEP_TOLERANCES, savgol_settings=DEFAULT_SWEEP_SAVGOL,
+            height_fractions=DEFAULT_SWEEP_HEIGHT_FRACTIONS):
+        """
+        Evaluate every combination of the parameter grid.
+
+        Parameters:
+        - tolerances: K0 tolerances
+        - savgol_settings: (window_length, polyorder) pairs
+        - height_fractions: Minimum peak heights relative to the spectrum maximum
+
+        Returns:
+        - DataFrame with one row per combination: the parameters, the number of
+          measurements, the mean number of peaks per spectrum, the measurements with at
+          least one identified substance, all identifications and distinct substances
+        """
+        tolerances = sorted(tolerances)
+        height_fractions = sorted(height_fractions)
+        rows = []
+        for (window_length, polyorder), height_fraction in itertools.product(savgol_settings, height_fractions):
+            # Search with the lowest fraction first, so later fractions reuse its peaks
+            needed, mean_peaks = self.identification_tolerances(window_length, polyorder, height_fraction,
+                                                                tolerances[-1])
+            for tolerance in tolerances:
+                identified = needed <= tolerance
+                rows.append({
+                    'savgol_window': window_length,
+                    'savgol_polyorder': polyorder,
+                    'height_fraction': height_fraction,
+                    'tolerance': tolerance,
+                    'measurements': len(self),
+                    'mean_peaks': mean_peaks,
+                    'identified_measurements': int(identified.any(axis=1).sum()),
+                    'identifications': int(identified.sum()),
+                    'distinct_substances': int(identified.any(axis=0).sum()),
+                })
+        return pd.DataFrame(rows)
+
+def run_sweep(measurements, tolerances=DEFAULT_SWEEP_TOLERANCES, savgol_settings=DEFAULT_SWEEP_SAVGOL,
+              height_fractions=DEFAULT_SWEEP_HEIGHT_FRACTIONS, library=None):
+    """
+    Run a parameter sweep over merged measurements, see ParameterSweep.run.
+
+    Returns:
+    - (table, elapsed seconds)
+    """
+    start = time.perf_counter()
+    table = ParameterSweep(measurements, library=library).run(tolerances, savgol_settings, height_fractions)
+    return table, time.perf_counter() - start
+
+def print_sweep_table(table, elapsed=None):
+    """
+    Print the identification counts of every parameter combination.
+    """
+    print(f"\n{'window':>7}{'order':>6}{'height':>8}{'tolerance':>10}{'peaks':>7}{'identified':>12}"
+          f"{'matches':>9}{'substances':>11}")
+    for row in table.itertuples():
+        print(f"{row.savgol_window:>7}{row.savgol_polyorder:>6}{row.height_fraction:>8.3f}{row.tolerance:>10.3f}"
+              f"{row.mean_peaks:>7.1f}{row.identified_measurements:>8}/{row.measurements:<3}"
+              f"{row.identifications:>9}{row.distinct_substances:>11}")
+    if elapsed is not None:
+        print(f"{len(table)} parameter combinations in {elapsed:.2f} s")
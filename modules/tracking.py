@@ -0,0 +1,319 @@
+import numpy as np
+from modules.sqlite_helper import to_iso_timestamp
+
+TRACK_K0_TOLERANCE = 0.02  # Largest K0 difference between a peak and the track it continues
+TRACK_MAX_GAP = 5  # Frames a track may miss before it ends
+TRACK_SMOOTHING = 0.3  # Weight of a new peak in the reference K0 of its track
+POLARITIES = ('pos', 'neg')
+INITIAL_CAPACITY = 1024
+
+class _Columns:
+    """
+    Equal-length NumPy columns that grow by doubling, so appending stays amortized O(1).
+    """
+
+    def __init__(self, dtypes, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.data = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def append(self, count, **values):
+        """
+        Append count rows; values are scalars or arrays of length count. Returns the new rows.
+        """
+        end = self.size + count
+        capacity = len(next(iter(self.data.values())))
+        if end > capacity:
+            capacity = max(end, 2 * capacity)
+            for name, column in self.data.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                self.data[name] = grown
+        for name, value in values.items():
+            self.data[name][self.size:end] = value
+        rows = slice(self.size, end)
+        self.size = end
+        return rows
+
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+    def arrays(self):
+        return {name: column[:self.size] for name, column in self.data.items()}
+
+class PeakTracker:
+    """
+    Links the peaks of consecutive measurements into tracks by nearest-neighbour matching in K0.
+
+    Frames are added one at a time (add), so the tracker can follow a live stream. A
+    peak continues the active track of its polarity with the closest K0 if the difference
+    is at most `tolerance`; when several peaks pick the same track the closest one wins
+    and the others start new tracks. Peaks are compared with a smoothed K0 of the recent
+    peaks of a track, so tracks follow slow drift, and tracks end after `max_gap` frames
+    without a peak.
+    Matching a frame costs O(p log t) for p peaks and t active tracks, so a run is linear
+    in the number of frames.
+
+    Identified substances are recorded per frame with the height of their highest matched
+    peak, the mean offset of the matched K0 values from the library and that peak's track.
+    """
+
+    TRACK_DTYPES = {'polarity': np.int8, 'first_frame': np.int64, 'last_frame': np.int64, 'peaks': np.int64,
+                    'first_k0': np.float64, 'last_k0': np.float64, 'k0_sum': np.float64, 'max_height': np.float64}
+    PEAK_DTYPES = {'frame': np.int64, 'track': np.int64, 'k0': np.float32, 'height': np.float32,
+                   'index': np.int32}
+    SUBSTANCE_DTYPES = {'frame': np.int64, 'substance': np.int32, 'height': np.float32, 'k0_offset': np.float32,
+                        'track': np.int64}
+
+    def __init__(self, tolerance=TRACK_K0_TOLERANCE, max_gap=TRACK_MAX_GAP):
+        """
+        Parameters:
+        - tolerance: Largest K0 difference between consecutive peaks of a track
+        - max_gap: Number of frames a track may miss before it ends
+        """
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self.frames = 0
+        self.times = _Columns({'time': 'datetime64[s]'})
+        self.tracks = _Columns(self.TRACK_DTYPES)
+        self.peaks = _Columns(self.PEAK_DTYPES)
+        self.substance_hits = _Columns(self.SUBSTANCE_DTYPES)
+        self.substance_names = []
+        self._substance_codes = {}
+        # Active tracks per polarity and their reference K0, sorted by K0
+        self._active = {polarity: (np.empty(0, dtype=np.int64), np.empty(0)) for polarity in POLARITIES}
+
+    def __len__(self):
+        return self.frames
+
+    def add(self, result):
+        """
+        Add the next measurement (an analysis.analyze_measurement result).
+
+        Returns:
+        - {polarity: track id of every peak, in the order of peaks_data[polarity]}
+        """
+        peaks_data = result['peaks_data']
+        peak_tracks = {}
+        for polarity in POLARITIES:
+            peaks = peaks_data[polarity]
+            indices = np.fromiter((peak[0] for peak in peaks), dtype=np.int64, count=len(peaks))
+            heights = np.fromiter((peak[1] for peak in peaks), dtype=np.float64, count=len(peaks))
+            peak_tracks[polarity] = self.add_peaks(polarity, peaks_data[f'{polarity}_k0s'], heights, indices)
+
+        for substance in result['identified_substances']:
+            self._add_substance(substance, peaks_data, peak_tracks)
+        self._end_frame(result.get('measurement_time'))
+        return peak_tracks
+
+    def add_peaks(self, polarity, k0_values, heights, indices=None):
+        """
+        Link the peaks of one polarity of the current frame to tracks.
+
+        Call end_frame (or use add) once both polarities of a frame are added.
+
+        Returns:
+        - Track id of every peak
+        """
+        frame = self.frames
+        k0_values = np.asarray(k0_values, dtype=np.float64)
+        heights = np.asarray(heights, dtype=np.float64)
+        indices = -1 if indices is None else indices
+        track_ids, track_k0 = self._active[polarity]
+
+        # Tracks that missed more than max_gap frames have ended
+        alive = self.tracks.data['last_frame'][track_ids] >= frame - self.max_gap - 1
+        if not alive.all():
+            track_ids, track_k0 = track_ids[alive], track_k0[alive]
+
+        assigned = np.full(len(k0_values), -1, dtype=np.int64)
+        if len(track_ids) and len(k0_values):
+            # Nearest active track: the neighbours left and right of the peak in K0 order
+            right = np.minimum(np.searchsorted(track_k0, k0_values), len(track_k0) - 1)
+            left = np.maximum(right - 1, 0)
+            right_distance = np.abs(track_k0[right] - k0_values)
+            left_distance = np.abs(track_k0[left] - k0_values)
+            nearest = np.where(left_distance < right_distance, left, right)
+            distance = np.minimum(left_distance, right_distance)
+            candidates = np.flatnonzero(distance <= self.tolerance)
+            if len(candidates):
+                # Closest peak first; every track takes the first peak that picked it
+                candidates = candidates[np.argsort(distance[candidates], kind='stable')]
+                _, first = np.unique(nearest[candidates], return_index=True)
+                winners = candidates[first]
+                slots = nearest[winners]
+                assigned[winners] = track_ids[slots]
+                # The reference K0 of a track follows its peaks smoothly, so drift is
+                # followed without a single noisy peak moving it far
+                track_k0 = track_k0.copy()
+                track_k0[slots] += TRACK_SMOOTHING * (k0_values[winners] - track_k0[slots])
+
+        new = assigned < 0
+        if new.any():
+            rows = self.tracks.append(int(new.sum()), polarity=POLARITIES.index(polarity), first_frame=frame,
+                                      last_frame=frame, peaks=0, first_k0=k0_values[new], last_k0=0.0, k0_sum=0.0,
+                                      max_height=-np.inf)
+            assigned[new] = np.arange(rows.start, rows.stop)
+
+        if len(assigned):
+            # Every track holds at most one peak per frame, so plain fancy indexing is safe
+            tracks = self.tracks.data
+            tracks['last_frame'][assigned] = frame
+            tracks['last_k0'][assigned] = k0_values
+            tracks['peaks'][assigned] += 1
+            tracks['k0_sum'][assigned] += k0_values
+            tracks['max_height'][assigned] = np.maximum(tracks['max_height'][assigned], heights)
+            self.peaks.append(len(assigned), frame=frame, track=assigned, k0=k0_values, height=heights,
+                              index=indices)
+
+            # Tracks without a peak in this frame stay active until their gap is too long
+            track_ids = np.concatenate([track_ids, assigned[new]])
+            track_k0 = np.concatenate([track_k0, k0_values[new]])
+            order = np.argsort(track_k0, kind='stable')
+            track_ids, track_k0 = track_ids[order], track_k0[order]
+        self._active[polarity] = (track_ids, track_k0)
+        return assigned
+
+    def end_frame(self, measurement_time=None):
+        """
+        Finish the current frame after add_peaks.
+        """
+        self._end_frame(measurement_time)
+
+    def _end_frame(self, measurement_time):
+        if measurement_time is None:
+            self.times.append(1, time=np.datetime64('NaT'))
+            self.frames += 1
+            return
+        try:
+            time = np.datetime64(to_iso_timestamp(measurement_time), 's')
+        except (ValueError, TypeError):
+            time = np.datetime64('NaT')
+        self.times.append(1, time=time)
+        self.frames += 1
+
+    def _add_substance(self, substance, peaks_data, peak_tracks):
+        code = self._substance_codes.get(substance['name'])
+        if code is None:
+            code = self._substance_codes[substance['name']] = len(self.substance_names)
+            self.substance_names.append(substance['name'])
+        best_height, best_track, offsets = -np.inf, -1, []
+        for polarity in POLARITIES:
+            k0s = list(peaks_data[f'{polarity}_k0s'])
+            for _, measured_k0, library_k0 in substance[f'{polarity}_matches']:
+                offsets.append(measured_k0 - library_k0)
+                if measured_k0 in k0s:
+                    position = k0s.index(measured_k0)
+                    height = peaks_data[polarity][position][1]
+                    if height > best_height:
+                        best_height, best_track = height, peak_tracks[polarity][position]
+        self.substance_hits.append(1, frame=self.frames, substance=code, height=best_height,
+                                   k0_offset=np.mean(offsets) if offsets else np.nan, track=best_track)
+
+    def track_table(self, min_peaks=1):
+        """
+        One row per track as NumPy arrays.
+
+        Returns:
+        - Dict with 'track' (id), 'polarity' (0 pos, 1 neg), 'first_frame', 'last_frame',
+          'first_seen', 'last_seen' (datetime64), 'peaks', 'mean_k0', 'k0_drift' (last minus
+          first K0), 'max_height' and 'substance' (number of the substance most often
+          identified with it, -1 if none); only tracks with at least min_peaks peaks
+        """
+        tracks = self.tracks.arrays()
+        keep = np.flatnonzero(tracks['peaks'] >= min_peaks)
+        times = self.times['time']
+        substance = np.full(self.tracks.size, -1, dtype=np.int32)
+        hits = self.substance_hits.arrays()
+        linked = hits['track'] >= 0
+        if linked.any():
+            # Most frequent substance per track: count (track, substance) pairs, keep the largest per track
+            pairs, counts = np.unique(np.stack([hits['track'][linked], hits['substance'][linked]]), axis=1,
+                                      return_counts=True)
+            order = np.lexsort((-counts, pairs[0]))
+            pairs = pairs[:, order]
+            first = np.flatnonzero(np.r_[True, pairs[0, 1:] != pairs[0, :-1]])
+            substance[pairs[0, first]] = pairs[1, first]
+        return {
+            'track': keep,
+            'polarity': tracks['polarity'][keep],
+            'first_frame': tracks['first_frame'][keep],
+            'last_frame': tracks['last_frame'][keep],
+            'first_seen': times[tracks['first_frame'][keep]],
+            'last_seen': times[tracks['last_frame'][keep]],
+            'peaks': tracks['peaks'][keep],
+            'mean_k0': tracks['k0_sum'][keep] / np.maximum(tracks['peaks'][keep], 1),
+            'k0_drift': tracks['last_k0'][keep] - tracks['first_k0'][keep],
+            'max_height': tracks['max_height'][keep],
+            'substance': substance[keep],
+        }
+
+    def track_series(self, track):
+        """
+        Time series of one track: 'frame', 'time', 'k0', 'height' and 'index' arrays.
+        """
+        peaks = self.peaks.arrays()
+        rows = np.flatnonzero(peaks['track'] == track)
+        series = {name: column[rows] for name, column in peaks.items() if name != 'track'}
+        series['time'] = self.times['time'][series['frame']]
+        return series
+
+    def substance_series(self, name):
+        """
+        Time series of an identified substance: 'frame', 'time', 'height' (highest matched
+        peak), 'k0_offset' (mean measured minus library K0) and 'track' arrays. Empty if the
+        substance was never identified.
+        """
+        hits = self.substance_hits.arrays()
+        code = self._substance_codes.get(name, -1)
+        rows = np.flatnonzero(hits['substance'] == code)
+        series = {column: values[rows] for column, values in hits.items() if column != 'substance'}
+        series['time'] = self.times['time'][series['frame']]
+        return series
+
+    def substance_table(self):
+        """
+        One row per identified substance: 'name', 'frames', 'first_seen', 'last_seen',
+        'max_height' and 'mean_k0_offset'.
+        """
+        hits = self.substance_hits.arrays()
+        n = len(self.substance_names)
+        frames = np.bincount(hits['substance'], minlength=n)
+        times = self.times['time'][hits['frame']]
+        first = np.full(n, np.datetime64('NaT'), dtype='datetime64[s]')
+        last = np.full(n, np.datetime64('NaT'), dtype='datetime64[s]')
+        max_height = np.full(n, -np.inf)
+        # Hits are in frame order: the first occurrence of a substance is its first frame
+        _, first_rows = np.unique(hits['substance'], return_index=True)
+        _, last_rows = np.unique(hits['substance'][::-1], return_index=True)
+        codes = hits['substance'][first_rows]
+        first[codes] = times[first_rows]
+        last[codes] = times[len(times) - 1 - last_rows]
+        np.maximum.at(max_height, hits['substance'], hits['height'])
+        offsets = np.bincount(hits['substance'], weights=np.nan_to_num(hits['k0_offset']), minlength=n)
+        return {'name': np.array(self.substance_names, dtype=str), 'frames': frames, 'first_seen': first,
+                'last_seen': last, 'max_height': max_height, 'mean_k0_offset': offsets / np.maximum(frames, 1)}
+
+    def save(self, path):
+        """
+        Write the peaks, tracks, substance hits and frame times to an .npz file.
+        """
+        arrays = {'time': self.times['time'], 'substance_names': np.array(self.substance_names, dtype=str)}
+        for prefix, columns in (('peak', self.peaks), ('track', self.tracks), ('substance', self.substance_hits)):
+            arrays.update({f'{prefix}_{name}': column for name, column in columns.arrays().items()})
+        np.savez(path, **arrays)
+
+def print_track_summary(tracker, min_peaks=2):
+    """
+    Print the number of tracks and one line per identified substance.
+    """
+    tracks = tracker.track_table(min_peaks=min_peaks)
+    print(f"\nTracked {len(tracker.peaks['frame'])} peaks of {len(tracker)} measurements in "
+          f"{tracker.tracks.size} tracks ({len(tracks['track'])} with at least {min_peaks} peaks)")
+    table = tracker.substance_table()
+    if not len(table['name']):
+        return
+    print(f"{'substance':<20}{'frames':>8}  {'first seen':<21}{'last seen':<21}{'max height':>11}{'K0 offset':>11}")
+    for row in np.argsort(-table['frames'], kind='stable'):
+        print(f"{table['name'][row]:<20}{table['frames'][row]:>8}  {str(table['first_seen'][row]):<21}"
+              f"{str(table['last_seen'][row]):<21}{table['max_height'][row]:>11.1f}"
+              f"{table['mean_k0_offset'][row]:>11.4f}")
@@ -1,207 +1,341 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.widgets import Slider
+from matplotlib.widgets import Slider, TextBox
+from modules.sqlite_helper import to_iso_timestamp
 
 # Constants for annotation and visualization
 K0_ANNOTATION_OFFSET = (0, 10)
 SUBSTANCE_ANNOTATION_OFFSET = (0, 25)
 K0_MATCH_TOLERANCE = 0.02
 PEAK_MARKER_SIZE = 50
+Y_HEADROOM = 0.15  # Fraction of the intensity range kept free above the highest point for labels
+PAGE_STEP = 10  # Measurements skipped with page up/down
+OVERVIEW_COLORMAP = 'viridis'
+OVERVIEW_MARKER_SIZE = 12
+OVERVIEW_TIME_TICKS = 6
+
+POLARITIES = {
+    'pos': {'title': 'Positive Spectrum', 'color': 'blue'},
+    'neg': {'title': 'Negative Spectrum', 'color': 'green'},
+}
+
+def measurement_annotations(data, polarity):
+    """
+    Precompute the peak markers and labels of one polarity of a measurement.
+
+    Parameters:
+    - data: Measurement dictionary ('spectrums', 'peaks_data', 'identified_substances')
+    - polarity: 'pos' or 'neg'
+
+    Returns:
+    - Dictionary with 'peaks' (N x 2 array of index, height), 'k0_labels' and
+      'substance_labels' (lists of (x, y, text))
+    """
+    peaks_data = data['peaks_data']
+    peaks = peaks_data.get(polarity)
+    k0s = peaks_data.get(f'{polarity}_k0s')
+    if peaks is None or k0s is None:
+        peaks, k0s = [], []
+    identified_substances = data.get('identified_substances') or []
+
+    k0_labels = []
+    substance_labels = []
+    for (idx, height), k0 in zip(peaks, k0s):
+        k0_labels.append((idx, height, f"K0: {k0:.3f}"))
+        # Mark identified substances
+        for substance in identified_substances:
+            for match in substance[f'{polarity}_matches']:
+                if abs(k0 - match[2]) <= K0_MATCH_TOLERANCE:
+                    substance_labels.append((idx, height, f"{substance['name']}"))
+
+    return {
+        'peaks': np.asarray(peaks, dtype=np.float64).reshape(-1, 2),
+        'k0_labels': k0_labels,
+        'substance_labels': substance_labels,
+    }
+
+def _intensity_limits(spectrum):
+    low, high = float(np.min(spectrum)), float(np.max(spectrum))
+    span = high - low or 1.0
+    return low - 0.02 * span, high + Y_HEADROOM * span
+
+class SpectrumPanels:
+    """
+    Positive and negative spectrum axes whose artists are created once and updated in place.
+
+    Lines, peak markers and labels are reused between measurements; label artists are
+    pooled and hidden when a measurement needs fewer of them.
+    """
+
+    def __init__(self, fig, ax_pos, ax_neg, animated=False):
+        """
+        Parameters:
+        - fig: Figure holding the axes
+        - ax_pos, ax_neg: Axes for the positive and negative spectrum
+        - animated: Mark the changing artists as animated for blitting
+        """
+        self.fig = fig
+        self.animated = animated
+        self.axes = {'pos': ax_pos, 'neg': ax_neg}
+        self.lines = {}
+        self.markers = {}
+        self.k0_labels = {'pos': [], 'neg': []}
+        self.substance_labels = {'pos': [], 'neg': []}
+
+        for polarity, ax in self.axes.items():
+            style = POLARITIES[polarity]
+            self.lines[polarity], = ax.plot([], [], color=style['color'], label=style['title'], animated=animated)
+            self.markers[polarity] = ax.scatter(np.empty(0), np.empty(0), color='red', s=PEAK_MARKER_SIZE, marker='x',
+                                                label='Peaks', animated=animated)
+            ax.set_title(style['title'])
+            ax.set_xlabel('Index')
+            ax.set_ylabel('Intensity')
+            ax.legend(loc='upper right')
+            ax.grid(True)
+
+        self.title = fig.suptitle("", fontsize=16, animated=animated)
+
+    def _label(self, pool, polarity, index, offset, **style):
+        while len(pool) <= index:
+            pool.append(self.axes[polarity].annotate("", (0, 0), textcoords="offset points", xytext=offset,
+                                                     ha='center', animated=self.animated, **style))
+        return pool[index]
+
+    def _update_labels(self, pool, polarity, labels, offset, **style):
+        for i, (x, y, label) in enumerate(labels):
+            annotation = self._label(pool, polarity, i, offset, **style)
+            annotation.xy = (x, y)
+            annotation.set_text(label)
+            annotation.set_visible(True)
+        for annotation in pool[len(labels):]:
+            annotation.set_visible(False)
+
+    def update(self, data, annotations=None, limits=None):
+        """
+        Show a measurement.
+
+        Parameters:
+        - data: Measurement dictionary
+        - annotations: Precomputed {'pos': ..., 'neg': ...} from measurement_annotations
+        - limits: Optional {'pos': (xlim, ylim), 'neg': ...}; the axes are fitted to the
+          measurement if None
+        """
+        if annotations is None:
+            annotations = {polarity: measurement_annotations(data, polarity) for polarity in self.axes}
+
+        for polarity, ax in self.axes.items():
+            spectrum = data['spectrums'].get(polarity)
+            if spectrum is None or len(spectrum) == 0:
+                self.lines[polarity].set_data([], [])
+            else:
+                self.lines[polarity].set_data(np.arange(len(spectrum)), spectrum)
+                if limits is None:
+                    ax.set_xlim(0, len(spectrum) - 1)
+                    ax.set_ylim(*_intensity_limits(spectrum))
+            if limits is not None:
+                ax.set_xlim(*limits[polarity][0])
+                ax.set_ylim(*limits[polarity][1])
+
+            layout = annotations[polarity]
+            self.markers[polarity].set_offsets(layout['peaks'])
+            self._update_labels(self.k0_labels[polarity], polarity, layout['k0_labels'], K0_ANNOTATION_OFFSET)
+            self._update_labels(self.substance_labels[polarity], polarity, layout['substance_labels'],
+                                SUBSTANCE_ANNOTATION_OFFSET, color='green', weight='bold')
+
+        self.title.set_text(f"Measurement Time: {data['measurement_time']}")
+
+    def animated_artists(self):
+        artists = [self.title]
+        for polarity in self.axes:
+            artists.append(self.lines[polarity])
+            artists.append(self.markers[polarity])
+            artists.extend(a for a in self.k0_labels[polarity] if a.get_visible())
+            artists.extend(a for a in self.substance_labels[polarity] if a.get_visible())
+        return artists
 
 def create_spectrum_plot(spectrums, peaks_data, identified_substances=None):
     """
     Create a plot showing spectra with peaks and identified substances.
-    
+
     Parameters:
     - spectrums: dictionary with 'pos' and 'neg' arrays
     - peaks_data: dictionary with 'pos' and 'neg' peak information (index, height)
     - identified_substances: list of identified substances with their K0 matches
     """
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
-    
-    # Plot positive spectrum
-    if 'pos' in spectrums and spectrums['pos'] is not None and len(spectrums['pos']) > 0:
-        ax1.plot(spectrums['pos'], color='blue', label='Positive Spectrum')
-        
-        if 'pos' in peaks_data and peaks_data['pos']:
-            peak_indices = [p[0] for p in peaks_data['pos']]
-            peak_heights = [p[1] for p in peaks_data['pos']]
-            ax1.scatter(peak_indices, peak_heights, color='red', s=PEAK_MARKER_SIZE, marker='x', label='Peaks')
-            
-            # Annotate peaks with K0 values
-            for i, (idx, height) in enumerate(zip(peak_indices, peak_heights)):
-                ax1.annotate(f"K0: {peaks_data['pos_k0s'][i]:.3f}", 
-                            (idx, height),
-                            textcoords="offset points", 
-                            xytext=K0_ANNOTATION_OFFSET,
-                            ha='center')
-                
-                # Mark identified substances
-                if identified_substances:
-                    for substance in identified_substances:
-                        for match in substance['pos_matches']:
-                            if abs(peaks_data['pos_k0s'][i] - match[2]) <= K0_MATCH_TOLERANCE:
-                                ax1.annotate(f"{substance['name']}", 
-                                           (idx, height),
-                                           textcoords="offset points", 
-                                           xytext=SUBSTANCE_ANNOTATION_OFFSET,
-                                           ha='center', 
-                                           color='green',
-                                           weight='bold')
-    
-    # Plot negative spectrum
-    if 'neg' in spectrums and spectrums['neg'] is not None and len(spectrums['neg']) > 0:
-        ax2.plot(spectrums['neg'], color='green', label='Negative Spectrum')
-        
-        if 'neg' in peaks_data and peaks_data['neg']:
-            peak_indices = [p[0] for p in peaks_data['neg']]
-            peak_heights = [p[1] for p in peaks_data['neg']]
-            ax2.scatter(peak_indices, peak_heights, color='red', s=PEAK_MARKER_SIZE, marker='x', label='Peaks')
-            
-            # Annotate peaks with K0 values
-            for i, (idx, height) in enumerate(zip(peak_indices, peak_heights)):
-                ax2.annotate(f"K0: {peaks_data['neg_k0s'][i]:.3f}", 
-                            (idx, height),
-                            textcoords="offset points", 
-                            xytext=K0_ANNOTATION_OFFSET,
-                            ha='center')
-                
-                # Mark identified substances
-                if identified_substances:
-                    for substance in identified_substances:
-                        for match in substance['neg_matches']:
-                            if abs(peaks_data['neg_k0s'][i] - match[2]) <= K0_MATCH_TOLERANCE:
-                                ax2.annotate(f"{substance['name']}", 
-                                           (idx, height),
-                                           textcoords="offset points", 
-                                           xytext=SUBSTANCE_ANNOTATION_OFFSET,
-                                           ha='center', 
-                                           color='green',
-                                           weight='bold')
-    
-    ax1.set_title('Positive Spectrum')
-    ax1.set_xlabel('Index')
-    ax1.set_ylabel('Intensity')
-    ax1.legend()
-    ax1.grid(True)
-    
-    ax2.set_title('Negative Spectrum')
-    ax2.set_xlabel('Index')
-    ax2.set_ylabel('Intensity')
-    ax2.legend()
-    ax2.grid(True)
-    
+    panels = SpectrumPanels(fig, ax1, ax2)
+    panels.update({'measurement_time': '', 'spectrums': spectrums, 'peaks_data': peaks_data,
+                   'identified_substances': identified_substances})
+    panels.title.set_text('')
+
     plt.tight_layout()
     return fig
 
-def show_scrollable_plots(data_list):
+def padded_limits(length, low, high):
+    """
+    Axis limits for spectra of the given length and intensity range, with room for labels.
+    """
+    span = high - low or 1.0
+    return (0, length - 1), (low - 0.02 * span, high + Y_HEADROOM * span)
+
+def _global_limits(data_list):
+    """
+    Axis limits covering every measurement, so the background can stay fixed while blitting.
+
+    Sequences with an intensity_ranges() method (e.g. archive.ArchiveMeasurements)
+    provide the ranges themselves instead of being scanned.
+    """
+    if hasattr(data_list, 'intensity_ranges'):
+        return {polarity: padded_limits(*bounds) for polarity, bounds in data_list.intensity_ranges().items()}
+
+    limits = {}
+    for polarity in POLARITIES:
+        length, low, high = 1, np.inf, -np.inf
+        for data in data_list:
+            spectrum = data['spectrums'].get(polarity)
+            if spectrum is not None and len(spectrum):
+                length = max(length, len(spectrum))
+                low = min(low, float(np.min(spectrum)))
+                high = max(high, float(np.max(spectrum)))
+        if not np.isfinite(low):
+            low, high = 0.0, 1.0
+        limits[polarity] = padded_limits(length, low, high)
+    return limits
+
+def _time_index(data_list):
+    """
+    Sorted ISO timestamps and the matching measurement positions, for jumping to a time.
+    """
+    if hasattr(data_list, 'time_index'):
+        return data_list.time_index()
+    timestamps = []
+    for data in data_list:
+        try:
+            timestamps.append(to_iso_timestamp(data['measurement_time']))
+        except ValueError:
+            timestamps.append('')
+    timestamps = np.asarray(timestamps)
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], order
+
+def show_campaign_overview(overview, on_select=None, reduction='max'):
+    """
+    Open a time x drift index heatmap of every measurement, one panel per polarity.
+
+    The rows come from the overview pyramid at the resolution of the axes, so zooming in
+    (toolbar) shows finer rows without drawing more than one row per pixel. Identified
+    substances are marked at the drift index of their peak.
+
+    Parameters:
+    - overview: overview.CampaignOverview
+    - on_select: Called with the measurement position of a click into a panel
+    - reduction: 'max' (peaks stay visible) or 'mean' of the decimated spectra
+
+    Returns:
+    - Function that moves the cursor line of both panels to a measurement position
+    """
+    fig, axes = plt.subplots(2, 1, figsize=(14, 8), sharex=True)
+    fig.suptitle(f"Campaign overview: {len(overview)} measurements, {len(overview.substances)} identified substances")
+    images = {}
+    cursors = []
+    state = {'updating': False}
+
+    for polarity, ax in zip(POLARITIES, axes):
+        rows, start, stop = overview.image(polarity, reduction=reduction)
+        images[polarity] = ax.imshow(rows.T, aspect='auto', origin='lower', interpolation='nearest',
+                                     cmap=OVERVIEW_COLORMAP, extent=(start, stop, 0, rows.shape[1]),
+                                     clim=overview.intensity_limits(polarity, reduction))
+        positions, indices, _ = overview.marker_positions(polarity)
+        ax.scatter(positions, indices, color='red', marker='x', s=OVERVIEW_MARKER_SIZE, linewidths=0.8,
+                   label='Identified substances')
+        cursors.append(ax.axvline(0, color='white', linewidth=1))
+        ax.set_title(POLARITIES[polarity]['title'])
+        ax.set_ylabel('Index')
+        ax.set_xlim(0, len(overview))
+        ax.legend(loc='upper right')
+        fig.colorbar(images[polarity], ax=ax, label=f'Intensity ({reduction})')
+    axes[-1].set_xlabel('Measurement time')
+    axes[-1].xaxis.set_major_locator(plt.MaxNLocator(OVERVIEW_TIME_TICKS))
+    axes[-1].xaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: overview.time_at(x)))
+    fig.autofmt_xdate()
+
+    def on_xlim_changed(ax):
+        # The panels share the x axis, so both are updated from the first callback
+        if state['updating']:
+            return
+        state['updating'] = True
+        start, stop = sorted(ax.get_xlim())
+        pixels = max(1, int(ax.get_window_extent().width))
+        for polarity, image in images.items():
+            rows, first, last = overview.image(polarity, max(0, start), min(len(overview), stop), pixels, reduction)
+            image.set_data(rows.T)
+            image.set_extent((first, last, 0, rows.shape[1]))
+        state['updating'] = False
+
+    def on_click(event):
+        # Clicks while zooming or panning with the toolbar don't select a measurement
+        if on_select is None or event.inaxes not in axes or fig.canvas.toolbar and fig.canvas.toolbar.mode:
+            return
+        on_select(int(np.clip(event.xdata, 0, len(overview) - 1)))
+
+    def move_cursor(position):
+        for cursor in cursors:
+            cursor.set_xdata([position + 0.5, position + 0.5])
+        fig.canvas.draw_idle()
+
+    axes[0].callbacks.connect('xlim_changed', on_xlim_changed)
+    fig.canvas.mpl_connect('button_press_event', on_click)
+    return move_cursor
+
+def show_scrollable_plots(data_list, autoscale=False, overview=None):
     """
     Create a scrollable interface to navigate through multiple spectrum plots.
-    
+
     Parameters:
-    - data_list: List of dictionaries containing spectrum data for each measurement
+    - data_list: List of dictionaries containing spectrum data for each measurement, or a
+      sequence that produces them on access (archive.ArchiveMeasurements)
+    - autoscale: Fit the axes to every measurement instead of using fixed limits for the
+      whole data set. Fixed limits allow blitting, which keeps scrolling fast.
+    - overview: Optional overview.CampaignOverview of data_list, shown in a second window
+      (show_campaign_overview); clicking into it jumps to the measurement
+
+    Keys: left/right step one measurement, page up/down (or up/down) step PAGE_STEP,
+    home/end jump to the first/last measurement. The text box jumps to the first
+    measurement at or after a time ('2012-11-12 12:30', '12.11.2012 12:30:00') or to a
+    position ('#42').
     """
     if not data_list:
         print("No data to display")
         return
-    
+
     # Create a figure that will persist
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
     # Slider position adjustment
     SLIDER_BOTTOM_MARGIN = 0.15
     plt.subplots_adjust(bottom=SLIDER_BOTTOM_MARGIN)
-    
-    # Function to update the plot
-    def update_plot(idx):
-        ax1.clear()
-        ax2.clear()
-        
-        current_data = data_list[idx]
-        
-        # Plot positive spectrum
-        if current_data['spectrums']['pos'] is not None:
-            pos_spectrum = current_data['spectrums']['pos']
-            ax1.plot(pos_spectrum, color='blue', label='Positive Spectrum')
-            
-            if current_data['peaks_data']['pos']:
-                peak_indices = [p[0] for p in current_data['peaks_data']['pos']]
-                peak_heights = [p[1] for p in current_data['peaks_data']['pos']]
-                ax1.scatter(peak_indices, peak_heights, color='red', s=PEAK_MARKER_SIZE, marker='x', label='Peaks')
-                
-                # Annotate peaks with K0 values
-                for i, (idx, height) in enumerate(zip(peak_indices, peak_heights)):
-                    ax1.annotate(f"K0: {current_data['peaks_data']['pos_k0s'][i]:.3f}", 
-                                (idx, height),
-                                textcoords="offset points", 
-                                xytext=K0_ANNOTATION_OFFSET,
-                                ha='center')
-                    
-                    # Mark identified substances
-                    if current_data['identified_substances']:
-                        for substance in current_data['identified_substances']:
-                            for match in substance['pos_matches']:
-                                if abs(current_data['peaks_data']['pos_k0s'][i] - match[2]) <= K0_MATCH_TOLERANCE:
-                                    ax1.annotate(f"{substance['name']}", 
-                                               (idx, height),
-                                               textcoords="offset points", 
-                                               xytext=SUBSTANCE_ANNOTATION_OFFSET,
-                                               ha='center', 
-                                               color='green',
-                                               weight='bold')
-        
-        # Plot negative spectrum
-        if current_data['spectrums']['neg'] is not None:
-            neg_spectrum = current_data['spectrums']['neg']
-            ax2.plot(neg_spectrum, color='green', label='Negative Spectrum')
-            
-            if current_data['peaks_data']['neg']:
-                peak_indices = [p[0] for p in current_data['peaks_data']['neg']]
-                peak_heights = [p[1] for p in current_data['peaks_data']['neg']]
-                ax2.scatter(peak_indices, peak_heights, color='red', s=PEAK_MARKER_SIZE, marker='x', label='Peaks')
-                
-                # Annotate peaks with K0 values
-                for i, (idx, height) in enumerate(zip(peak_indices, peak_heights)):
-                    ax2.annotate(f"K0: {current_data['peaks_data']['neg_k0s'][i]:.3f}", 
-                                (idx, height),
-                                textcoords="offset points", 
-                                xytext=K0_ANNOTATION_OFFSET,
-                                ha='center')
-                    
-                    # Mark identified substances
-                    if current_data['identified_substances']:
-                        for substance in current_data['identified_substances']:
-                            for match in substance['neg_matches']:
-                                if abs(current_data['peaks_data']['neg_k0s'][i] - match[2]) <= K0_MATCH_TOLERANCE:
-                                    ax2.annotate(f"{substance['name']}", 
-                                               (idx, height),
-                                               textcoords="offset points", 
-                                               xytext=SUBSTANCE_ANNOTATION_OFFSET,
-                                               ha='center', 
-                                               color='green',
-                                               weight='bold')
-        
-        ax1.set_title('Positive Spectrum')
-        ax1.set_xlabel('Index')
-        ax1.set_ylabel('Intensity')
-        ax1.legend()
-        ax1.grid(True)
-        
-        ax2.set_title('Negative Spectrum')
-        ax2.set_xlabel('Index')
-        ax2.set_ylabel('Intensity')
-        ax2.legend()
-        ax2.grid(True)
-        
-        fig.suptitle(f"Measurement Time: {current_data['measurement_time']}", fontsize=16)
-        fig.canvas.draw_idle()
-    
-    # Initial plot
-    update_plot(0)
-    
+
+    use_blit = fig.canvas.supports_blit and not autoscale
+    panels = SpectrumPanels(fig, ax1, ax2, animated=use_blit)
+    limits = None if autoscale else _global_limits(data_list)
+
+    # Precompute marker positions and labels so the slider callback only moves artists.
+    # Lazy sequences (e.g. an archive) are annotated on first display instead.
+    annotations = {}
+
+    def annotations_for(idx):
+        if idx not in annotations:
+            annotations[idx] = {polarity: measurement_annotations(data_list[idx], polarity) for polarity in POLARITIES}
+        return annotations[idx]
+
+    if isinstance(data_list, list):
+        for idx in range(len(data_list)):
+            annotations_for(idx)
+    state = {'background': None, 'time_index': None}
+
     # Add slider
     SLIDER_X_POSITION = 0.25
     SLIDER_Y_POSITION = 0.05
-    SLIDER_WIDTH = 0.65
+    SLIDER_WIDTH = 0.45
     SLIDER_HEIGHT = 0.03
     ax_slider = plt.axes([SLIDER_X_POSITION, SLIDER_Y_POSITION, SLIDER_WIDTH, SLIDER_HEIGHT])
     slider = Slider(
@@ -212,10 +346,86 @@ def show_scrollable_plots(data_list):
         valinit=0,
         valstep=1
     )
-    
+
+    TEXTBOX_X_POSITION = 0.8
+    TEXTBOX_WIDTH = 0.15
+    ax_jump = plt.axes([TEXTBOX_X_POSITION, SLIDER_Y_POSITION, TEXTBOX_WIDTH, SLIDER_HEIGHT])
+    jump_box = TextBox(ax_jump, 'Jump to ')
+
+    def draw_animated():
+        for artist in panels.animated_artists():
+            fig.draw_artist(artist)
+
+    def blit():
+        canvas = fig.canvas
+        canvas.restore_region(state['background'])
+        draw_animated()
+        fig.draw_artist(ax_slider)
+        canvas.blit(fig.bbox)
+        canvas.flush_events()
+
+    def on_draw(event):
+        # A full redraw (first show, resize) renders everything but the animated artists
+        if use_blit:
+            state['background'] = fig.canvas.copy_from_bbox(fig.bbox)
+            draw_animated()
+
+    move_overview_cursor = None
+    if overview is not None:
+        move_overview_cursor = show_campaign_overview(
+            overview, on_select=lambda position: slider.set_val(min(position, len(data_list) - 1)))
+
+    # Function to update the plot
+    def update_plot(idx):
+        panels.update(data_list[idx], annotations_for(idx), limits)
+        if use_blit and state['background'] is not None:
+            blit()
+        else:
+            fig.canvas.draw_idle()
+        if move_overview_cursor is not None:
+            move_overview_cursor(idx)
+
+    # Initial plot
+    update_plot(0)
+
     # Connect the slider to the update function
     def update(val):
         update_plot(int(slider.val))
-    
+
+    def step(delta):
+        slider.set_val(int(np.clip(int(slider.val) + delta, 0, len(data_list) - 1)))
+
+    def on_key(event):
+        steps = {'right': 1, 'left': -1, 'pageup': PAGE_STEP, 'pagedown': -PAGE_STEP, 'up': PAGE_STEP,
+                 'down': -PAGE_STEP, 'home': -len(data_list), 'end': len(data_list)}
+        # Typing into the jump box must not move the slider
+        if event.key in steps and not jump_box.capturekeystrokes:
+            step(steps[event.key])
+
+    def on_jump(text):
+        text = text.strip()
+        if not text:
+            return
+        if text.startswith('#') or text.isdigit():
+            target = int(text.lstrip('#'))
+        else:
+            try:
+                timestamp = to_iso_timestamp(text)
+            except ValueError:
+                print(f"Unrecognized time: {text}")
+                return
+            if state['time_index'] is None:
+                state['time_index'] = _time_index(data_list)
+            timestamps, order = state['time_index']
+            position = min(np.searchsorted(timestamps, timestamp, side='left'), len(order) - 1)
+            target = int(order[position])
+        slider.set_val(int(np.clip(target, 0, len(data_list) - 1)))
+
     slider.on_changed(update)
+    if use_blit:
+        # The slider is redrawn as part of the blit instead of a full canvas redraw
+        slider.drawon = False
+    fig.canvas.mpl_connect('draw_event', on_draw)
+    fig.canvas.mpl_connect('key_press_event', on_key)
+    jump_box.on_submit(on_jump)
     plt.show()
@@ -0,0 +1,26 @@
+"""
+Core timings of benchmarks.run_suite as pytest-benchmark cases.
+
+Run from the repository root, optionally saving the results for comparison:
+    python -m pytest tests/test_benchmarks.py --benchmark-json bench.json
+    python -m pytest tests/test_benchmarks.py --benchmark-only --benchmark-compare
+"""
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmarks.run_suite import CASES, Pool
+
+SCALES = [100, 1000]
+POOL_SIZE = 200
+BENCHMARK_CASES = ['parse_binary', 'peaks', 'k0', 'matching', 'pairing', 'ingest']
+
+@pytest.fixture(scope='module')
+def pool():
+    return Pool(size=POOL_SIZE)
+
+@pytest.mark.parametrize('scale', SCALES)
+@pytest.mark.parametrize('case', BENCHMARK_CASES)
+def test_case(benchmark, pool, case, scale):
+    benchmark.extra_info['spectra'] = scale
+    benchmark.pedantic(CASES[case](pool, scale), rounds=3, iterations=1)
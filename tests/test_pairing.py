@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from benchmarks.bench_pairing import legacy_merge_loop
+from modules.pairing import pair_positions, pair_polarities
+from modules.spectrum_codec import encode_spectrum
+
+def masks(pattern):
+    """
+    Polarity masks from a pattern string: b = both, p = positive only, n = negative only,
+    e = empty.
+    """
+    return [c in 'bp' for c in pattern], [c in 'bn' for c in pattern]
+
+def test_consecutive_negative_rows():
+    pos_rows, neg_rows, unpaired = pair_positions(*masks('pnnb'))
+    assert pos_rows.tolist() == [0, 3]
+    assert neg_rows.tolist() == [1, 3]
+    assert unpaired.tolist() == [2]
+
+def test_trailing_positive_row_is_dropped():
+    pos_rows, neg_rows, unpaired = pair_positions(*masks('bpnp'))
+    assert pos_rows.tolist() == [0, 1]
+    assert neg_rows.tolist() == [0, 2]
+    assert unpaired.tolist() == [3]
+
+def test_rows_between_a_pair_are_skipped():
+    pos_rows, neg_rows, unpaired = pair_positions(*masks('pbepn'))
+    assert pos_rows.tolist() == [0]
+    assert neg_rows.tolist() == [4]
+    assert unpaired.tolist() == [1, 2, 3]
+
+def test_empty_input():
+    pos_rows, neg_rows, unpaired = pair_positions([], [])
+    assert len(pos_rows) == len(neg_rows) == len(unpaired) == 0
+
+def test_matches_legacy_merge_loop():
+    rng = np.random.default_rng(42)
+    spectra = rng.uniform(1, 100, (200, 16)).astype(np.float32)
+    empty = encode_spectrum(np.zeros(16, dtype=np.float32))
+    kinds = rng.choice(list('bpne'), size=200, p=[0.2, 0.35, 0.35, 0.1])
+    df = pd.DataFrame({
+        'id': np.arange(1, 201),
+        'pos_spectrum': [encode_spectrum(s) if k in 'bp' else empty for s, k in zip(spectra, kinds)],
+        'neg_spectrum': [encode_spectrum(s[::-1]) if k in 'bn' else empty for s, k in zip(spectra, kinds)],
+    })
+
+    merged, _ = pair_polarities(df)
+    expected = legacy_merge_loop(df)
+    assert merged['id'].tolist() == [row['id'] for row in expected]
+    assert merged['neg_spectrum'].tolist() == [row['neg_spectrum'] for row in expected]